@@ -0,0 +1,74 @@
+""" Benchmark the dask graph of long series and of series written as many numbered files.
+
+For each series the ingest time (composing all documents of the run), the number of layers and
+tasks in the dask graph, and the time to slice out and compute one frame are reported:
+
+    - long: one SER file with --frames small frames
+    - files: --files MRC files of 2 frames each, ingested as one run
+
+The graph is one blockwise layer over a frames.FrameSource in both cases, so building and slicing
+it should not grow with the number of frames or files beyond the number of dask blocks.
+
+Usage:
+    python benchmarks/graph_size.py --frames 100000 --files 1000 --output graph.json
+
+"""
+
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+import synthetic  # noqa: F401 (puts the test writers on the path)
+
+
+def measure(ingest, paths):
+    t0 = time.perf_counter()
+    docs = list(ingest(paths))
+    ingest_seconds = time.perf_counter() - t0
+    dask_data = docs[2][1]['data']['raw']
+
+    t0 = time.perf_counter()
+    dask_data[len(dask_data) // 2].compute(scheduler='synchronous')
+    slice_seconds = time.perf_counter() - t0
+    return {'frames': len(dask_data), 'ingest': ingest_seconds, 'slice': slice_seconds,
+            'layers': len(dask_data.dask.layers), 'blocks': dask_data.npartitions}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=100000)
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    from ncempy.io import mrc
+    from writers import write_ser
+    from xicam.NCEM.ingestors.MRCPlugin import ingest_NCEM_MRC
+    from xicam.NCEM.ingestors.SERPlugin import ingest_NCEM_SER
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = str(Path(directory) / 'long_1.ser')
+        write_ser(path, np.zeros((args.frames, 8, 8), dtype='<u2'))
+        results['long'] = measure(ingest_NCEM_SER, [path])
+
+        paths = [str(Path(directory) / 'series_{}.mrc'.format(ii)) for ii in range(args.files)]
+        for path in paths:
+            mrc.mrcWriter(path, np.zeros((2, 64, 64), dtype='<u2'), (1, 1, 1))
+        results['files'] = measure(ingest_NCEM_MRC, paths)
+
+    for name, result in results.items():
+        print('{:>6}: {frames:7d} frames, ingest {ingest:8.3f} s, slice {slice:8.4f} s, {layers} layers, '
+              '{blocks} blocks'.format(name, **result))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
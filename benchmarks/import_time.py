@@ -0,0 +1,56 @@
+""" Benchmark the time to import the NCEM entry points in a fresh interpreter.
+
+Databroker and Xi-cam import these modules through the entry points in setup.py. The ingestors,
+sniffers and handlers must import without Qt and defer dask, ncempy and event_model until they
+are used (see xicam.NCEM.ingestors.lazy). The GUI plugin is listed for comparison.
+
+Usage:
+    python benchmarks/import_time.py --repeat 5 --output imports.json
+
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+MODULES = {'ingestors': ['xicam.NCEM.ingestors.DMPlugin', 'xicam.NCEM.ingestors.EMDPlugin',
+                         'xicam.NCEM.ingestors.MRCPlugin', 'xicam.NCEM.ingestors.SERPlugin',
+                         'xicam.NCEM.ingestors.TIFPlugin', 'xicam.NCEM.ingestors.ZarrPlugin'],
+           'sniffers': ['xicam.NCEM.ingestors.sniffers'],
+           'gui': ['xicam.NCEM.plugin']}
+
+
+def import_time(modules):
+    """ Seconds to import modules in a new interpreter and the number of modules it loaded"""
+    code = ('import json, sys, time\n'
+            'before = len(sys.modules)\n'
+            't0 = time.perf_counter()\n'
+            'for name in {!r}:\n'
+            '    __import__(name)\n'
+            'print(json.dumps([time.perf_counter() - t0, len(sys.modules) - before]))').format(modules)
+    out = subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.PIPE,
+                         stderr=subprocess.DEVNULL).stdout
+    return json.loads(out.decode().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = {}
+    for name, modules in MODULES.items():
+        runs = [import_time(modules) for _ in range(args.repeat)]
+        results[name] = {'seconds': statistics.median(seconds for seconds, _ in runs), 'modules': runs[0][1]}
+        print('{:>10}: {:8.3f} s {:6d} modules'.format(name, results[name]['seconds'], results[name]['modules']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+""" Benchmark every NCEM ingestor and the viewer hot paths on synthetic files.
+
+A file of --frames frames of --size x --size uint16 pixels is written for each format (see
+synthetic.py). Each format is then measured in a fresh process with an empty metadata cache:
+
+    - ingest: seconds to compose all documents of the run (the data stays lazy)
+    - first_frame: seconds from the start of ingest until the first frame is in memory
+    - random_frame: median seconds to read one frame at a random index
+    - throughput: MB/s reading every frame in order, one dask block at a time
+    - peak_rss: peak resident memory of the process in MB, and the increase over the baseline
+      after imports (peak_rss_delta)
+
+The viewer benchmarks time the steps of drawing a large frame: the coarsest pyramid level, one
+full resolution tile and a thumbnail.
+
+Results are printed as a table and written as JSON so they can be compared across releases:
+
+    python benchmarks/ingest.py --frames 100 --size 1024 --output results.json
+
+Notes:
+    - Files are read right after they are written so they are in the OS page cache. The numbers
+      measure the ingestors, not the disk.
+
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+import synthetic
+
+INGESTORS = {'emd': 'EMDPlugin:ingest_NCEM_EMD',
+             'velox': 'EMDPlugin:ingest_NCEM_EMD_VELOX',
+             'mrc': 'MRCPlugin:ingest_NCEM_MRC',
+             'tif': 'TIFPlugin:ingest_NCEM_TIF',
+             'ser': 'SERPlugin:ingest_NCEM_SER',
+             'dm4': 'DMPlugin:ingest_NCEM_DM',
+             'zarr': 'ZarrPlugin:ingest_NCEM_ZARR'}
+
+
+def _peak_rss():
+    """ Peak resident memory of this process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024  # bytes on macOS, kB on Linux
+
+
+def _ingestor(fmt):
+    import importlib
+
+    module, name = INGESTORS[fmt].split(':')
+    return getattr(importlib.import_module('xicam.NCEM.ingestors.' + module), name)
+
+
+def _import_lazy_modules(ingest):
+    """ Import the modules that the ingestor and the frame sources bind to lazy proxies, so that
+    the first use of a module is not timed as part of the ingest."""
+    from xicam.NCEM.ingestors import frames, lazy
+
+    for module in (sys.modules[ingest.__module__], frames):
+        for value in vars(module).values():
+            if isinstance(value, lazy.LazyModule) and value:
+                value._load()
+
+
+def _frames(docs):
+    data = next(doc for name, doc in docs if name == 'event')['data']['raw']
+    return data.reshape((-1, *data.shape[-2:]))
+
+
+def measure_ingestor(fmt, path, cache_dir, reads=20):
+    """ Time one ingestor on the file at path. Runs in its own process (see main)."""
+    import dask
+    from xicam.NCEM.ingestors import cache
+
+    cache.CACHE_DIR = Path(cache_dir)
+    ingest = _ingestor(fmt)
+    _import_lazy_modules(ingest)
+    baseline = _peak_rss()
+
+    with dask.config.set(scheduler='synchronous'):
+        t0 = time.perf_counter()
+        docs = list(ingest([path]))
+        ingest_time = time.perf_counter() - t0
+        data = _frames(docs)
+        np.asarray(data[0])
+        first_frame = time.perf_counter() - t0
+
+        random.seed(0)
+        latencies = []
+        for t in random.sample(range(data.shape[0]), min(reads, data.shape[0])):
+            t1 = time.perf_counter()
+            np.asarray(data[t])
+            latencies.append(time.perf_counter() - t1)
+
+        t1 = time.perf_counter()
+        for block in data.to_delayed().ravel():
+            block.compute()
+        sequential = time.perf_counter() - t1
+
+    peak = _peak_rss()
+    return {'ingest': ingest_time,
+            'first_frame': first_frame,
+            'random_frame': statistics.median(latencies),
+            'throughput': data.nbytes / sequential / 1e6,
+            'peak_rss': peak,
+            'peak_rss_delta': peak - baseline}
+
+
+def measure_viewer(size):
+    """ Time drawing a size x size frame through a pyramid and making its thumbnail"""
+    from xicam.NCEM import thumbnails
+    from xicam.NCEM.pyramid import FramePyramid
+
+    frame = synthetic.frames(1, size)
+    results = {}
+
+    pyramid = FramePyramid(frame)
+    t0 = time.perf_counter()
+    pyramid.frame(0, pyramid.num_levels - 1)
+    results['pyramid_top_level'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    pyramid.region(0, size // 2, size // 2 + 1, size // 2, size // 2 + 1)
+    results['pyramid_tile'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    thumbnails.thumbnail_array(frame[0])
+    results['thumbnail'] = time.perf_counter() - t0
+    return results
+
+
+def _metadata(args):
+    try:
+        from importlib.metadata import version
+        package_version = version('xicam.NCEM')
+    except Exception:
+        package_version = None
+    return {'version': package_version,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'frames': args.frames,
+            'size': args.size}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--size', type=int, default=512)
+    parser.add_argument('--formats', nargs='+', default=synthetic.FORMATS, choices=synthetic.FORMATS)
+    parser.add_argument('--viewer-size', type=int, default=8192, help='frame size for the viewer benchmarks')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = {'metadata': _metadata(args), 'ingestors': {}, 'viewer': {}}
+    context = multiprocessing.get_context('spawn')
+    columns = ('ingest', 'first_frame', 'random_frame', 'throughput', 'peak_rss')
+    print('{:>6} '.format('format') + ' '.join('{:>12}'.format(c) for c in columns))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt in args.formats:
+            try:
+                path = synthetic.write(fmt, tmp, args.frames, args.size)
+            except ImportError as ex:  # e.g. zarr is not installed
+                print('{:>6} skipped: {}'.format(fmt, ex))
+                continue
+            with context.Pool(1) as pool:
+                result = pool.apply(measure_ingestor, (fmt, path, str(Path(tmp) / 'cache' / fmt)))
+            results['ingestors'][fmt] = result
+            print('{:>6} '.format(fmt) + ' '.join('{:12.4g}'.format(result[c]) for c in columns))
+
+    with context.Pool(1) as pool:
+        results['viewer'] = pool.apply(measure_viewer, (args.viewer_size,))
+    for name, value in results['viewer'].items():
+        print('{:>18}: {:8.4f} s'.format(name, value))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
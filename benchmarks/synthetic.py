@@ -0,0 +1,76 @@
+""" Synthetic files in every format read by the NCEM ingestors, for benchmarks.
+
+Each writer makes a [t, y, x] uint16 series of num_t frames of size x size pixels:
+
+    path = write('mrc', directory, num_t=100, size=1024)
+
+EMD, MRC and TIFF files are written with ncempy and tifffile. DM4, SER and Velox files can not be
+written by any library, so the minimal writers shared by the tests (tests/writers.py) are reused.
+Zarr stores are exported from the MRC file with xicam.NCEM.export.
+
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'tests'))
+
+FORMATS = ('emd', 'velox', 'mrc', 'tif', 'ser', 'dm4', 'zarr')
+
+SUFFIXES = {'emd': '.emd', 'velox': '.emd', 'mrc': '.mrc', 'tif': '.tif', 'ser': '_1.ser', 'dm4': '.dm4',
+            'zarr': '.zarr'}
+
+
+def frames(num_t, size, seed=0):
+    """ Random uint16 frames as [t, y, x]"""
+    return np.random.default_rng(seed).integers(0, 4096, size=(num_t, size, size), dtype='<u2')
+
+
+def write_emd(path, data):
+    from ncempy.io import emd
+
+    with emd.fileEMD(path, readonly=False) as f0:
+        f0.put_emdgroup('synthetic', data, emd.defaultDims(data))
+
+
+def write_mrc(path, data):
+    from ncempy.io import mrc
+
+    mrc.mrcWriter(path, data, (1, 1, 1))
+
+
+def write_tif(path, data):
+    import tifffile
+
+    tifffile.imwrite(path, data, imagej=True, resolution=(1., 1.), metadata={'unit': 'um'})
+
+
+def write_zarr(path, data):
+    from xicam.NCEM.export import export_zarr
+    from xicam.NCEM.ingestors.MRCPlugin import ingest_NCEM_MRC
+
+    mrc_path = Path(path).with_suffix('.zarr.mrc')
+    write_mrc(mrc_path, data)
+    export_zarr(ingest_NCEM_MRC([str(mrc_path)]), path)
+    mrc_path.unlink()
+
+
+def write(fmt, directory, num_t, size):
+    """ Write a synthetic file of format fmt (one of FORMATS) in directory and return its path"""
+    path = str(Path(directory) / (fmt + SUFFIXES[fmt]))
+    data = frames(num_t, size)
+    if fmt == 'velox':
+        from writers import write_velox
+        write_velox(path, {'HAADF': data.transpose(1, 2, 0)}, chunks=(size, size, 1))
+    elif fmt == 'ser':
+        from writers import write_ser
+        write_ser(path, data)
+    elif fmt == 'dm4':
+        from writers import write_dm4
+        write_dm4(path, data)
+    else:
+        {'emd': write_emd, 'mrc': write_mrc, 'tif': write_tif, 'zarr': write_zarr}[fmt](path, data)
+    return path
@@ -0,0 +1,65 @@
+""" Benchmark reading Velox EMD frames one at a time against the slab reader used by the ingestor.
+
+Velox files store image series as [y, x, t]. This writes a synthetic Velox style file with a
+contiguous and a chunked layout and times reading every frame with:
+
+    - per-frame: _get_slice_velox(emd_obj, t) for each t (the previous ingest path)
+    - slab: _dask_data_velox(emd_obj) computed block by block
+
+Usage:
+    python benchmarks/velox_read.py --frames 200 --size 512
+
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from ncempy.io import emdVelox
+
+import synthetic
+from writers import write_velox  # tests/writers.py, on the path set up by synthetic
+
+from xicam.NCEM.ingestors.EMDPlugin import _get_slice_velox, _dask_data_velox
+
+
+def time_per_frame(path):
+    with emdVelox.fileEMDVelox(path) as emd_obj:
+        num_t = emd_obj.list_data[0]['Data'].shape[-1]
+        t0 = time.perf_counter()
+        for t in range(num_t):
+            np.asarray(_get_slice_velox(emd_obj, t))
+        return time.perf_counter() - t0
+
+
+def time_slab(path):
+    with emdVelox.fileEMDVelox(path) as emd_obj:
+        dask_data = _dask_data_velox(emd_obj)
+        t0 = time.perf_counter()
+        for block in dask_data.to_delayed().ravel():
+            block.compute(scheduler='synchronous')
+        return time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--size', type=int, default=512)
+    args = parser.parse_args()
+
+    nbytes = args.frames * args.size ** 2 * 2
+    layouts = {'contiguous': None, 'chunked': (args.size, args.size, 1)}
+    data = synthetic.frames(args.frames, args.size).transpose(1, 2, 0)  # stored as [y, x, t]
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, chunks in layouts.items():
+            path = str(Path(tmp) / '{}.emd'.format(name))
+            write_velox(path, {'HAADF': data}, chunks=chunks)
+            for label, func in (('per-frame', time_per_frame), ('slab', time_slab)):
+                elapsed = func(path)
+                print('{:>10} {:>9}: {:8.3f} s {:8.1f} MB/s'.format(name, label, elapsed, nbytes / elapsed / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -68,7 +68,7 @@ setup(
     # requirements files see:
     # https://packaging.python.org/en/latest/requirements.html
     # xicam 2.3.0 and databroker 1.2.4 work
-    install_requires=['ncempy>=1.7.0', 'tifffile', 'dask', 'numpy', 'databroker', 'qtpy', 'pyqtgraph',
+    install_requires=['ncempy>=1.7.0', 'tifffile', 'dask', 'numpy', 'databroker', 'qtpy', 'pyqtgraph', 'appdirs',
                       'xicam==2.3.0','databroker<2', 'pyyaml==5.4.1'],
 
     setup_requires=[],
@@ -80,6 +80,7 @@ setup(
     extras_require={
         # 'dev': ['check-manifest'],
         'tests': ['pytest', 'coverage'],
+        'zarr': ['zarr>=2.11', 'numcodecs'],
     },
 
     # If there are data files included in your packages that need to be
@@ -102,9 +103,19 @@ setup(
                                            "application/x-EMD-VELOX = xicam.NCEM.ingestors.EMDPlugin:ingest_NCEM_EMD_VELOX",
                                            "application/x-MRC = xicam.NCEM.ingestors.MRCPlugin:ingest_NCEM_MRC",
                                            "application/x-SER = xicam.NCEM.ingestors.SERPlugin:ingest_NCEM_SER",
+                                           "application/x-NCEM-ZARR = xicam.NCEM.ingestors.ZarrPlugin:ingest_NCEM_ZARR",
                                            "image/tiff = xicam.NCEM.ingestors.TIFPlugin:ingest_NCEM_TIF"],
-                  "databroker.sniffers": ['emd_sniffer = xicam.NCEM.ingestors.EMDPlugin:emd_sniffer', ],
-                  "databroker.handlers": [],
+                  "databroker.sniffers": ['dm_sniffer = xicam.NCEM.ingestors.sniffers:dm_sniffer',
+                                          'emd_sniffer = xicam.NCEM.ingestors.sniffers:emd_sniffer',
+                                          'mrc_sniffer = xicam.NCEM.ingestors.sniffers:mrc_sniffer',
+                                          'ser_sniffer = xicam.NCEM.ingestors.sniffers:ser_sniffer',
+                                          'tif_sniffer = xicam.NCEM.ingestors.sniffers:tif_sniffer'],
+                  "databroker.handlers": ["NCEM_DM = xicam.NCEM.ingestors.DMPlugin:DMHandler",
+                                          "NCEM_EMD = xicam.NCEM.ingestors.EMDPlugin:EMDHandler",
+                                          "NCEM_EMD_VELOX = xicam.NCEM.ingestors.EMDPlugin:VeloxHandler",
+                                          "NCEM_MRC = xicam.NCEM.ingestors.MRCPlugin:MRCHandler",
+                                          "NCEM_SER = xicam.NCEM.ingestors.SERPlugin:SERHandler",
+                                          "NCEM_TIF = xicam.NCEM.ingestors.TIFPlugin:TIFHandler"],
                   "xicam.plugins.GUIPlugin": ["NCEM = xicam.NCEM:NCEMPlugin"],
                   "xicam.plugins.WidgetPlugin": ["ncem_viewer = xicam.NCEM.widgets.NCEMViewerPlugin:NCEMViewerPlugin"]
                   },
@@ -0,0 +1,10 @@
+import pytest
+
+from xicam.NCEM.ingestors import cache
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Keep the on-disk caches of the ingestors out of the user cache directory"""
+    monkeypatch.setattr(cache, 'CACHE_DIR', tmp_path / 'cache')
+    return tmp_path / 'cache'
@@ -1,9 +1,13 @@
 from pathlib import Path
+
+import numpy as np
 import pytest
 
 
 from xicam.NCEM.ingestors.DMPlugin import ingest_NCEM_DM
 
+from writers import write_dm4
+
 
 @pytest.fixture
 def DM_path():
@@ -18,3 +22,53 @@ def test_slicing(DM_path):
     data = event_doc['data']['raw']
     assert data.shape == (20, 1, 1024, 1024)
     assert data[1, 0].compute().shape == (1024, 1024)
+
+
+@pytest.mark.parametrize('shape', [(6, 20, 30), (3, 4, 10, 12)])
+def test_memmap(tmp_path, shape):
+    dd = np.random.randint(0, 4096, size=shape).astype('<u2')
+    fPath = str(tmp_path / 'synthetic.dm4')
+    write_dm4(fPath, dd)
+
+    docs = list(ingest_NCEM_DM([fPath]))
+    assert docs[0][1]['PhysicalSizeX'] == 0.5
+    assert docs[0][1]['Acquisition.Exposure'] == 1.5
+    data = docs[2][1]['data']['raw']
+    assert data.shape == shape
+    assert data.chunks[-2:] == ((shape[-2],), (shape[-1],))
+    np.testing.assert_array_equal(data.compute(), dd)
+
+    in_memory = list(ingest_NCEM_DM([fPath], on_memory=True))[2][1]['data']['raw']
+    np.testing.assert_array_equal(in_memory.compute(), dd)
+
+
+def test_tag_filter(tmp_path, monkeypatch, caplog):
+    from xicam.NCEM.ingestors import DMPlugin
+
+    tags = {'.ImageList.2.ImageTags.Acquisition.Frame {}.Exposure'.format(ii): float(ii) for ii in range(50000)}
+    tags['.ImageList.2.ImageTags.Acquisition.Private.Key'] = 1
+    tags['.ImageList.2.ImageData.Calibrations.Dimension.1.Scale'] = 0.5
+    tags['.ImageList.1.ImageTags.Thumbnail.Key'] = 2
+
+    with caplog.at_level('WARNING', logger=DMPlugin.__name__):
+        metadata = DMPlugin.TagFilter()(tags, 2)
+    assert len(metadata) == 10000
+    assert 'Dropped 40001 DM tags' in caplog.text
+    assert 'Acquisition.Frame 0.Exposure' in metadata
+    assert 'Acquisition.Private.Key' not in metadata
+    assert 'Thumbnail.Key' not in metadata
+
+    caplog.clear()
+    metadata = DMPlugin.TagFilter(allow=['Calibrations.'], max_tags=10)(tags, 2)
+    assert metadata == {'Calibrations.Dimension.1.Scale': 0.5}
+    assert not caplog.records  # nothing dropped, nothing logged
+
+    metadata = DMPlugin.TagFilter(max_bytes=100)(tags, 2)
+    assert 0 < len(metadata) < 5
+
+    config = tmp_path / 'dm_tags.json'
+    config.write_text('{"deny": ["Acquisition"], "max_tags": 5}')
+    monkeypatch.setenv('XICAM_NCEM_DM_TAG_FILTER', str(config))
+    tag_filter = DMPlugin._load_tag_filter()
+    assert tag_filter.max_tags == 5
+    assert tag_filter(tags, 2) == {'Calibrations.Dimension.1.Scale': 0.5}
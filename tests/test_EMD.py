@@ -5,10 +5,13 @@ import pytest
 
 import numpy as np
 
-from ncempy.io import emd
-from xicam.NCEM.ingestors.EMDPlugin import ingest_NCEM_EMD, _get_slice
+from ncempy.io import emd, emdVelox
+from xicam.NCEM.ingestors.EMDPlugin import (ingest_NCEM_EMD, ingest_NCEM_EMD_VELOX, VeloxFrameMetadata, _get_slice,
+                                            _get_slice_velox, _frame_table_velox)
 from databroker.in_memory import BlueskyInMemoryCatalog
 
+from writers import write_velox
+
 
 @pytest.fixture
 def temp_file():
@@ -40,6 +43,13 @@ def EMD_multi_path():
     return fPath
 
 
+@pytest.fixture
+def Velox_path(temp_file):
+    """A Velox style EMD file with a [y, x, t] = [20, 30, 12] data set"""
+    dd = np.arange(12 * 20 * 30, dtype='<u2').reshape(12, 20, 30).transpose(1, 2, 0)
+    return write_velox(str(temp_file), {'HAADF': dd}, chunks=(20, 30, 4))
+
+
 def test_slicing(temp_file):
     dd = np.ones((10, 11, 12), dtype=np.uint16)
     with emd.fileEMD(temp_file, readonly=False) as emd0:
@@ -111,3 +121,90 @@ def test_multi_device(temp_file):
     print(stream_names)
     run_catalog[stream_names[0]].to_dask()['raw'].compute()
     run_catalog[stream_names[1]].to_dask()['raw'].compute()
+
+
+def test_chunk_aligned(temp_file):
+    dd = np.arange(40 * 16 * 16, dtype=np.uint16).reshape(40, 16, 16)
+    with emd.fileEMD(temp_file, readonly=False) as emd0:
+        dims = emd.defaultDims(dd)
+        emd0.put_emdgroup('test', dd, dims, chunks=(4, 8, 8))
+
+    docs = list(ingest_NCEM_EMD([str(temp_file)]))
+    event_doc = docs[2][1]
+    data = event_doc['data']['raw']
+    assert data.shape == (40, 16, 16)
+    # Each dask chunk covers whole HDF5 chunks and whole frames
+    assert all(c % 4 == 0 for c in data.chunks[0])
+    assert data.chunks[1:] == ((16,), (16,))
+    assert data.numblocks[0] < 40
+    np.testing.assert_array_equal(data[5:9].compute(), dd[5:9])
+
+
+def test_4d_lazy(temp_file):
+    dd = np.arange(6 * 5 * 8 * 9, dtype=np.uint16).reshape(6, 5, 8, 9)
+    with emd.fileEMD(temp_file, readonly=False) as emd0:
+        dims = emd.defaultDims(dd)
+        emd0.put_emdgroup('test', dd, dims)
+
+    with emd.fileEMD(temp_file) as emd_obj:
+        assert _get_slice(emd_obj, 2, z=3).shape == (8, 9)
+
+    docs = list(ingest_NCEM_EMD([str(temp_file)]))
+    event_doc = docs[2][1]
+    data = event_doc['data']['raw']
+    assert data.shape == (6, 5, 8, 9)
+    np.testing.assert_array_equal(data[2, 3].compute(), dd[2, 3])
+    np.testing.assert_array_equal(data[:, :, 4, 4].compute(), dd[:, :, 4, 4])
+
+
+def test_velox_transpose(Velox_path):
+    docs = list(ingest_NCEM_EMD_VELOX([Velox_path]))
+    event_doc = docs[2][1]
+    data = event_doc['data']['raw']
+    assert data.shape == (12, 20, 30)
+    assert data.chunks[1:] == ((20,), (30,))
+    with emdVelox.fileEMDVelox(Velox_path) as emd_obj:
+        for t in (0, 5, 11):
+            np.testing.assert_array_equal(data[t].compute(), _get_slice_velox(emd_obj, t)[:])
+    assert data[3:7].compute().flags['C_CONTIGUOUS']
+
+
+def test_velox_multi_detector(temp_file):
+    haadf = np.ones((20, 30, 6), dtype='<u2')
+    bf = 2 * np.ones((20, 30, 6), dtype='<u2')
+    write_velox(str(temp_file), {'HAADF': haadf, 'BF': bf})
+
+    docs = list(ingest_NCEM_EMD_VELOX([str(temp_file)]))
+    descriptors = [doc for name, doc in docs if name == 'descriptor' and doc['name'].startswith('primary')]
+    assert [doc['name'] for doc in descriptors] == ['primary_HAADF', 'primary_BF']
+    assert descriptors[0]['configuration']['PhysicalSizeY']['data']['PhysicalSizeY'] == 2e-10
+    events = [doc for name, doc in docs if name == 'event']
+    assert events[1]['data']['raw'][0].compute().max() == 2
+
+
+def test_velox_frame_metadata(Velox_path):
+    with emdVelox.fileEMDVelox(Velox_path) as emd_obj:
+        frame_md = VeloxFrameMetadata(emd_obj)
+        assert len(frame_md) == 12
+        assert frame_md[5]['Acquisition']['AcquisitionStartDatetime']['DateTime'] == '1600000005'
+        assert frame_md[-1]['Stage']['Position']['x'] == str(1e-6 * 11)
+        frame_md[5]
+        assert frame_md.cache_info().hits == 1
+        assert frame_md.cache_info().currsize == 2
+
+
+def test_velox_frame_stream(Velox_path, cache_dir):
+    docs = list(ingest_NCEM_EMD_VELOX([Velox_path]))
+    descriptor = [doc for name, doc in docs if name == 'descriptor'][1]
+    assert descriptor['name'] == 'frames_HAADF'
+    event_page = [doc for name, doc in docs if name == 'event_page'][0]
+    assert event_page['descriptor'] == descriptor['uid']
+    np.testing.assert_allclose(event_page['data']['time'], 1600000000 + np.arange(12))
+    np.testing.assert_allclose(event_page['data']['stage_x'], 1e-6 * np.arange(12))
+    assert np.isnan(event_page['data']['dose']).all()
+    assert len(list((cache_dir / 'velox_frames').glob('*.npz'))) == 1
+
+    # The second ingest reads the cached table
+    with emdVelox.fileEMDVelox(Velox_path) as emd_obj:
+        table = _frame_table_velox(Velox_path, emd_obj, block_size=5)
+    np.testing.assert_allclose(table['time'], event_page['data']['time'])
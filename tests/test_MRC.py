@@ -29,3 +29,68 @@ def test_ingest(temp_file):
     data = event_doc['data']['raw']
     assert data.shape == (10, 11, 12)
     assert data[0].compute().shape == (11, 12)
+
+
+def test_memmap(temp_file):
+    dd = np.arange(10 * 11 * 12, dtype=np.int16).reshape(10, 11, 12)
+    mrc.mrcWriter(temp_file, dd, (1, 2, 3))
+
+    docs = list(ingest_NCEM_MRC([str(temp_file)]))
+    data = docs[2][1]['data']['raw']
+    assert data.dtype == np.int16
+    assert data.numblocks == (1, 1, 1)
+    np.testing.assert_array_equal(data[3].compute(), dd[3])
+    np.testing.assert_array_equal(data[::3, 2:5].compute(), dd[::3, 2:5])
+
+
+def test_extended_header(temp_file):
+    dd = np.arange(4 * 5 * 6, dtype=np.float32).reshape(4, 5, 6)
+    mrc.mrcWriter(temp_file, dd, (1, 2, 3))
+    # Insert a FEI style extended header of 128 4-byte values after the 1024 byte header
+    raw = temp_file.read_bytes()
+    header = np.frombuffer(raw[:1024], dtype=np.int32).copy()
+    header[23] = 128 * 4  # extra[1] is the size of the extended header in bytes
+    extended = np.zeros(128, dtype=np.float32)
+    extended[11] = 2e-10  # pixel size
+    temp_file.write_bytes(header.tobytes() + extended.tobytes() + raw[1024:])
+
+    docs = list(ingest_NCEM_MRC([str(temp_file)]))
+    data = docs[2][1]['data']['raw']
+    np.testing.assert_array_equal(data.compute(), dd)
+
+
+def test_external(temp_file):
+    from databroker.in_memory import BlueskyInMemoryCatalog
+    from xicam.NCEM.ingestors.MRCPlugin import MRCHandler
+
+    dd = np.arange(6 * 5 * 4, dtype=np.int16).reshape(6, 5, 4)
+    mrc.mrcWriter(temp_file, dd, (1, 2, 3))
+
+    docs = list(ingest_NCEM_MRC([str(temp_file)], external=True))
+    assert [name for name, doc in docs] == ['start', 'descriptor', 'resource', 'datum_page', 'event_page', 'stop']
+    assert docs[1][1]['data_keys']['raw']['shape'] == [5, 4]
+
+    catalog = BlueskyInMemoryCatalog(handler_registry={'NCEM_MRC': MRCHandler})
+    catalog.upsert(docs[0][1], docs[-1][1], lambda: iter(docs), [], {})
+    run = catalog[docs[0][1]['uid']]
+    np.testing.assert_array_equal(run.primary.read()['raw'].values, dd)
+
+
+def test_tilt_angles(tmp_path, monkeypatch):
+    """ Tilt angles from a .rawtlt file follow edits of the file and each run reports the path it was given"""
+    fPath = tmp_path / 'tilt.mrc'
+    mrc.mrcWriter(fPath, np.ones((3, 4, 5), dtype=np.float32), (1, 1, 1))
+    fPath.with_suffix('.rawtlt').write_text('-60\n0\n60.5\n')
+
+    start_doc = list(ingest_NCEM_MRC([str(fPath)]))[0][1]
+    assert start_doc['tilt angles'] == [-60.0, 0.0, 60.5]
+    assert start_doc['FileName'] == str(fPath)
+
+    monkeypatch.chdir(tmp_path)
+    start_doc = list(ingest_NCEM_MRC(['tilt.mrc']))[0][1]  # a cache hit for the same file
+    assert start_doc['tilt angles'] == [-60.0, 0.0, 60.5]
+    assert start_doc['FileName'] == 'tilt.mrc'
+
+    fPath.with_suffix('.rawtlt').write_text('-45\n0\n45\n')
+    start_doc = list(ingest_NCEM_MRC(['tilt.mrc']))[0][1]  # the header is cached but not the tilt angles
+    assert start_doc['tilt angles'] == [-45.0, 0.0, 45.0]
@@ -1,7 +1,10 @@
 from pathlib import Path
 
+import numpy as np
 import pytest
-from xicam.NCEM.ingestors.SERPlugin import ingest_NCEM_SER, _get_slice
+from xicam.NCEM.ingestors.SERPlugin import ingest_NCEM_SER, SERIndex, _get_slice
+
+from writers import write_ser
 
 
 @pytest.fixture
@@ -18,3 +21,55 @@ def test_slicing(SER_path):
     data = event_doc['data']['raw']
     assert data.shape == (29, 512, 512)
     assert data[0].compute().shape == (512, 512)
+
+
+@pytest.fixture
+def synthetic_SER(tmp_path):
+    dd = np.arange(6 * 16 * 20, dtype='<u2').reshape(6, 16, 20)
+    positions = np.stack([np.arange(6) * 1e-9, -np.arange(6) * 1e-9], axis=1)
+    return write_ser(str(tmp_path / 'synthetic_1.ser'), dd, positions=positions), dd
+
+
+def test_index(synthetic_SER):
+    path, dd = synthetic_SER
+    index = SERIndex(path)
+    assert len(index) == 6
+    frame = index.frame(2)
+    assert not frame.flags['OWNDATA']  # a view into the memory map
+    np.testing.assert_array_equal(frame, _get_slice(path, 2))
+    np.testing.assert_array_equal(frame, dd[2])
+    np.testing.assert_array_equal(index.times, 1000 + np.arange(6))
+    np.testing.assert_allclose(index.positions[:, 1], -np.arange(6) * 1e-9)
+
+
+def test_ingest_synthetic(synthetic_SER):
+    path, dd = synthetic_SER
+    docs = list(ingest_NCEM_SER([path]))
+    data = docs[2][1]['data']['raw']
+    assert data.shape == (6, 16, 20)
+    np.testing.assert_array_equal(data.compute(), dd)
+    assert docs[3][1]['name'] == 'frames'
+    np.testing.assert_allclose(docs[4][1]['data']['position_x'], np.arange(6) * 1e-9)
+
+
+def test_padded_elements(tmp_path):
+    dd = np.arange(4 * 8 * 10, dtype='<u2').reshape(4, 8, 10)
+    path = write_ser(str(tmp_path / 'gap_1.ser'), dd, gap=7)
+    index = SERIndex(path)
+    assert index.as_array() is not None  # constant gaps are still evenly spaced
+    np.testing.assert_array_equal(index.as_array(), dd)
+    np.testing.assert_array_equal(index[1:3, 2:4], dd[1:3, 2:4])
+
+
+def test_multi_file(tmp_path):
+    dd = np.arange(12 * 8 * 10, dtype='<u2').reshape(12, 8, 10)
+    positions = np.stack([np.arange(12) * 1e-9, np.zeros(12)], axis=1)
+    paths = [write_ser(str(tmp_path / 'series_{}.ser'.format(ii + 1)), dd[4 * ii:4 * ii + 4],
+                       positions=positions[4 * ii:4 * ii + 4]) for ii in range(3)]
+
+    docs = list(ingest_NCEM_SER([paths[2], paths[0], paths[1]]))
+    data = docs[2][1]['data']['raw']
+    assert data.shape == (12, 8, 10)
+    np.testing.assert_array_equal(data.compute(), dd)
+    np.testing.assert_allclose(docs[4][1]['data']['position_x'], positions[:, 0])
+    assert docs[4][1]['seq_num'] == list(range(1, 13))
@@ -32,3 +32,60 @@ def test_slicing():
     data = event_doc['data']['raw']
     assert data.shape == (30, 40, 50)
     assert data[0].compute().shape == (40, 50)
+
+
+def test_tiled_compressed(tmp_path):
+    """ Tiled, compressed BigTIFF pages are read through the zarr store with one tile per block"""
+    pytest.importorskip('zarr')
+    dd = np.random.randint(0, 4096, size=(12, 64, 48), dtype='<u2')
+    fPath = str(tmp_path / 'tiled.tif')
+    tifffile.imwrite(fPath, dd, bigtiff=True, tile=(16, 16), compression='zlib')
+
+    docs = list(ingest_NCEM_TIF([fPath]))
+    data = docs[2][1]['data']['raw']
+    assert data.shape == (12, 64, 48)
+    assert data.chunks == ((1,) * 12, (16,) * 4, (16,) * 3)
+    np.testing.assert_array_equal(data.compute(), dd)
+    np.testing.assert_array_equal(data[7].compute(), dd[7])
+    np.testing.assert_array_equal(data[3:5, 20:40, 10:20].compute(), dd[3:5, 20:40, 10:20])
+
+
+@pytest.mark.parametrize('with_zarr', [True, False])
+def test_read_paths(tmp_path, monkeypatch, with_zarr):
+    """ Contiguous series are memory mapped and compressed pages are read in blocks of whole frames"""
+    from xicam.NCEM.ingestors import TIFPlugin
+    if not with_zarr:
+        monkeypatch.setattr(TIFPlugin, 'zarr', None)
+
+    dd = np.random.randint(0, 4096, size=(10, 20, 30), dtype='<u2')
+    plain = str(tmp_path / 'plain.tif')
+    tifffile.imwrite(plain, dd, imagej=True)
+    packed = str(tmp_path / 'packed.tif')
+    tifffile.imwrite(packed, dd, compression='zlib')
+
+    for fPath in (plain, packed):
+        data = TIFPlugin._dask_data(fPath)
+        assert data.shape == (10, 20, 30)
+        assert data.chunks[1:] == ((20,), (30,))
+        np.testing.assert_array_equal(data.compute(), dd)
+        np.testing.assert_array_equal(data[3:5].compute(), dd[3:5])
+
+
+def test_multi_file(tmp_path):
+    """ One file per frame is ingested as one series in natural sort order"""
+    dd = np.random.randint(0, 4096, size=(12, 20, 30), dtype='<u2')
+    paths = []
+    for t, frame in enumerate(dd):
+        fPath = str(tmp_path / 'frame_{}.tif'.format(t + 1))
+        tifffile.imwrite(fPath, frame)
+        paths.append(fPath)
+
+    docs = list(ingest_NCEM_TIF(paths[::-1]))
+    assert docs[0][1]['FileNames'] == paths
+    data = docs[2][1]['data']['raw']
+    assert data.shape == (12, 20, 30)
+    np.testing.assert_array_equal(data.compute(), dd)
+
+    tifffile.imwrite(str(tmp_path / 'frame_13.tif'), dd[0, :10])
+    with pytest.raises(ValueError, match='frame_13.tif'):
+        list(ingest_NCEM_TIF(paths + [str(tmp_path / 'frame_13.tif')]))
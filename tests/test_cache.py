@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+
+from xicam.NCEM.ingestors import cache
+
+
+def test_metadata_cache_copies(tmp_path, monkeypatch):
+    metadata_cache = cache.MetadataCache(tmp_path / 'metadata.sqlite')
+    monkeypatch.setattr(cache, 'metadata_cache', metadata_cache)
+    calls = []
+
+    @cache.cached_metadata
+    def _metadata(path, dset_num=0):
+        calls.append(path)
+        return {'FileName': path, 'shape': np.array([2, 3]), 'dset_num': dset_num}
+
+    fPath = tmp_path / 'data.bin'
+    fPath.write_bytes(b'0' * 10)
+
+    first = _metadata(str(fPath))
+    first['uid'] = 'run 1'
+    second = _metadata(str(fPath), dset_num=0)
+    assert 'uid' not in second
+    np.testing.assert_array_equal(second['shape'], [2, 3])
+    assert len(calls) == 1
+    assert metadata_cache.stats()['hit_rate'] == 0.5
+
+    # A new instance reads the same data base (e.g. the next session)
+    monkeypatch.setattr(cache, 'metadata_cache', cache.MetadataCache(tmp_path / 'metadata.sqlite'))
+    _metadata(str(fPath))
+    assert len(calls) == 1
+
+    # Rewriting the file changes its identity
+    fPath.write_bytes(b'1' * 20)
+    os.utime(fPath, ns=(0, 0))
+    _metadata(str(fPath))
+    assert len(calls) == 2
+
+
+def test_metadata_cache_eviction(tmp_path):
+    metadata_cache = cache.MetadataCache(tmp_path / 'metadata.sqlite', max_bytes=5000)
+    for ii in range(10):
+        metadata_cache.put(str(ii), b'x' * 1000)
+    stats = metadata_cache.stats()
+    assert stats['entries'] < 10
+    assert stats['bytes'] <= 5000
+    assert metadata_cache.get('0') is None
+    assert metadata_cache.get('9') == b'x' * 1000
+
+
+def test_metadata_cache_unpicklable(tmp_path, monkeypatch):
+    """ Values that can not be pickled are returned as computed and not cached"""
+    metadata_cache = cache.MetadataCache(tmp_path / 'metadata.sqlite')
+    monkeypatch.setattr(cache, 'metadata_cache', metadata_cache)
+
+    @cache.cached_metadata
+    def _metadata(path):
+        return {'reader': lambda: path}
+
+    fPath = tmp_path / 'data.bin'
+    fPath.write_bytes(b'0' * 10)
+
+    assert metadata_cache.put('key', _metadata(str(fPath))) is False
+    assert _metadata(str(fPath))['reader']() == str(fPath)
+    assert metadata_cache.stats()['entries'] == 0
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from xicam.NCEM.export import convert, export_emd, export_zarr
+from xicam.NCEM.ingestors.EMDPlugin import ingest_NCEM_EMD, ingest_NCEM_EMD_VELOX
+from xicam.NCEM.ingestors.MRCPlugin import ingest_NCEM_MRC
+from xicam.NCEM.ingestors.SERPlugin import ingest_NCEM_SER
+from xicam.NCEM.ingestors.ZarrPlugin import ingest_NCEM_ZARR
+from xicam.NCEM.ingestors.chunking import viewer_chunks
+
+from writers import write_ser, write_velox
+
+
+def test_viewer_chunks():
+    assert viewer_chunks((100, 512, 512), np.uint16) == (1, 512, 512)
+    assert viewer_chunks((10, 4096, 4096), np.float32) == (1, 1024, 1024)
+    assert viewer_chunks((64, 64, 128, 128), np.float32) == (8, 8, 128, 128)
+
+
+def test_zarr_round_trip(tmp_path):
+    frames = np.arange(6 * 8 * 10, dtype=np.int16).reshape(6, 8, 10)
+    positions = np.stack([np.arange(6) * 1e-9, np.arange(6) * 2e-9], axis=1)
+    ser_path = write_ser(str(tmp_path / 'series_1.ser'), frames, positions=positions)
+
+    store = tmp_path / 'series.zarr'
+    root = export_zarr(ingest_NCEM_SER([ser_path]), store)
+    assert root['primary/raw'].chunks == (1, 8, 10)
+
+    docs = list(ingest_NCEM_ZARR([str(store)]))
+    assert docs[0][1]['ConvertedFrom'] == ser_path
+    data = docs[2][1]['data']['raw']
+    np.testing.assert_array_equal(data.compute(), frames)
+    table = [doc for name, doc in docs if name == 'event_page'][0]
+    np.testing.assert_allclose(table['data']['position_y'], positions[:, 1])
+
+    with pytest.raises(Exception):
+        export_zarr(ingest_NCEM_SER([ser_path]), store)
+
+
+def test_velox_to_zarr(tmp_path):
+    dd = np.arange(6 * 20 * 30, dtype='<u2').reshape(6, 20, 30)
+    velox_path = write_velox(str(tmp_path / 'velox.emd'), {'HAADF': dd.transpose(1, 2, 0)})
+
+    convert([velox_path], tmp_path / 'velox.zarr')
+    docs = list(ingest_NCEM_ZARR([str(tmp_path / 'velox.zarr')]))
+    descriptors = [doc for name, doc in docs if name == 'descriptor']
+    assert descriptors[0]['name'] == 'primary_HAADF'
+    source = [doc for name, doc in ingest_NCEM_EMD_VELOX([velox_path]) if name == 'descriptor'][0]
+    assert {key: value['data'] for key, value in descriptors[0]['configuration'].items()} == \
+        {key: value['data'] for key, value in source['configuration'].items()}
+    np.testing.assert_array_equal(docs[2][1]['data']['raw'].compute(), dd)
+
+
+def test_emd_round_trip(tmp_path):
+    from ncempy.io import mrc
+
+    dd = np.arange(5 * 6 * 7, dtype=np.float32).reshape(5, 6, 7)
+    mrc_path = tmp_path / 'stack.mrc'
+    mrc.mrcWriter(mrc_path, dd, (1, 2e-10, 3e-10))
+
+    emd_path = tmp_path / 'stack.emd'
+    export_emd(ingest_NCEM_MRC([str(mrc_path)]), emd_path)
+
+    docs = list(ingest_NCEM_EMD([str(emd_path)]))
+    assert docs[1][1]['name'] == 'primary_stack'
+    np.testing.assert_array_equal(docs[2][1]['data']['raw'].compute(), dd)
+    source = next(ingest_NCEM_MRC([str(mrc_path)]))[1]
+    configuration = docs[1][1]['configuration']
+    assert configuration['PhysicalSizeX']['data']['PhysicalSizeX'] == pytest.approx(source['PhysicalSizeX'])
+
+
+def test_external_not_exported(tmp_path):
+    frames = np.zeros((2, 4, 4), dtype=np.uint8)
+    ser_path = write_ser(str(tmp_path / 'series_1.ser'), frames)
+    with pytest.raises(ValueError):
+        export_zarr(ingest_NCEM_SER([ser_path], external=True), tmp_path / 'series.zarr')
@@ -0,0 +1,157 @@
+import subprocess
+import sys
+
+import h5py
+import numpy as np
+import pytest
+import tifffile
+from ncempy.io import mrc
+
+from xicam.NCEM.follow import HDF5Frames, follow
+
+
+def _next_page(docs):
+    """ Pull documents until the next event_page"""
+    for name, doc in docs:
+        if name == 'event_page':
+            return doc
+
+
+def _frames(page):
+    return np.stack(page['data']['raw'])
+
+
+def test_follow_mrc(tmp_path):
+    dd = np.arange(5 * 6 * 7, dtype=np.float32).reshape(5, 6, 7)
+    path = tmp_path / 'live.mrc'
+    mrc.mrcWriter(path, dd[:2], (1, 1, 1))
+
+    stop = []
+    docs = follow(path, poll_interval=0.01, should_stop=lambda: bool(stop))
+    names = [next(docs)[0], next(docs)[0]]
+    assert names == ['start', 'descriptor']
+
+    page = _next_page(docs)
+    np.testing.assert_array_equal(_frames(page), dd[:2])
+    assert page['seq_num'] == [1, 2]
+
+    # Append frames and a partial frame that is not read yet
+    with open(path, 'ab') as f:
+        f.write(dd[2:4].tobytes())
+        f.write(dd[4].tobytes()[:10])
+    page = _next_page(docs)
+    np.testing.assert_array_equal(_frames(page), dd[2:4])
+    assert page['seq_num'] == [3, 4]
+
+    with open(path, 'ab') as f:
+        f.write(dd[4].tobytes()[10:])
+    np.testing.assert_array_equal(_frames(_next_page(docs)), dd[4:])
+
+    stop.append(True)
+    name, doc = next(docs)
+    assert name == 'stop'
+    assert doc['num_events'] == {'primary': 5}
+
+
+def test_follow_tif(tmp_path):
+    dd = np.random.randint(0, 1000, size=(4, 10, 12)).astype(np.uint16)
+    path = tmp_path / 'live.tif'
+    tifffile.imwrite(path, dd[0])
+
+    docs = follow(path, poll_interval=0.01, idle_timeout=0.1)
+    assert next(docs)[0] == 'start'
+    assert next(docs)[1]['data_keys']['raw']['shape'] == [10, 12]
+    np.testing.assert_array_equal(_frames(_next_page(docs)), dd[:1])
+
+    for frame in dd[1:]:
+        tifffile.imwrite(path, frame, append=True)
+    page = _next_page(docs)
+    np.testing.assert_array_equal(_frames(page), dd[1:])
+    assert page['seq_num'] == [2, 3, 4]
+
+    # Stops once no frames are added for idle_timeout seconds
+    assert [name for name, doc in docs] == ['stop']
+
+
+def test_follow_tif_rgb(tmp_path):
+    dd = np.random.randint(0, 255, size=(3, 10, 12, 3)).astype(np.uint8)
+    path = tmp_path / 'live.tif'
+    tifffile.imwrite(path, dd[0], photometric='rgb')
+    for frame in dd[1:]:
+        tifffile.imwrite(path, frame, photometric='rgb', append=True)
+
+    docs = follow(path, poll_interval=0.01, idle_timeout=0.1)
+    assert next(docs)[0] == 'start'
+    assert next(docs)[1]['data_keys']['raw']['shape'] == [10, 12, 3]
+    np.testing.assert_array_equal(_frames(_next_page(docs)), dd)
+
+
+@pytest.mark.parametrize('velox', [False, True])
+def test_follow_emd(tmp_path, velox):
+    dd = np.arange(6 * 8 * 9, dtype=np.uint16).reshape(6, 8, 9)
+    path = tmp_path / 'live.emd'
+    with h5py.File(path, 'w') as f:
+        if velox:
+            dataset = f.create_group('Data/Image/0').create_dataset(
+                'Data', data=dd[:2].transpose(1, 2, 0), maxshape=(8, 9, None), chunks=(8, 9, 1))
+        else:
+            group = f.create_group('data/live')
+            group.attrs['emd_group_type'] = 1
+            group.create_dataset('data', data=dd[:2], maxshape=(None, 8, 9), chunks=(1, 8, 9))
+
+    mimetype = 'application/x-EMD-VELOX' if velox else 'application/x-EMD'
+    docs = follow(path, mimetype=mimetype, poll_interval=0.01, idle_timeout=0.1)
+    np.testing.assert_array_equal(_frames(_next_page(docs)), dd[:2])
+
+    # The follower does not hold the file open between polls so the writer can append
+    with h5py.File(path, 'a') as f:
+        if velox:
+            dataset = f['Data/Image/0/Data']
+            dataset.resize(6, axis=2)
+            dataset[:, :, 2:] = dd[2:].transpose(1, 2, 0)
+        else:
+            dataset = f['data/live/data']
+            dataset.resize(6, axis=0)
+            dataset[2:] = dd[2:]
+    np.testing.assert_array_equal(_frames(_next_page(docs)), dd[2:])
+    assert [name for name, doc in docs] == ['stop']
+
+
+# Appends frames 2 and 3 and holds the file open (and locked) until stdin is closed
+WRITER = """
+import sys
+import h5py
+import numpy as np
+with h5py.File(sys.argv[1], 'a') as f:
+    dataset = f['data/live/data']
+    dataset.resize(4, axis=0)
+    dataset[2:] = np.arange(4 * 8 * 9, dtype=np.uint16).reshape(4, 8, 9)[2:]
+    f.flush()
+    print('locked', flush=True)
+    sys.stdin.read()
+"""
+
+
+def test_follow_emd_locked(tmp_path):
+    """ While a writer without SWMR holds the file, polls see no new frames instead of failing"""
+    dd = np.arange(4 * 8 * 9, dtype=np.uint16).reshape(4, 8, 9)
+    path = tmp_path / 'live.emd'
+    with h5py.File(path, 'w') as f:
+        group = f.create_group('data/live')
+        group.attrs['emd_group_type'] = 1
+        group.create_dataset('data', data=dd[:2], maxshape=(None, 8, 9), chunks=(1, 8, 9))
+    frames = HDF5Frames(str(path))
+    assert frames.count() == 2
+
+    # HDF5 file locks only exclude other processes
+    writer = subprocess.Popen([sys.executable, '-c', WRITER, str(path)], stdin=subprocess.PIPE,
+                              stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        assert writer.stdout.readline().strip() == 'locked'
+        assert frames.count() == 2
+    finally:
+        writer.communicate('')
+    assert writer.returncode == 0
+
+    assert frames.count() == 4
+    np.testing.assert_array_equal(frames.read(2, 4), dd[2:])
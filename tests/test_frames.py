@@ -0,0 +1,144 @@
+import os
+
+import numpy as np
+import pytest
+import tifffile
+from ncempy.io import emdVelox, mrc
+
+from xicam.NCEM.ingestors import frames, handles, multifile
+from xicam.NCEM.ingestors.DMPlugin import ingest_NCEM_DM
+from xicam.NCEM.ingestors.EMDPlugin import _VeloxFrames
+from xicam.NCEM.ingestors.MRCPlugin import MRCSlices, ingest_NCEM_MRC, _source as mrc_source
+from xicam.NCEM.ingestors.SERPlugin import SERIndex, ingest_NCEM_SER
+from xicam.NCEM.ingestors.TIFPlugin import _TiffPages, ingest_NCEM_TIF, _source as tif_source
+
+from writers import write_dm4, write_ser, write_velox
+
+# Out of order, repeated and strided batches
+BATCHES = ([5, 1, 1, 7], [0, 2, 4, 6], [3], [])
+
+DATA = np.arange(8 * 6 * 5, dtype='<u2').reshape(8, 6, 5)
+
+
+def _sources(tmp_path):
+    path = str(tmp_path / 'stack.mrc')
+    mrc.mrcWriter(path, DATA, (1, 1, 1))
+    yield mrc_source(path)
+    yield MRCSlices(path)
+
+    path = str(tmp_path / 'stack.tif')
+    tifffile.imwrite(path, DATA)
+    yield tif_source(path)
+    yield _TiffPages(path)
+
+    path = str(tmp_path / 'stack_1.ser')
+    write_ser(path, DATA, gap=16)
+    yield SERIndex(path)
+
+    path = str(tmp_path / 'velox.emd')
+    write_velox(path, {'HAADF': DATA.transpose(1, 2, 0)}, chunks=(6, 5, 3))
+    emd_obj = emdVelox.fileEMDVelox(path)
+    yield _VeloxFrames(emd_obj, emd_obj.list_data[0]['Data'])
+
+
+@pytest.fixture
+def sources(tmp_path):
+    return list(_sources(tmp_path))
+
+
+def _check_read_frames(source):
+    assert source.shape == DATA.shape
+    assert source.dtype == DATA.dtype
+    for batch in BATCHES:
+        data = source.read_frames(batch)
+        assert data.shape == (len(batch), 6, 5), type(source).__name__
+        np.testing.assert_array_equal(data, DATA[batch], err_msg=type(source).__name__)
+
+
+def _check_to_dask(source):
+    dask_data = source.to_dask()
+    assert dask_data.chunks[1:] == ((6,), (5,))
+    np.testing.assert_array_equal(dask_data[1:7:2, 2:4].compute(scheduler='synchronous'), DATA[1:7:2, 2:4])
+    assert source.to_dask().name == dask_data.name  # the same file gives the same name
+
+
+def test_read_frames(sources):
+    for source in sources:
+        _check_read_frames(source)
+
+
+def test_to_dask(sources):
+    for source in sources:
+        _check_to_dask(source)
+
+
+def test_zarr(tmp_path):
+    zarr = pytest.importorskip('zarr')
+    path = str(tmp_path / 'stack.zarr')
+    source = frames.ArraySource(path, zarr.array(DATA, chunks=(2, 6, 5), store=path), 'ZARR', native_chunks=(2, 6, 5))
+    _check_read_frames(source)
+    _check_to_dask(source)
+
+
+def test_concatenated(tmp_path):
+    paths = []
+    for ii in range(0, 8, 3):  # files of 3, 3 and 2 frames
+        paths.append(str(tmp_path / 'series_{}.mrc'.format(ii)))
+        mrc.mrcWriter(paths[-1], DATA[ii:ii + 3], (1, 1, 1))
+    source = multifile.concatenate([mrc_source(path) for path in paths], paths)
+
+    for batch in BATCHES:
+        np.testing.assert_array_equal(source.read_frames(batch), DATA[batch])
+    np.testing.assert_array_equal(source[2:7, 1], DATA[2:7, 1])
+    np.testing.assert_array_equal(source[-1], DATA[-1])
+
+    dask_data = source.to_dask()
+    assert dask_data.chunks[0] == (3, 3, 2)  # blocks end at the file boundaries
+    np.testing.assert_array_equal(dask_data[1:8:3].compute(scheduler='synchronous'), DATA[1:8:3])
+
+
+def test_graph_size(tmp_path):
+    paths = [str(tmp_path / 'series_{}.mrc'.format(ii)) for ii in range(50)]
+    for path in paths:
+        mrc.mrcWriter(path, DATA[:2], (1, 1, 1))
+    docs = list(ingest_NCEM_MRC(paths))
+    dask_data = docs[2][1]['data']['raw']
+    assert dask_data.shape == (100, 6, 5)
+    assert len(dask_data.dask.layers) == 2  # the sources and one blockwise layer, however many files
+
+    long_series = frames.ArraySource('long.mrc', np.zeros((100000, 2, 2), dtype=np.uint8), 'MRC')
+    dask_data = long_series.to_dask(name='long')
+    assert len(dask_data.dask.layers) == 2
+    assert dask_data[54321].compute(scheduler='synchronous').shape == (2, 2)
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='counts the open file descriptors in /proc')
+def test_many_files(tmp_path):
+    """ A series of more files than the open file limit allows is ingested and read"""
+    resource = pytest.importorskip('resource')
+    handles.pool.clear()
+    limit = len(os.listdir('/proc/self/fd')) + handles.pool.max_open + 32
+    num_files = limit + 100
+
+    writers = {'mrc': lambda path, data: mrc.mrcWriter(path, data, (1, 1, 1)),
+               'ser': write_ser,
+               'dm4': lambda path, data: write_dm4(path, data, thumbnail=False),
+               'tif': tifffile.imwrite,
+               'tiff': lambda path, data: tifffile.imwrite(path, data, tile=(16, 16), compression='zlib')}
+    ingestors = {'mrc': ingest_NCEM_MRC, 'ser': ingest_NCEM_SER, 'dm4': ingest_NCEM_DM, 'tif': ingest_NCEM_TIF,
+                 'tiff': ingest_NCEM_TIF}
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    for ext, write in writers.items():
+        paths = [str(tmp_path / 'series_{}.{}'.format(ii, ext)) for ii in range(num_files)]
+        for path in paths:
+            write(path, DATA[:2])
+
+        resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+        try:
+            docs = list(ingestors[ext](paths))
+            data = docs[2][1]['data']['raw'][:, 1].compute(scheduler='threads')
+        finally:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+            handles.pool.clear()
+        assert data.shape == (2 * num_files, 5), ext
+        np.testing.assert_array_equal(data[-2:], DATA[:2, 1], err_msg=ext)
@@ -0,0 +1,94 @@
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+import pytest
+from ncempy.io import mrc
+
+from xicam.NCEM.ingestors.handles import HandlePool
+from xicam.NCEM.ingestors import handles
+from xicam.NCEM.ingestors.MRCPlugin import _get_slice
+
+
+class _Handle:
+    opened = 0
+
+    def __init__(self, path):
+        _Handle.opened += 1
+        self.path = path
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def paths(tmp_path):
+    out = []
+    for ii in range(3):
+        pp = tmp_path / f'file_{ii}.bin'
+        pp.write_bytes(b'0')
+        out.append(str(pp))
+    return out
+
+
+def test_hits_and_misses(paths):
+    pool = HandlePool()
+    for _ in range(3):
+        with pool.borrow(paths[0], _Handle) as handle:
+            assert handle.path == paths[0]
+    assert pool.stats() == {'hits': 2, 'misses': 1, 'open': 1, 'files': 1}
+
+
+def test_lru_limit(paths):
+    pool = HandlePool(max_files=2)
+    borrowed = []
+    for path in paths:
+        with pool.borrow(path, _Handle) as handle:
+            borrowed.append(handle)
+    assert borrowed[0].closed
+    assert not borrowed[2].closed
+    assert pool.stats()['open'] == 2
+
+
+def test_rewritten_file_is_reopened(paths):
+    pool = HandlePool()
+    with pool.borrow(paths[0], _Handle) as first:
+        pass
+    Path(paths[0]).write_bytes(b'0123')
+    os.utime(paths[0], ns=(0, 10 ** 9))
+    with pool.borrow(paths[0], _Handle) as second:
+        pass
+    assert second is not first
+    assert first.closed
+    assert pool.stats()['misses'] == 2
+
+
+def test_max_open(paths):
+    pool = HandlePool(max_open=1)
+    with pool.borrow(paths[0], _Handle):
+        done = threading.Event()
+
+        def other():
+            with pool.borrow(paths[1], _Handle):
+                done.set()
+
+        thread = threading.Thread(target=other)
+        thread.start()
+        assert not done.wait(0.2)  # waits for the first handle to be returned
+    thread.join(5)
+    assert done.is_set()
+    assert pool.stats()['open'] == 1
+
+
+def test_mrc_frames_share_handle(tmp_path):
+    path = tmp_path / 'temp.mrc'
+    mrc.mrcWriter(path, np.ones((10, 11, 12), dtype=np.float32), (1, 2, 3))
+    handles.pool.clear()
+
+    for t in range(10):
+        assert _get_slice(str(path), t).shape == (11, 12)
+    stats = handles.pool.stats()
+    assert stats['misses'] == 1
+    assert stats['hits'] == 9
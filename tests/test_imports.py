@@ -0,0 +1,64 @@
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from writers import write_dm4, write_ser
+
+# Imported by databroker through the entry points in setup.py
+ENTRY_POINTS = ['xicam.NCEM.ingestors.DMPlugin', 'xicam.NCEM.ingestors.EMDPlugin', 'xicam.NCEM.ingestors.MRCPlugin',
+                'xicam.NCEM.ingestors.SERPlugin', 'xicam.NCEM.ingestors.TIFPlugin', 'xicam.NCEM.ingestors.ZarrPlugin',
+                'xicam.NCEM.ingestors.sniffers']
+
+HEAVY = ('qtpy', 'PyQt5', 'xicam.gui', 'xicam.plugins', 'databroker', 'dask', 'ncempy', 'event_model', 'zarr')
+
+# Generous for slow CI machines. Importing the GUI plugin took about 6 s.
+MAX_SECONDS = 2.
+
+
+def _import(modules):
+    """ Import modules in a fresh interpreter and return the loaded modules and the time it took"""
+    code = ('import json, sys, time\n'
+            't0 = time.perf_counter()\n'
+            'for name in {!r}:\n'
+            '    __import__(name)\n'
+            'print(json.dumps([time.perf_counter() - t0, sorted(sys.modules)]))').format(modules)
+    out = subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(out.decode().splitlines()[-1])
+
+
+def test_ingestors_without_qt():
+    seconds, modules = _import(ENTRY_POINTS)
+    loaded = [name for name in modules if any(name == heavy or name.startswith(heavy + '.') for heavy in HEAVY)]
+    assert loaded == []
+    assert seconds < MAX_SECONDS
+
+
+def test_ingest_without_qt(tmp_path):
+    """ Ingesting and reading DM and SER files (with the metrics on) does not import Qt or Xi-cam"""
+    dd = np.arange(3 * 4 * 5, dtype='<u2').reshape(3, 4, 5)
+    write_dm4(str(tmp_path / 'image.dm4'), dd)
+    write_ser(str(tmp_path / 'series_1.ser'), dd)
+    code = ('import json, sys\n'
+            'from xicam.NCEM.ingestors.DMPlugin import ingest_NCEM_DM\n'
+            'from xicam.NCEM.ingestors.SERPlugin import ingest_NCEM_SER\n'
+            'for ingest, path in ((ingest_NCEM_DM, {!r}), (ingest_NCEM_SER, {!r})):\n'
+            '    docs = list(ingest([path]))\n'
+            '    docs[2][1]["data"]["raw"].compute()\n'
+            'print(json.dumps(sorted(sys.modules)))').format(str(tmp_path / 'image.dm4'),
+                                                           str(tmp_path / 'series_1.ser'))
+    env = dict(os.environ, XICAM_NCEM_METRICS='1', XICAM_NCEM_CACHE_DIR=str(tmp_path / 'cache'))
+    out = subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.PIPE, env=env).stdout
+    modules = json.loads(out.decode().splitlines()[-1])
+    gui = ('qtpy', 'xicam.core', 'xicam.plugins')
+    assert [name for name in modules if any(name == heavy or name.startswith(heavy + '.') for heavy in gui)] == []
+
+
+def test_plugin_is_lazy():
+    import xicam.NCEM
+    from xicam.NCEM.plugin import NCEMPlugin
+
+    assert xicam.NCEM.NCEMPlugin is NCEMPlugin
+    assert 'NCEMPlugin' in dir(xicam.NCEM)
@@ -0,0 +1,60 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import tifffile
+
+from xicam.NCEM.indexer import Index, index_file
+
+from writers import write_dm4, write_ser
+
+
+def test_index_update(tmp_path):
+    root = tmp_path / 'data'
+    (root / 'day1').mkdir(parents=True)
+    dd = np.arange(4 * 10 * 12, dtype='<u2').reshape((4, 10, 12))
+    write_dm4(str(root / 'day1' / 'image.dm4'), dd)
+    write_ser(str(root / 'day1' / 'series_1.ser'), dd)
+    tifffile.imwrite(str(root / 'stack.tif'), dd, photometric='minisblack')
+    (root / 'notes.txt').write_text('not a data file')
+
+    with Index(tmp_path / 'index.sqlite') as index:
+        assert index.update(root, max_workers=2) == {'indexed': 4, 'unchanged': 0, 'removed': 0, 'errors': 0}
+        rows = index.search()
+        assert [row['mimetype'] for row in rows] == ['application/x-DM', 'application/x-SER', 'image/tiff']
+        assert all(row['error'] is None for row in rows), [row['error'] for row in rows]
+        assert all(json.loads(row['shape']) == [4, 10, 12] and row['dtype'] == 'uint16' for row in rows)
+        assert all(Path(row['thumbnail']).exists() for row in rows)
+
+        dm_row, = index.search(where='physical_size_x = ?', params=(0.5,))
+        assert dm_row['sample_name'] == 'image'
+
+        (root / 'stack.tif').unlink()
+        write_ser(str(root / 'day1' / 'series_1.ser'), dd[:2])
+        assert index.update(root, max_workers=2) == {'indexed': 1, 'unchanged': 2, 'removed': 1, 'errors': 0}
+        ser_row, = index.search(mimetype='application/x-SER')
+        assert json.loads(ser_row['shape']) == [2, 10, 12]
+
+
+def test_index_errors(tmp_path, caplog):
+    """ A file that looks like MRC but can not be read is indexed with its error and counted"""
+    root = tmp_path / 'data'
+    root.mkdir()
+    header = np.array([10, 10, 2, 1, 0, 0, 0, 10, 10, 2], dtype='<i4').tobytes()
+    (root / 'truncated.mrc').write_bytes(header + bytes(24))
+
+    with Index(tmp_path / 'index.sqlite') as index:
+        assert index.update(root, max_workers=1) == {'indexed': 1, 'unchanged': 0, 'removed': 0, 'errors': 1}
+        row, = index.search()
+        assert row['mimetype'] == 'application/x-MRC'
+        assert row['error'] is not None
+        assert row['shape'] is None
+    assert 'truncated.mrc' in caplog.text
+
+
+def test_index_removed_file(tmp_path):
+    """ A file that is removed between the walk and indexing gives an error row instead of aborting"""
+    row = index_file(str(tmp_path / 'gone.mrc'))
+    assert row['path'] == str((tmp_path / 'gone.mrc').resolve())
+    assert row['error'].startswith('FileNotFoundError')
+    assert row.get('size') is None
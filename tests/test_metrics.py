@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+import tifffile
+from ncempy.io import mrc
+
+from xicam.NCEM.ingestors import handles, metrics
+from xicam.NCEM.ingestors.MRCPlugin import ingest_NCEM_MRC
+from xicam.NCEM.ingestors.TIFPlugin import _get_slice
+
+
+@pytest.fixture
+def enabled():
+    metrics.reset()
+    metrics.enable(log_interval=None)
+    yield
+    metrics.disable()
+    metrics.reset()
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.setattr(metrics, '_enabled', False)
+    dd = np.zeros((2, 3))
+    assert metrics.instrument(dd, 'MRC', 'path') is dd
+    metrics.reset()
+    with metrics.measure('viewer', 'frame'):
+        pass
+    assert metrics.snapshot() == {}
+
+
+def test_reads(tmp_path, enabled):
+    dd = np.arange(4 * 30 * 20, dtype=np.float32).reshape(4, 30, 20)
+    path = str(tmp_path / 'stack.mrc')
+    mrc.mrcWriter(path, dd, (1, 1, 1))
+
+    docs = list(ingest_NCEM_MRC([path]))
+    data = docs[2][1]['data']['raw']
+    np.testing.assert_array_equal(data[1:3].compute(scheduler='synchronous'), dd[1:3])
+
+    stats = metrics.snapshot()
+    assert stats['MRC']['metadata']['count'] == 1
+    read = stats['MRC']['read']
+    assert read['count'] == 1
+    assert read['bytes'] == dd[1:3].nbytes  # dask reads only the requested frames of the block
+    assert sum(read['histogram'].values()) == 1
+    assert list(read['files']) == [path]
+    assert 'MRC read: 1 calls' in metrics.report()
+
+
+def test_open(tmp_path, enabled):
+    path = str(tmp_path / 'image.tif')
+    tifffile.imwrite(path, np.ones((2, 8, 8), dtype=np.uint16))
+    handles.pool.clear()
+
+    _get_slice(path, 0)
+    _get_slice(path, 1)
+    stats = metrics.snapshot()
+    assert stats['TIF']['open']['count'] == 1  # the handle is reused
+    assert stats['TIF']['read']['count'] == 2
+    assert stats['TIF']['read']['bytes'] == 2 * 8 * 8 * 2
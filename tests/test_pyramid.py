@@ -0,0 +1,42 @@
+import dask.array as da
+import numpy as np
+
+from xicam.NCEM.pyramid import FramePyramid, TILE_SIZE
+
+
+def test_levels():
+    dd = np.arange(2 * 2100 * 3000, dtype=np.uint16).reshape(2, 2100, 3000) % 997
+    pyramid = FramePyramid(da.from_array(dd, chunks=(1, 700, 3000)))
+    assert FramePyramid.wanted(dd.shape)
+    assert not FramePyramid.wanted((10, 512, 512))
+    assert pyramid.num_levels == 4
+    assert pyramid.level_for(0.5) == 0
+    assert pyramid.level_for(2.5) == 1
+    assert pyramid.level_for(100) == 3
+
+    level2 = pyramid.frame(1, 2)
+    assert level2.dtype == np.float32
+    np.testing.assert_allclose(level2, dd[1].reshape(525, 4, 750, 4).mean(axis=(1, 3)))
+
+    # Built from the cached level 2 and directly from the full resolution frame
+    level3 = pyramid.frame(1, 3)
+    pyramid.clear()
+    np.testing.assert_allclose(pyramid.frame(1, 3), level3)
+    np.testing.assert_allclose(level3, dd[1, :2096, :3000].reshape(262, 8, 375, 8).mean(axis=(1, 3)), rtol=1e-6)
+
+
+def test_region():
+    dd = np.arange(2100 * 3000, dtype=np.int32).reshape(2100, 3000)
+    pyramid = FramePyramid(dd, max_bytes=TILE_SIZE * TILE_SIZE * 4)
+
+    image, (y0, x0) = pyramid.region(0, 600, 700, 1100.5, 1900)
+    assert (y0, x0) == (512, 1024)
+    np.testing.assert_array_equal(image, dd[512:1024, 1024:2048])
+
+    # Clipped to the frame
+    image, (y0, x0) = pyramid.region(0, -10, 5000, 2900, 4000)
+    assert (y0, x0) == (0, 2560)
+    assert image.shape == (2100, 440)
+
+    # Only the most recent region fits in the cache
+    assert len(pyramid._cache) == 1
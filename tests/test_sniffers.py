@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+import tifffile
+from ncempy.io import emd, mrc
+
+from xicam.NCEM.ingestors import sniffers
+
+from writers import write_dm4, write_ser, write_velox
+
+SNIFFERS = [sniffers.dm_sniffer, sniffers.emd_sniffer, sniffers.mrc_sniffer, sniffers.ser_sniffer,
+            sniffers.tif_sniffer]
+
+
+def _sniff(path):
+    with open(path, 'rb') as f:
+        first_bytes = f.read(64)
+    return [mimetype for mimetype in (sniffer(str(path), first_bytes) for sniffer in SNIFFERS) if mimetype]
+
+
+@pytest.fixture
+def data():
+    return np.arange(4 * 10 * 12, dtype='<u2').reshape((4, 10, 12))
+
+
+def test_formats(tmp_path, data):
+    files = {}
+
+    files['application/x-DM'] = tmp_path / 'image.dm4'
+    write_dm4(str(files['application/x-DM']), data)
+
+    files['application/x-SER'] = tmp_path / 'image_1.ser'
+    write_ser(str(files['application/x-SER']), data)
+
+    files['image/tiff'] = tmp_path / 'image.tif'
+    tifffile.imwrite(str(files['image/tiff']), data)
+
+    files['application/x-MRC'] = tmp_path / 'image.mrc'
+    mrc.mrcWriter(str(files['application/x-MRC']), data.astype(np.float32), (1, 1, 1))
+
+    files['application/x-EMD'] = tmp_path / 'image.emd'
+    with emd.fileEMD(str(files['application/x-EMD']), readonly=False) as f0:
+        f0.put_emdgroup('data', data, emd.defaultDims(data))
+
+    files['application/x-EMD-VELOX'] = tmp_path / 'velox.emd'
+    write_velox(str(files['application/x-EMD-VELOX']), {'HAADF': data.transpose((1, 2, 0))})
+
+    for mimetype, path in files.items():
+        assert _sniff(path) == [mimetype], path
+
+    # The extension is not needed when the file contains the MRC2014 MAP string
+    renamed = files['application/x-MRC'].rename(tmp_path / 'image.dat')
+    with open(renamed, 'r+b') as f:
+        f.seek(208)
+        f.write(b'MAP ')
+    assert _sniff(renamed) == ['application/x-MRC']
+
+
+def test_not_ncem(tmp_path):
+    text = tmp_path / 'notes.mrc'
+    text.write_text('Not a data file ' * 10)
+    assert _sniff(text) == []
+
+
+def test_hdf5_probe_cached(tmp_path, data, monkeypatch):
+    path = tmp_path / 'velox.emd'
+    write_velox(str(path), {'HAADF': data.transpose((1, 2, 0))})
+    assert _sniff(path) == ['application/x-EMD-VELOX']
+
+    # A second sniff does not open the file
+    import h5py
+    monkeypatch.setattr(h5py, 'File', None)
+    assert _sniff(path) == ['application/x-EMD-VELOX']
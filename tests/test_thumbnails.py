@@ -0,0 +1,50 @@
+import dask.array as da
+import numpy as np
+from qtpy.QtGui import QImage
+
+from xicam.NCEM import thumbnails
+from xicam.NCEM.ingestors import cache
+from xicam.NCEM.ingestors.MRCPlugin import ingest_NCEM_MRC
+
+
+def test_stride():
+    assert thumbnails._stride((1024, 512), 2) == 8
+    assert thumbnails._stride((16384, 16384), 2) == 128
+    # 128 rows of 16k float32 pixels are 8 MB, so every 256th row is read
+    assert thumbnails._stride((16384, 16384), 4) == 256
+
+
+def test_thumbnail_array():
+    frame = da.from_array(np.arange(3 * 1000 * 500, dtype=np.float32).reshape(3, 1000, 500), chunks=(1, 100, 500))
+    image = thumbnails.thumbnail_array(frame)
+    assert image.shape == (125, 63)
+    assert image.dtype == np.uint8
+    assert image[0, 0] == 0 and image[-1, -1] == 255
+
+    assert thumbnails.thumbnail_array(np.full((10, 10), np.nan)).max() == 0
+
+
+def test_write_png(tmp_path):
+    image = np.arange(12 * 20, dtype=np.uint8).reshape(12, 20)
+    path = thumbnails.write_png(tmp_path / 'thumbnail.png', image)
+
+    qimage = QImage(str(path))
+    assert (qimage.width(), qimage.height()) == (20, 12)
+    assert qimage.pixelColor(3, 2).red() == image[2, 3]
+
+
+def test_thumbnail_for_run(tmp_path, cache_dir):
+    from databroker.in_memory import BlueskyInMemoryCatalog
+    from ncempy.io import mrc
+
+    mrc_path = tmp_path / 'stack.mrc'
+    mrc.mrcWriter(mrc_path, np.random.rand(3, 40, 50).astype(np.float32), (1, 1, 1))
+    docs = list(ingest_NCEM_MRC([str(mrc_path)]))
+    catalog = BlueskyInMemoryCatalog()
+    catalog.upsert(docs[0][1], docs[-1][1], lambda: iter(docs), [], {})
+    run = catalog[docs[0][1]['uid']]
+
+    path = thumbnails.thumbnail_for_run(run)
+    assert path == cache.thumbnail_path(mrc_path)
+    assert path.parent.parent == cache_dir
+    assert QImage(str(path)).size().width() == 50
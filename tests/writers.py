@@ -0,0 +1,139 @@
+""" Minimal writers of the formats that no library writes, shared by the tests and the benchmarks.
+
+Only the parts of each format read by ncempy and the NCEM ingestors are written.
+
+"""
+
+import json
+import struct
+
+import h5py
+import numpy as np
+
+
+# Minimal DM4 tag tree writer. Only the tags read by ncempy to locate the data are written.
+_DM_TYPES = {np.dtype('<u2'): (10, 4), np.dtype('<f4'): (2, 6), np.dtype('<u4'): (23, 5)}
+
+
+def _entry(label, payload, group=False):
+    label = label.encode('ascii')
+    return struct.pack('>BH', 20 if group else 21, len(label)) + label + struct.pack('>Q', len(payload)) + payload
+
+
+def _group(entries):
+    return struct.pack('>bbQ', 0, 0, len(entries)) + b''.join(entries)
+
+
+def _value(encoded_type, value):
+    np_type = {5: '<u4', 6: '<f4'}[encoded_type]
+    return b'%%%%' + struct.pack('>QQ', 1, encoded_type) + np.array(value, dtype=np_type).tobytes()
+
+
+def _array(encoded_type, data):
+    return b'%%%%' + struct.pack('>QQQQ', 3, 20, encoded_type, data.size) + data.tobytes()
+
+
+def _image(data, scale=0.5):
+    data_type, encoded_type = _DM_TYPES[data.dtype]
+    dims = data.shape[::-1]
+    calibrations = [_entry('', _group([_entry('Origin', _value(6, 0)),
+                                        _entry('Scale', _value(6, scale)),
+                                        _entry('Units', _array(4, np.frombuffer('nm'.encode('utf-16-le'), '<u2')))]),
+                           group=True) for _ in dims]
+    image_data = _group([_entry('Calibrations', _group([_entry('Dimension', _group(calibrations), group=True)]),
+                                group=True),
+                         _entry('Data', _array(encoded_type, data.ravel())),
+                         _entry('DataType', _value(5, data_type)),
+                         _entry('Dimensions', _group([_entry('', _value(5, d)) for d in dims]), group=True)])
+    image_tags = _group([_entry('Acquisition', _group([_entry('Exposure', _value(6, 1.5))]), group=True)])
+    return _entry('', _group([_entry('ImageData', image_data, group=True),
+                              _entry('ImageTags', image_tags, group=True)]), group=True)
+
+
+def write_dm4(fPath, data, thumbnail=True):
+    """ Write data to a minimal DM4 file, optionally preceded by an RGB thumbnail like files written by DM"""
+    images = [_image(data)]
+    if thumbnail:
+        images.insert(0, _image(np.zeros((8, 8), dtype='<u4')))
+    root = _group([_entry('ImageList', _group(images), group=True)])
+    with open(fPath, 'wb') as f:
+        f.write(struct.pack('>IQI', 4, 16 + len(root), 1) + root)
+
+
+def write_ser(fPath, frames, positions=None, gap=0):
+    """Write a minimal TIA SER file (version 0x0220) with a series of 2D images.
+
+    frames is [t, y, x]. If positions ([t, 2]) are given the tags include the x and y position.
+    gap adds padding bytes between data elements.
+
+    """
+    num_t, ny, nx = frames.shape
+    tag_type = 0x4142 if positions is not None else 0x4152
+    dims = np.array([num_t], dtype='<i4').tobytes() + np.array([0.0, 1.0], dtype='<f8').tobytes() + \
+        np.array([0, 0], dtype='<i4').tobytes() + np.array([0], dtype='<i4').tobytes()
+    head = np.array([0x4949, 0x0197, 0x0220], dtype='<i2').tobytes() + \
+        np.array([0x4122, tag_type, num_t, num_t], dtype='<i4').tobytes()
+    offset_array_offset = len(head) + 8 + 4 + len(dims)
+    data_start = offset_array_offset + 16 * num_t
+
+    elements = []
+    data_offsets = []
+    pos = data_start
+    for frame in frames:
+        cal = np.array([(0.0, 1e-10, 0), (0.0, 2e-10, 0)],
+                       dtype=[('o', '<f8'), ('d', '<f8'), ('e', '<i4')]).tobytes()
+        element = cal + np.array([2], dtype='<i2').tobytes() + np.array([nx, ny], dtype='<i4').tobytes() + \
+            np.flipud(frame).astype('<u2').tobytes() + b'\0' * gap
+        data_offsets.append(pos)
+        elements.append(element)
+        pos += len(element)
+
+    tags = []
+    tag_offsets = []
+    for t in range(num_t):
+        tag = np.array([tag_type, 1000 + t], dtype='<i4').tobytes()
+        if positions is not None:
+            tag += np.asarray(positions[t], dtype='<f8').tobytes()
+        tag_offsets.append(pos)
+        tags.append(tag)
+        pos += len(tag)
+
+    with open(fPath, 'wb') as f:
+        f.write(head)
+        f.write(np.array([offset_array_offset], dtype='<i8').tobytes())
+        f.write(np.array([1], dtype='<i4').tobytes())
+        f.write(dims)
+        f.write(np.array(data_offsets, dtype='<i8').tobytes())
+        f.write(np.array(tag_offsets, dtype='<i8').tobytes())
+        f.write(b''.join(elements))
+        f.write(b''.join(tags))
+    return fPath
+
+
+def velox_frame_metadata(t, detector='HAADF'):
+    return {'Acquisition': {'AcquisitionStartDatetime': {'DateTime': str(1600000000 + t)}},
+            'BinaryResult': {'Detector': detector,
+                             'PixelSize': {'width': '1e-10', 'height': '2e-10'},
+                             'PixelUnitX': 'm', 'PixelUnitY': 'm',
+                             'Offset': {'x': '0', 'y': '0'}},
+            'Stage': {'Position': {'x': str(1e-6 * t), 'y': '0', 'z': '0'}},
+            'Scan': {'DwellTime': '1e-6'}}
+
+
+def write_velox(fPath, datasets, chunks=None):
+    """Write a minimal Velox style EMD file. Each data set is stored as [y, x, t] with one
+    JSON metadata column per frame.
+
+    """
+    with h5py.File(fPath, 'w') as f0:
+        f0.create_dataset('Version', data=[json.dumps({'format': 'Velox', 'version': 2}).encode('ascii')])
+        images = f0.create_group('Data/Image')
+        for ii, (detector, dd) in enumerate(datasets.items()):
+            grp = images.create_group('{:032x}'.format(ii))
+            grp.create_dataset('Data', data=dd, chunks=chunks)
+            blobs = [json.dumps(velox_frame_metadata(t, detector)).encode('utf-8') for t in range(dd.shape[-1])]
+            meta = np.zeros((max(len(b) for b in blobs) + 10, len(blobs)), dtype=np.uint8)
+            for t, blob in enumerate(blobs):
+                meta[:len(blob), t] = np.frombuffer(blob, dtype=np.uint8)
+            grp.create_dataset('Metadata', data=meta)
+    return fPath
@@ -1,64 +1,25 @@
-import numpy as np
-from qtpy.QtCore import *
-from qtpy.QtGui import *
+""" The NCEM plugin for Xicam.
 
-from databroker.core import BlueskyRun
+Importing xicam.NCEM or its ingestors does not import Qt or the Xi-cam GUI so that batch workers
+can use the ingestors, the indexer and the exporters without a display. The GUI plugin is loaded
+from xicam.NCEM.plugin the first time it is accessed:
 
-#from xicam.core.data import NonDBHeader
+    from xicam.NCEM import NCEMPlugin
 
-from xicam.plugins import GUIPlugin, GUILayout
-from . import widgets
-
-from xicam.gui.widgets.tabview import TabView
+"""
 
 from . import ingestors  # necessary unused import; registers mimetypes
-from xicam.gui.widgets.metadataview import MetadataView
-
-from .ingestors import DMPlugin
-
-
-class NCEMPlugin(GUIPlugin):
-    name = 'NCEM'
-    sigLog = Signal(int, str, str, np.ndarray)
-
-    def __init__(self):
-        # Data model
-        self.catalogModel = QStandardItemModel()
-
-        # Selection model
-        self.selectionmodel = QItemSelectionModel(self.catalogModel)
-
-        # Setup TabViews
-        self.rawview = TabView(self.catalogModel, self.selectionmodel, widgets.NCEMViewerPlugin, 'primary', field='raw')
-
-        self.fftview = TabView(self.catalogModel, self.selectionmodel, widgets.FFTViewerPlugin, 'primary', field='raw')
-
-        #self.fourDview = TabView(self.headermodel, self.selectionmodel, widgets.FourDImageView, 'primary')
-
-        self.metadataview = MetadataView(self.catalogModel, self.selectionmodel, excludedkeys=('uid','descriptor','data'))
 
-        # self.toolbar = widgets.NCEMToolbar(self.catalogModel, self.selectionmodel)
+_LAZY = {'NCEMPlugin': 'plugin'}
 
-        self.stages = {
-            'View': GUILayout(self.rawview, right=self.metadataview ),  # top=self.toolbar, )),
-            # 'View': GUILayout(self.rawview, top=self.toolbar),
-            # '4D STEM': GUILayout(self.fourDview, ),
-            'FFT View': GUILayout(self.fftview, )
-        }
-        super(NCEMPlugin, self).__init__()
 
-    def appendCatalog(self, catalog: BlueskyRun, *args, **kwargs):
+def __getattr__(name):
+    # PEP 562: import the Qt parts of the package on first use
+    if name in _LAZY:
+        import importlib
+        return getattr(importlib.import_module('.' + _LAZY[name], __name__), name)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
 
-        displayName = ""
-        if 'sample_name' in catalog.metadata['start']:
-            displayName = catalog.metadata['start']['sample_name']
-        elif 'scan_id' in catalog.metadata['start']:
-            displayName = f"Scan: {catalog.metadata['start']['scan_id']}"
-        else:
-            displayName = f"UID: {catalog.metadata['start']['uid']}"
 
-        item = QStandardItem()
-        item.setData(displayName, Qt.DisplayRole)
-        item.setData(catalog, Qt.UserRole)
-        self.catalogModel.appendRow(item)
-        self.catalogModel.dataChanged.emit(item.index(), item.index())
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY))
@@ -0,0 +1,286 @@
+""" Part of the NCEM plugin for Xicam to convert microscope files for fast re-opening.
+
+SER, DM and Velox files are slow to browse because of how their frames are laid out on disk. A run
+produced by any of the NCEM ingestors can be written once to a chunked, compressed Zarr store or
+Berkeley EMD file and then opened through the same lazy machinery:
+
+    export_zarr(ingest_NCEM_SER(['series_1.ser']), 'series.zarr')
+    docs = ingest_NCEM_ZARR(['series.zarr'])
+
+    python -m xicam.NCEM.export series_1.ser series_2.ser series.zarr
+
+Notes:
+    - The frames are streamed block by block with dask.array.store. The whole data set is never
+      held in memory.
+    - Chunks are chosen for the viewer with chunking.viewer_chunks: one frame (or tile of a large
+      frame) per chunk and square tiles of scan positions for 4D-STEM data.
+    - Zarr stores are compressed with Blosc/zstd with bit shuffling. EMD files use gzip with the
+      HDF5 shuffle filter so that they can be read without extra HDF5 plugins.
+    - Zarr stores are written in the Zarr version 2 format with zarr 2 and zarr 3, so they can be
+      read with either.
+    - Zarr stores keep every stream including tables such as the SER frame times. EMD files keep
+      the frame streams and the metadata of the run.
+
+"""
+
+import argparse
+import importlib
+import numbers
+from pathlib import Path
+
+import dask.array as da
+import numpy as np
+
+try:
+    import zarr
+    from numcodecs import Blosc
+except ImportError:
+    zarr = None
+    ZARR_3 = False
+else:
+    ZARR_3 = int(zarr.__version__.split('.')[0]) >= 3
+
+from .indexer import INGESTORS, sniff
+from .ingestors import multifile
+from .ingestors.ZarrPlugin import FORMAT_VERSION
+from .ingestors.chunking import viewer_chunks
+
+# Start document keys that belong to the original run and not to the data
+RUN_KEYS = ('uid', 'time', 'scan_id')
+
+EMD_COMPRESSION = {'compression': 'gzip', 'compression_opts': 4, 'shuffle': True}
+
+
+def _jsonable(value):
+    """ A copy of value that can be stored as JSON in Zarr attributes"""
+    if isinstance(value, dict):
+        return {str(k): _jsonable(v) for k, v in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    elif isinstance(value, np.ndarray):
+        return _jsonable(value.tolist())
+    elif isinstance(value, np.generic):
+        return value.item()
+    elif isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    elif value is None or isinstance(value, (str, bool, numbers.Number)):
+        return value
+    return str(value)
+
+
+def _flatten(metadata, prefix=''):
+    """ Metadata as a flat dict of dotted keys with the values HDF5 attributes can hold"""
+    flat = {}
+    for key, value in metadata.items():
+        key = prefix + str(key)
+        if isinstance(value, dict):
+            flat.update(_flatten(value, key + '.'))
+        elif isinstance(value, (str, bool, numbers.Number, np.generic)):
+            flat[key] = value
+        elif isinstance(value, (list, tuple)) and value and all(isinstance(v, numbers.Number) for v in value):
+            flat[key] = np.asarray(value)
+    return flat
+
+
+def _streams(docs):
+    """ Collect the metadata, frame arrays and tables of a run from its documents.
+
+    Returns
+    -------
+    : tuple
+        (metadata, streams) where streams maps each stream name to a dict with the configuration
+        and data_keys of its descriptor and either the dask array 'raw' or the table 'columns'.
+
+    """
+    metadata = {}
+    streams = {}
+    descriptors = {}
+    for name, doc in docs:
+        if name == 'start':
+            metadata = {k: v for k, v in doc.items() if k not in RUN_KEYS}
+        elif name == 'descriptor':
+            descriptors[doc['uid']] = streams.setdefault(doc['name'], {
+                'configuration': doc.get('configuration', {}),
+                'data_keys': doc['data_keys']})
+        elif name == 'event':
+            raw = doc['data'].get('raw')
+            if not hasattr(raw, 'shape'):
+                raise ValueError('Only runs with the frames in the documents can be exported '
+                                 '(ingest with external=False)')
+            descriptors[doc['descriptor']]['raw'] = da.asarray(raw)
+        elif name == 'event_page':
+            columns = descriptors[doc['descriptor']].setdefault('columns', {})
+            for key, values in doc['data'].items():
+                columns.setdefault(key, []).extend(values)
+        elif name in ('resource', 'datum', 'datum_page'):
+            raise ValueError('Only runs with the frames in the documents can be exported '
+                             '(ingest with external=False)')
+    return metadata, streams
+
+
+def _create_array(group, name, compressor=None, **kwargs):
+    """ A new array in group with the zarr 2 API (create_dataset) or the zarr 3 API (create_array).
+
+    The default compressor of zarr is used if compressor is None.
+    """
+    if compressor is not None:
+        kwargs['compressors' if ZARR_3 else 'compressor'] = compressor
+    if ZARR_3:
+        return group.create_array(name, **kwargs)
+    return group.create_dataset(name, **kwargs)
+
+
+def export_zarr(docs, store_path, chunks=None, compressor=None, overwrite=False):
+    """ Write the run in docs to a Zarr directory store that can be read with ingest_NCEM_ZARR.
+
+    Parameters
+    ----------
+    docs : iterable
+        The (name, doc) pairs produced by an NCEM ingestor.
+    store_path : str or pathlib.Path
+        The directory of the Zarr store.
+    chunks : tuple or None
+        The chunk shape of the frames. None chooses chunks with viewer_chunks.
+    compressor : numcodecs.abc.Codec or None
+        The compressor of the frames. None uses Blosc with zstd and bit shuffling.
+    overwrite : bool
+        Replace an existing store at store_path.
+
+    """
+    if zarr is None:
+        raise ImportError('Exporting to Zarr requires zarr (pip install xicam.NCEM[zarr])')
+    if compressor is None:
+        compressor = Blosc(cname='zstd', clevel=3, shuffle=Blosc.BITSHUFFLE)
+
+    metadata, streams = _streams(docs)
+    mode = 'w' if overwrite else 'w-'
+    if ZARR_3:
+        root = zarr.open_group(str(store_path), mode=mode, zarr_format=2)
+    else:
+        root = zarr.open_group(str(store_path), mode=mode)
+    root.attrs.update({'ncem_zarr': FORMAT_VERSION, 'metadata': _jsonable(metadata), 'streams': list(streams)})
+
+    for stream_name, stream in streams.items():
+        group = root.create_group(stream_name)
+        group.attrs.update({'configuration': _jsonable(stream['configuration']),
+                            'data_keys': _jsonable(stream['data_keys'])})
+        if 'raw' in stream:
+            dask_data = stream['raw']
+            stream_chunks = chunks or viewer_chunks(dask_data.shape, dask_data.dtype)
+            target = _create_array(group, 'raw', shape=dask_data.shape, dtype=dask_data.dtype,
+                                   chunks=stream_chunks, compressor=compressor)
+            # Each dask block is exactly one Zarr chunk, so the blocks can be written without a lock
+            da.store(dask_data.rechunk(stream_chunks), target, lock=False)
+        for column, values in stream.get('columns', {}).items():
+            _create_array(group, column, data=np.asarray(values))
+
+    return root
+
+
+def _dims(shape, metadata):
+    """ The EMD dim vectors of a data set with the pixel size in metadata for the last two axes"""
+    dims = []
+    for ax, size in enumerate(shape):
+        dims.append([np.arange(size, dtype=np.float64), 'dim{}'.format(ax + 1), 'n'])
+    for ax, name in zip((-2, -1), ('Y', 'X')):
+        try:
+            step = float(metadata['PhysicalSize' + name])
+            origin = float(metadata.get('PhysicalSize{}Origin'.format(name), 0))
+        except (KeyError, TypeError, ValueError):
+            continue
+        dims[ax] = [origin + step * np.arange(shape[ax], dtype=np.float64), name.lower(),
+                    str(metadata.get('PhysicalSize{}Unit'.format(name), ''))]
+    return dims
+
+
+def export_emd(docs, emd_path, chunks=None, compression=None, overwrite=False):
+    """ Write the frame streams of the run in docs to a Berkeley EMD file.
+
+    Each frame stream becomes an emd_group_type 1 group in /data. The metadata of the run is
+    stored as attributes of /microscope with nested keys joined by dots.
+
+    Parameters
+    ----------
+    docs : iterable
+        The (name, doc) pairs produced by an NCEM ingestor.
+    emd_path : str or pathlib.Path
+        The EMD file to write.
+    chunks : tuple or None
+        The HDF5 chunk shape of the frames. None chooses chunks with viewer_chunks.
+    compression : dict or None
+        Keyword arguments for h5py.Group.create_dataset. None uses gzip with shuffling.
+    overwrite : bool
+        Replace an existing file at emd_path.
+
+    """
+    from ncempy.io import emd
+
+    emd_path = Path(emd_path)
+    if emd_path.exists():
+        if not overwrite:
+            raise FileExistsError('{} already exists'.format(emd_path))
+        emd_path.unlink()
+    if compression is None:
+        compression = EMD_COMPRESSION
+
+    metadata, streams = _streams(docs)
+    with emd.fileEMD(emd_path, readonly=False) as emd_obj:
+        emd_obj.microscope.attrs.update(_flatten(metadata))
+
+        for stream_name, stream in streams.items():
+            if 'raw' not in stream:
+                continue
+            dask_data = stream['raw']
+            if stream_name.startswith('primary_'):
+                label = stream_name[len('primary_'):]
+            else:
+                label = metadata.get('sample_name') or stream_name
+            configuration = {key: value['data'][key] for key, value in stream['configuration'].items()
+                             if key in value.get('data', {})}
+
+            group = emd_obj.data.create_group(label)
+            group.attrs['emd_group_type'] = 1
+            group.attrs.update(_flatten(configuration))
+            stream_chunks = chunks or viewer_chunks(dask_data.shape, dask_data.dtype)
+            target = group.create_dataset('data', shape=dask_data.shape, dtype=dask_data.dtype,
+                                          chunks=stream_chunks, **compression)
+            # h5py is not thread safe
+            da.store(dask_data.rechunk(stream_chunks), target, lock=True)
+            for ax, dim in enumerate(_dims(dask_data.shape, {**metadata, **configuration})):
+                emd_obj.write_dim('dim{}'.format(ax + 1), dim, group)
+
+
+def convert(paths, destination, overwrite=False, **kwargs):
+    """ Ingest the files in paths as one run and write it to destination.
+
+    The format is chosen from the suffix of destination: .zarr for a Zarr store and .emd for a
+    Berkeley EMD file. Extra keyword arguments are passed to export_zarr or export_emd.
+
+    """
+    paths = multifile.natural_sort([str(path) for path in paths])
+    mimetype = sniff(paths[0])
+    if mimetype not in INGESTORS:
+        raise ValueError('{} is not a file type the NCEM ingestors can read'.format(paths[0]))
+    module, name = INGESTORS[mimetype].split(':')
+    ingestor = getattr(importlib.import_module(module), name)
+
+    suffix = Path(destination).suffix.lower()
+    if suffix == '.zarr':
+        return export_zarr(ingestor(paths), destination, overwrite=overwrite, **kwargs)
+    elif suffix == '.emd':
+        return export_emd(ingestor(paths), destination, overwrite=overwrite, **kwargs)
+    raise ValueError('Unknown export format: {} (use .zarr or .emd)'.format(suffix))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', help='the files of one series')
+    parser.add_argument('destination', help='the .zarr store or .emd file to write')
+    parser.add_argument('--overwrite', action='store_true', help='replace an existing destination')
+    args = parser.parse_args()
+
+    convert(args.paths, args.destination, overwrite=args.overwrite)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+""" Part of the NCEM plugin for Xicam to show files that are still being written.
+
+During live acquisition a camera appends frames to an MRC, multi-page TIFF or EMD file. follow()
+watches such a file and yields the documents of a run whose primary stream gets an event_page each
+time new frames appear:
+
+    for name, doc in follow(path, should_stop=lambda: done):
+        ...  # 'start', 'descriptor', 'event_page', ..., 'stop'
+
+Each event in the stream is one [y, x] frame. Only the new frames are read on each poll, so the
+cost of an update does not depend on how long the file already is:
+
+    - MRC: the number of frames follows from the file size. New frames are memory mapped.
+    - TIFF: the chain of IFDs is walked from the last page that was seen. A page is only counted
+      once its IFD and data are completely written.
+    - Berkeley and Velox EMD: the HDF5 data set is refreshed (SWMR if the writer allows it) and
+      its length along the time axis is read.
+
+Notes:
+    - Files are polled with os.stat (every poll_interval seconds) so that this works the same on
+      every platform and on network file systems where inotify does not see remote writes.
+    - Only the first data set of EMD files is followed.
+
+"""
+
+import os
+import struct
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import event_model
+import h5py
+import numpy as np
+
+from . import indexer
+
+# Seconds between checks of the file size
+POLL_INTERVAL = 0.5
+
+# The most frames put in a single event_page
+MAX_PAGE_FRAMES = 64
+
+
+class MRCFrames:
+    """ The frames of an MRC file that is being written. Frames are counted from the file size."""
+
+    def __init__(self, path):
+        from ncempy.io import mrc
+
+        self.path = path
+        with mrc.fileMRC(path) as mrc_obj:
+            dtype = mrc_obj.dataType
+            self.frame_shape = tuple(int(ii) for ii in mrc_obj.dataSize[1:])
+            self._offset = int(mrc_obj.dataOffset)  # includes the extended header
+        if dtype is None:
+            raise ValueError('Can not follow MRC files of this mode: {}'.format(path))
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        self._frame_bytes = self.dtype.itemsize * int(np.prod(self.frame_shape))
+
+    def count(self):
+        return max(0, (os.path.getsize(self.path) - self._offset) // self._frame_bytes)
+
+    def read(self, start, stop):
+        # Copy the frames so that the memory map and its file are closed when this returns
+        return np.array(np.memmap(self.path, dtype=self.dtype, mode='r',
+                                  offset=self._offset + start * self._frame_bytes,
+                                  shape=(stop - start, *self.frame_shape)))
+
+    def close(self):
+        pass
+
+
+class TIFFrames:
+    """ The pages of a TIFF file that is being written.
+
+    The offsets of the complete pages are kept. Each count() reads the link to the next IFD from the
+    last complete page (writers update it when they append a page) and parses only the new IFDs.
+
+    """
+
+    def __init__(self, path):
+        import tifffile
+
+        self.path = path
+        self._offsets = []
+        self._link = None  # file position of the offset of the next IFD
+        with tifffile.TiffFile(path) as tif:
+            page = tif.pages[0]
+            self.frame_shape = tuple(page.shape)  # [y, x] or [y, x, samples] for RGB pages
+            self.dtype = np.dtype(page.dtype)
+            self._link = 4 if tif.tiff.version == 42 else 8  # after the (Big)TIFF header
+
+    def count(self):
+        import tifffile
+
+        try:
+            tif = tifffile.TiffFile(self.path)
+        except (tifffile.TiffFileError, OSError, ValueError):
+            return len(self._offsets)
+        with tif:
+            tiff = tif.tiff
+            fh = tif.filehandle
+            size = os.path.getsize(self.path)
+            while True:
+                fh.seek(self._link)
+                data = fh.read(tiff.offsetsize)
+                if len(data) < tiff.offsetsize:
+                    break
+                offset, = struct.unpack(tiff.offsetformat, data)
+                if offset == 0 or offset >= size:
+                    break
+                fh.seek(offset)
+                try:
+                    page = tifffile.TiffPage(tif, index=len(self._offsets))
+                except (tifffile.TiffFileError, struct.error, ValueError):
+                    break  # the IFD is not completely written yet
+                if any(o + n > size for o, n in zip(page.dataoffsets, page.databytecounts)):
+                    break
+                fh.seek(offset)
+                tagno, = struct.unpack(tiff.tagnoformat, fh.read(tiff.tagnosize))
+                self._offsets.append(offset)
+                self._link = offset + tiff.tagnosize + tagno * tiff.tagsize
+        return len(self._offsets)
+
+    def read(self, start, stop):
+        import tifffile
+
+        frames = np.empty((stop - start, *self.frame_shape), dtype=self.dtype)
+        with tifffile.TiffFile(self.path) as tif:
+            for ii, offset in enumerate(self._offsets[start:stop]):
+                tif.filehandle.seek(offset)
+                page = tifffile.TiffPage(tif, index=start + ii)
+                frames[ii] = page.asarray().reshape(self.frame_shape)
+        return frames
+
+    def close(self):
+        pass
+
+
+def _superblock_version(path):
+    """ The version of the HDF5 superblock that follows the signature at the start of the file"""
+    with open(path, 'rb') as f:
+        header = f.read(9)
+    return header[8] if len(header) == 9 else 0
+
+
+class HDF5Frames:
+    """ The frames of an EMD data set that is being written.
+
+    If the writer uses SWMR the file stays open and the data set is refreshed before each count.
+    Otherwise the file is opened for each count and read and closed again so that the writer can
+    reopen it to append. While the writer holds the file, opening it fails (HDF5 file locking) and
+    count returns the frames seen so far, so the file is tried again on the next poll.
+
+    """
+
+    def __init__(self, path, velox=False, dset_num=0):
+        self.path = path
+        self.velox = velox
+        self.dset_num = dset_num
+        self._file = None
+        self._dataset = None
+        if _superblock_version(path) >= 3:  # SWMR writers need a version 3 superblock
+            self._file = h5py.File(path, 'r', libver='latest', swmr=True)
+        with self._open() as dataset:
+            shape = dataset.shape
+            self.dtype = dataset.dtype
+        if len(shape) < 3:
+            self.frame_shape = shape
+        else:
+            self.frame_shape = shape[:2] if velox else shape[1:]
+        self._count = 0
+
+    @contextmanager
+    def _open(self):
+        if self._file is not None:
+            if self._dataset is None:
+                self._dataset = self._find_dataset(self._file)
+            self._dataset.refresh()
+            yield self._dataset
+            return
+        with h5py.File(self.path, 'r') as f:
+            yield self._find_dataset(f)
+
+    def _find_dataset(self, f):
+        if self.velox:
+            groups = list(f['Data/Image'].values())
+            return groups[self.dset_num]['Data']
+
+        # Berkeley EMD: emd_group_type 1 groups in the order ncempy finds them
+        found = []
+
+        def visit(group):
+            for name in group:
+                if group.get(name, getclass=True) == h5py.Group:
+                    item = group[name]
+                    if item.attrs.get('emd_group_type') == 1 and 'data' in item:
+                        found.append(item['data'])
+                    visit(item)
+
+        visit(f)
+        return found[self.dset_num]
+
+    def count(self):
+        try:
+            with self._open() as dataset:
+                if dataset.ndim < 3:
+                    self._count = 1
+                else:
+                    self._count = dataset.shape[-1] if self.velox else dataset.shape[0]
+        except OSError:
+            pass  # locked by the writer
+        return self._count
+
+    def read(self, start, stop):
+        with self._open() as dataset:
+            if dataset.ndim < 3:
+                return dataset[()][None]
+            if self.velox:
+                return np.moveaxis(dataset[:, :, start:stop], -1, 0)
+            return dataset[start:stop]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._dataset = None
+
+
+def open_frames(path, mimetype):
+    """ A frame source (with count, read and close) for a followed file of mimetype"""
+    if mimetype == 'application/x-MRC':
+        return MRCFrames(path)
+    if mimetype == 'image/tiff':
+        return TIFFrames(path)
+    if mimetype == 'application/x-EMD':
+        return HDF5Frames(path)
+    if mimetype == 'application/x-EMD-VELOX':
+        return HDF5Frames(path, velox=True)
+    raise ValueError('Can not follow files of type {}: {}'.format(mimetype, path))
+
+
+def _start_metadata(path, mimetype):
+    from .ingestors import EMDPlugin, MRCPlugin, TIFPlugin
+
+    metadata = {'application/x-MRC': MRCPlugin._metadata,
+                'image/tiff': TIFPlugin._metadata,
+                'application/x-EMD': EMDPlugin._metadata,
+                'application/x-EMD-VELOX': EMDPlugin._metadata_velox}[mimetype]
+    try:
+        start_doc = dict(metadata(path))
+    except (OSError, KeyError, ValueError):
+        # e.g. a file the writer still holds open without SWMR
+        start_doc = {}
+    start_doc['FileName'] = path
+    return start_doc
+
+
+def follow(path, mimetype=None, poll_interval=POLL_INTERVAL, idle_timeout=None, should_stop=None):
+    """ Yield the documents of a run that grows with the file at path.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        An MRC, TIFF or EMD file that frames are being appended to.
+    mimetype : str
+        The type of the file. It is sniffed from the file if not given.
+    poll_interval : float
+        Seconds to wait between checks for new frames.
+    idle_timeout : float
+        Stop after this many seconds without new frames. None follows until should_stop returns True.
+    should_stop : callable
+        Called before each poll. The run is stopped once it returns True.
+
+    """
+    path = str(path)
+    if mimetype is None:
+        mimetype = indexer.sniff(path)
+    frames = open_frames(path, mimetype)
+
+    try:
+        run_bundle = event_model.compose_run()  # type: event_model.ComposeRunBundle
+        start_doc = _start_metadata(path, mimetype)
+        start_doc.update(run_bundle.start_doc)
+        start_doc['sample_name'] = Path(path).resolve().stem
+        start_doc['live'] = True
+        yield 'start', start_doc
+
+        frame_data_keys = {'raw': {'source': 'NCEM',
+                                   'dtype': 'number',
+                                   'shape': list(frames.frame_shape)}}
+        frame_stream_bundle = run_bundle.compose_descriptor(data_keys=frame_data_keys, name='primary')
+        yield 'descriptor', frame_stream_bundle.descriptor_doc
+
+        num_read = 0
+        last_change = time.monotonic()
+        while True:
+            num_t = frames.count()
+            if num_t > num_read:
+                last_change = time.monotonic()
+            while num_read < num_t:
+                stop = min(num_t, num_read + MAX_PAGE_FRAMES)
+                try:
+                    data = frames.read(num_read, stop)
+                except OSError:
+                    break  # e.g. the writer locked the HDF5 file after it was counted; read on the next poll
+                now = time.time()
+                yield 'event_page', frame_stream_bundle.compose_event_page(
+                    data={'raw': list(data)},
+                    timestamps={'raw': [now] * len(data)},
+                    seq_num=list(range(num_read + 1, stop + 1)),
+                    time=[now] * len(data))
+                num_read = stop
+
+            if should_stop is not None and should_stop():
+                break
+            if idle_timeout is not None and time.monotonic() - last_change > idle_timeout:
+                break
+            time.sleep(poll_interval)
+
+        yield 'stop', run_bundle.compose_stop()
+    finally:
+        frames.close()
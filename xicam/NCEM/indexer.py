@@ -0,0 +1,258 @@
+""" Part of the NCEM plugin for Xicam to index directories of microscope files into a SQLite catalog.
+
+The indexer walks a directory tree, identifies each file with the NCEM sniffers and describes it by
+running the matching ingestor up to its first event. The metadata comes from the ingestors'
+_metadata functions and the only pixel data read is a subsample of the first frame for the
+thumbnail (see thumbnails.py). Files are described on a process pool and the results are
+written to the index as they arrive. Files whose size, modification time and inode have not
+changed since the last run are skipped, and files that were removed are dropped from the index.
+Files that can not be described are indexed with the exception in the error column, logged and
+counted in the result of Index.update.
+
+Usage:
+    python -m xicam.NCEM.indexer /path/to/data --db index.sqlite --workers 8
+
+    index = Index('index.sqlite')
+    index.update('/path/to/data')
+    rows = index.search(mimetype='application/x-DM', where='voltage > ?', params=(200e3,))
+
+"""
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import dask
+
+from . import thumbnails
+from .ingestors import cache, sniffers
+
+logger = logging.getLogger(__name__)
+
+# The ingestor for each MIME type returned by the sniffers (see setup.py)
+INGESTORS = {'application/x-DM': 'xicam.NCEM.ingestors.DMPlugin:ingest_NCEM_DM',
+             'application/x-EMD': 'xicam.NCEM.ingestors.EMDPlugin:ingest_NCEM_EMD',
+             'application/x-EMD-VELOX': 'xicam.NCEM.ingestors.EMDPlugin:ingest_NCEM_EMD_VELOX',
+             'application/x-MRC': 'xicam.NCEM.ingestors.MRCPlugin:ingest_NCEM_MRC',
+             'application/x-SER': 'xicam.NCEM.ingestors.SERPlugin:ingest_NCEM_SER',
+             'image/tiff': 'xicam.NCEM.ingestors.TIFPlugin:ingest_NCEM_TIF'}
+
+SNIFFERS = (sniffers.dm_sniffer, sniffers.ser_sniffer, sniffers.emd_sniffer, sniffers.mrc_sniffer,
+            sniffers.tif_sniffer)
+
+# Microscope settings stored in their own columns. Each is looked up in the start document by the
+# keys used in DM tags, Velox metadata, TIA (SER/EMI) and FEI MRC headers.
+SETTINGS = {'voltage': ('Microscope Info.Voltage', 'Optics.AccelerationVoltage', 'High tension_kV', 'ht'),
+            'magnification': ('Microscope Info.Indicated Magnification', 'Optics.NominalMagnification',
+                              'Magnification_x', 'magnification'),
+            'camera_length': ('Microscope Info.STEM Camera Length', 'Optics.CameraLength', 'Camera length_m',
+                              'camera length'),
+            'exposure': ('Acquisition.Parameters.High Level.Exposure (s)', 'Scan.DwellTime', 'Dwell time_s',
+                         'integration time')}
+
+COLUMNS = ('path', 'size', 'mtime_ns', 'inode', 'mimetype', 'sample_name', 'shape', 'dtype',
+           'physical_size_x', 'physical_size_y', 'physical_size_unit', *SETTINGS, 'thumbnail', 'indexed',
+           'error')
+
+
+def sniff(path):
+    """ The NCEM MIME type of the file at path or None"""
+    with open(path, 'rb') as f:
+        first_bytes = f.read(64)
+    for sniffer in SNIFFERS:
+        mimetype = sniffer(str(path), first_bytes)
+        if mimetype:
+            return mimetype
+
+
+def _lookup(metadata, key):
+    # Flat keys (DM, SER) are tried first, then nested dicts (Velox)
+    if key in metadata:
+        return metadata[key]
+    value = metadata
+    for part in key.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def describe(path, mimetype):
+    """ Run the ingestor for path up to its first event, summarize the documents and make a thumbnail"""
+    module, name = INGESTORS[mimetype].split(':')
+    ingestor = getattr(importlib.import_module(module), name)
+
+    row = {}
+    for doc_name, doc in ingestor([str(path)]):
+        if doc_name == 'start':
+            row['sample_name'] = doc.get('sample_name')
+            row['physical_size_x'] = _number(doc.get('PhysicalSizeX'))
+            row['physical_size_y'] = _number(doc.get('PhysicalSizeY'))
+            row['physical_size_unit'] = doc.get('PhysicalSizeXUnit')
+            for column, keys in SETTINGS.items():
+                row[column] = next((v for v in (_number(_lookup(doc, key)) for key in keys) if v is not None),
+                                   None)
+        elif doc_name == 'event':
+            raw = doc['data']['raw']
+            row['shape'] = json.dumps([int(ii) for ii in raw.shape])
+            row['dtype'] = str(raw.dtype)
+            row['thumbnail'] = str(thumbnails.make_thumbnail(path, raw))
+            break
+    return row
+
+
+def index_file(path):
+    """ Sniff and describe one file. This runs in the worker processes."""
+    row = {'path': str(Path(path).resolve()), 'indexed': time.time()}
+    try:
+        # A file can be removed or replaced after the walk that found it
+        row['path'], row['size'], row['mtime_ns'], row['inode'] = cache.file_identity(path)
+        row['mimetype'] = sniff(path)
+        if row['mimetype'] is not None:
+            # Files are read in parallel by the processes. A forked worker can not use the
+            # thread pool of the parent, so the thumbnail is computed in the worker thread.
+            with dask.config.set(scheduler='synchronous'):
+                row.update(describe(path, row['mimetype']))
+    except Exception as ex:
+        row['error'] = '{}: {}'.format(type(ex).__name__, ex)
+    return row
+
+
+class Index:
+    """ A SQLite catalog of the microscope files in one or more directory trees.
+
+    Parameters
+    ----------
+    db_path : str or pathlib.Path or None
+        The data base file. None uses index.sqlite in the NCEM cache directory.
+
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = Path(db_path) if db_path is not None else cache.CACHE_DIR / 'index.sqlite'
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, '
+                               'mtime_ns INTEGER, inode INTEGER, mimetype TEXT, sample_name TEXT, shape TEXT, '
+                               'dtype TEXT, physical_size_x REAL, physical_size_y REAL, physical_size_unit TEXT, '
+                               '{}, thumbnail TEXT, indexed REAL, error TEXT)'.format(
+                                   ', '.join('{} REAL'.format(column) for column in SETTINGS)))
+            self._conn.execute('CREATE INDEX IF NOT EXISTS files_mimetype ON files (mimetype)')
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+    def update(self, root, max_workers=None, batch_size=256):
+        """ Index the files under root that are new or changed since the last update.
+
+        Returns
+        -------
+        : dict
+            The number of files that were indexed, skipped as unchanged and removed, and the number of
+            the indexed files that could not be described (see the error column).
+
+        """
+        prefix = str(Path(root).resolve()) + os.sep
+        known = {row['path']: (row['size'], row['mtime_ns'], row['inode'])
+                 for row in self._conn.execute('SELECT path, size, mtime_ns, inode FROM files '
+                                               'WHERE substr(path, 1, ?) = ?', (len(prefix), prefix))}
+        changed = []
+        unchanged = 0
+        for dir_path, _, file_names in os.walk(prefix):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                try:
+                    resolved, *identity = cache.file_identity(path)
+                except OSError:
+                    continue
+                if known.pop(resolved, None) == tuple(identity):
+                    unchanged += 1
+                else:
+                    changed.append(path)
+
+        with self._conn:
+            self._conn.executemany('DELETE FROM files WHERE path = ?', [(path,) for path in known])
+
+        rows = []
+        errors = 0
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for future in as_completed([executor.submit(index_file, path) for path in changed]):
+                rows.append(future.result())
+                if rows[-1].get('error') is not None:
+                    errors += 1
+                    logger.warning('Could not index %s: %s', rows[-1]['path'], rows[-1]['error'])
+                if len(rows) >= batch_size:
+                    self._write(rows)
+                    rows = []
+        self._write(rows)
+
+        return {'indexed': len(changed), 'unchanged': unchanged, 'removed': len(known), 'errors': errors}
+
+    def search(self, where=None, params=(), order_by='path', **columns):
+        """ Rows of indexed NCEM files as dicts.
+
+        Keyword arguments select rows with equal column values. where is an extra SQL condition
+        with ? placeholders for params, e.g. search(where='voltage >= ?', params=(300e3,)).
+
+        """
+        conditions = ['mimetype IS NOT NULL']
+        values = []
+        for column, value in columns.items():
+            if column not in COLUMNS:
+                raise ValueError('Unknown column: {}'.format(column))
+            conditions.append('{} = ?'.format(column))
+            values.append(value)
+        if where:
+            conditions.append('({})'.format(where))
+            values.extend(params)
+        if order_by not in COLUMNS:
+            raise ValueError('Unknown column: {}'.format(order_by))
+        query = 'SELECT * FROM files WHERE {} ORDER BY {}'.format(' AND '.join(conditions), order_by)
+        return [dict(row) for row in self._conn.execute(query, values)]
+
+    def _write(self, rows):
+        if not rows:
+            return
+        with self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO files ({}) VALUES ({})'.format(
+                ', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))),
+                [tuple(row.get(column) for column in COLUMNS) for row in rows])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('root', nargs='+', help='directories to index')
+    parser.add_argument('--db', default=None, help='the index file (default: the NCEM cache directory)')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    args = parser.parse_args()
+
+    with Index(args.db) as index:
+        for root in args.root:
+            counts = index.update(root, max_workers=args.workers)
+            print('{}: {indexed} indexed ({errors} errors), {unchanged} unchanged, {removed} removed'.format(
+                root, **counts))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,161 +1,213 @@
+""" Part of the NCEM plugin for Xicam to read Digital Micrograph DM3 and DM4 files.
+
+Notes:
+    - The tag tree is parsed once per file without loading the file into memory. The raw data is
+      then memory mapped from its offset in the file, so multi-gigabyte files (e.g. 4D-STEM) are
+      only read as frames are accessed.
+    - Image series are returned as [t, y, x] and chunked by whole frames. 4D data sets are
+      returned as [scan_y, scan_x, ky, kx] and chunked by scan rows.
+    - ingest_NCEM_DM(paths, on_memory=True) reads the data into memory instead. This can be faster
+      for small files on network file systems.
+    - Only the ImageTags and ImageData tags of the image are kept as metadata. The tags are
+      filtered by tag_filter in a single pass. Set the XICAM_NCEM_DM_TAG_FILTER environment variable
+      to a JSON file with any of the TagFilter arguments to change the rules, e.g.
+      {"deny": ["Private", "Frame.Intensity"], "max_tags": 1000}.
+
+"""
+
 import functools
-import event_model
+import json
+import logging
+import os
+import re
 from pathlib import Path
-import time
-import dask
-import dask.array as da
+import numpy as np
 
-from ncempy.io import dm
+from . import cache, frames, lazy, metrics, multifile, resources
 
+event_model = lazy.LazyModule('event_model')
+dm = lazy.LazyModule('ncempy.io.dm')
 
-def _num_z(dm_obj):
-    """ The number of slices along axis 1 (start at 0) (C-ordering)
-    for 4D data sets. Not used for 3D data sets
+logger = logging.getLogger(__name__)
 
-    Only used for 4D data sets
-    """
 
-    if dm_obj.thumbnail:
-        out = dm_obj.zSize2[1]
-    else:
-        out = dm_obj.zSize2[0]
-    return int(out)
+class TagFilter:
+    """ Select the DM tags kept as metadata in a single pass over the tag tree.
 
+    Parameters
+    ----------
+    roots : tuple of str
+        The tag groups of an image that are kept. Keys in the metadata are relative to these groups.
+    deny : tuple of str
+        Tags containing any of these strings are dropped.
+    allow : tuple of str or None
+        If set, only tags starting with one of these strings (relative to the root group) are kept.
+    max_tags : int
+        The maximum number of tags kept.
+    max_bytes : int
+        The maximum approximate size in bytes of the kept keys and values.
 
-def _num_t(dm_obj):
-    """ The number of slices in the first dimension (C-ordering) for 3D
-    datasets
+    """
 
-    This is the number of slices along the "Z" axis. For a 3D volume
-    this is is a slice long Z. For an image stack this is the requested
-    image in the stack.
+    def __init__(self, roots=('ImageTags.', 'ImageData.'),
+                 deny=('frame sequence', 'Private', 'Reference Images', 'Frame.Intensity', 'Area.Transform',
+                       'Parameters.Objects', 'Device.Parameters'),
+                 allow=None, max_tags=10000, max_bytes=1024 ** 2):
+        self.roots = tuple(roots)
+        self.deny = tuple(deny)
+        self.allow = None if allow is None else tuple(allow)
+        self.max_tags = max_tags
+        self.max_bytes = max_bytes
+        self._deny = re.compile('|'.join(re.escape(ii) for ii in self.deny)) if self.deny else None
+
+    def __call__(self, tags, image_index):
+        """ Filter a dict of DM tags (fileDM.allTags) for the image at image_index (ImageList.{image_index})"""
+        root = re.compile('{}(?:{})'.format(re.escape('.ImageList.{}.'.format(image_index)),
+                                            '|'.join(re.escape(ii) for ii in self.roots)))
+        deny = self._deny.search if self._deny else None
+        out = {}
+        size = 0
+        dropped = 0
+        for kk, ii in tags.items():
+            match = root.match(kk)
+            if match is None:
+                continue
+            sub = kk[match.end():]
+            if deny and deny(sub):
+                continue
+            if self.allow is not None and not sub.startswith(self.allow):
+                continue
+            nbytes = len(sub) + (ii.nbytes if hasattr(ii, 'nbytes') else len(str(ii)))
+            if len(out) >= self.max_tags or size + nbytes > self.max_bytes:
+                dropped += 1
+                continue
+            out[sub] = ii
+            size += nbytes
+
+        if dropped:
+            logger.warning('Dropped %d DM tags over the metadata limit of %d tags or %d bytes (kept %d tags, '
+                           '%d bytes)', dropped, self.max_tags, self.max_bytes, len(out), size)
+        return out
+
+
+def _load_tag_filter():
+    """ The TagFilter configured by the JSON file in XICAM_NCEM_DM_TAG_FILTER or the default filter"""
+    config_path = os.environ.get('XICAM_NCEM_DM_TAG_FILTER')
+    if not config_path:
+        return TagFilter()
+    with open(config_path) as f:
+        return TagFilter(**json.load(f))
+
+
+# The filter used by the ingestor. Replace it to change the rules in a running session.
+tag_filter = _load_tag_filter()
+
+
+def _layout(dm_obj):
+    """ The offset, dtype and shape of the raw image data in the file
+
+    The thumbnail (if any) is skipped. The shape is C-ordered as [t, y, x] for images and image
+    series and [scan_y, scan_x, ky, kx] for 4D data sets.
 
     """
+    ii = 0 if dm_obj.numObjects == 1 else 1
+    dtype = np.dtype(dm_obj._DM2NPDataType(dm_obj.dataType[ii])).newbyteorder('<')
+    shape = (int(dm_obj.zSize2[ii]), int(dm_obj.zSize[ii]), int(dm_obj.ySize[ii]), int(dm_obj.xSize[ii]))
+    if shape[0] == 1:
+        shape = shape[1:]
+    return int(dm_obj.dataOffset[ii]), dtype, shape
+
+
+def _metadata_from_dm(dm1):
+    # Only keep the most useful tags as meta data
+    metaData = tag_filter(dm1.allTags, dm1.numObjects)
+
+    # Store the X and Y pixel size, offset and unit
+    try:
+        metaData['PhysicalSizeX'] = metaData['Calibrations.Dimension.1.Scale']
+        metaData['PhysicalSizeXOrigin'] = metaData['Calibrations.Dimension.1.Origin']
+        metaData['PhysicalSizeXUnit'] = metaData['Calibrations.Dimension.1.Units']
+        metaData['PhysicalSizeY'] = metaData['Calibrations.Dimension.2.Scale']
+        metaData['PhysicalSizeYOrigin'] = metaData['Calibrations.Dimension.2.Origin']
+        metaData['PhysicalSizeYUnit'] = metaData['Calibrations.Dimension.2.Units']
+    except:
+        metaData['PhysicalSizeX'] = 1
+        metaData['PhysicalSizeXOrigin'] = 0
+        metaData['PhysicalSizeXUnit'] = ''
+        metaData['PhysicalSizeY'] = 1
+        metaData['PhysicalSizeYOrigin'] = 0
+        metaData['PhysicalSizeYUnit'] = ''
 
-    if dm_obj.thumbnail:
-        out = dm_obj.zSize[1]
-    else:
-        out = dm_obj.zSize[0]
-    return int(out)
+    return metaData
 
 
-def get_slice(dm_obj, z, t):
-    return dm_obj.getSlice(0, z, t)['data']
+@cache.cached_metadata
+@metrics.timed('DM', 'metadata')
+def _header(path):
+    """ Parse the tag tree once and return the metadata and the layout of the raw data"""
+    with dm.fileDM(path, on_memory=False) as dm1:
+        return _metadata_from_dm(dm1), _layout(dm1)
 
 
-@functools.lru_cache(maxsize=10, typed=False)
 def _metadata(path):
-    metaData = {}
-    with dm.fileDM(path, on_memory=True) as dm1:
-        # Save most useful metaData
-
-        # Only keep the most useful tags as meta data
-        for kk, ii in dm1.allTags.items():
-            # Most useful starting tags
-            prefix1 = 'ImageList.{}.ImageTags.'.format(dm1.numObjects)
-            prefix2 = 'ImageList.{}.ImageData.'.format(dm1.numObjects)
-            pos1 = kk.find(prefix1)
-            pos2 = kk.find(prefix2)
-            if pos1 > -1:
-                sub = kk[pos1 + len(prefix1):]
-                metaData[sub] = ii
-            elif pos2 > -1:
-                sub = kk[pos2 + len(prefix2):]
-                metaData[sub] = ii
-
-            # Remove unneeded keys
-            for jj in list(metaData):
-                if jj.find('frame sequence') > -1:
-                    del metaData[jj]
-                elif jj.find('Private') > -1:
-                    del metaData[jj]
-                elif jj.find('Reference Images') > -1:
-                    del metaData[jj]
-                elif jj.find('Frame.Intensity') > -1:
-                    del metaData[jj]
-                elif jj.find('Area.Transform') > -1:
-                    del metaData[jj]
-                elif jj.find('Parameters.Objects') > -1:
-                    del metaData[jj]
-                elif jj.find('Device.Parameters') > -1:
-                    del metaData[jj]
-
-        # Store the X and Y pixel size, offset and unit
-        try:
-            metaData['PhysicalSizeX'] = metaData['Calibrations.Dimension.1.Scale']
-            metaData['PhysicalSizeXOrigin'] = metaData['Calibrations.Dimension.1.Origin']
-            metaData['PhysicalSizeXUnit'] = metaData['Calibrations.Dimension.1.Units']
-            metaData['PhysicalSizeY'] = metaData['Calibrations.Dimension.2.Scale']
-            metaData['PhysicalSizeYOrigin'] = metaData['Calibrations.Dimension.2.Origin']
-            metaData['PhysicalSizeYUnit'] = metaData['Calibrations.Dimension.2.Units']
-        except:
-            metaData['PhysicalSizeX'] = 1
-            metaData['PhysicalSizeXOrigin'] = 0
-            metaData['PhysicalSizeXUnit'] = ''
-            metaData['PhysicalSizeY'] = 1
-            metaData['PhysicalSizeYOrigin'] = 0
-            metaData['PhysicalSizeYUnit'] = ''
-
-        metaData['FileName'] = path
+    return _header(path)[0]
 
-    return metaData
 
+def _memmap(path):
+    """ A read-only memory map of the raw data"""
+    offset, dtype, shape = _header(path)[1]
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
 
-def ingest_NCEM_DM(paths):
-    assert len(paths) == 1
+
+def _source(path, on_memory=False):
+    """ The raw data memory mapped from the file (or read into memory if on_memory).
+
+    The memory map is borrowed from the handle pool for each read and the frames are copied out
+    of it, so no file is held open between reads.
+
+    """
+    if on_memory:
+        with dm.fileDM(path, on_memory=True) as dm1:
+            offset, dtype, shape = _layout(dm1)
+            data = np.array(dm1.getDataset(0)['data']).reshape(shape)
+        return frames.ArraySource(path, data, 'DM', frame_axes=(-2, -1))
+    return frames.PooledSource(path, _memmap, 'DM', frame_axes=(-2, -1))
+
+
+def _dask_data(path, on_memory=False):
+    """ A lazy dask array of the raw data"""
+    return _source(path, on_memory=on_memory).to_dask()
+
+
+def ingest_NCEM_DM(paths, on_memory=False, external=False):
+    paths = multifile.natural_sort(paths)
     path = paths[0]
 
     # Compose run start
     run_bundle = event_model.compose_run()  # type: event_model.ComposeRunBundle
     start_doc = _metadata(path)
+    start_doc['FileName'] = path
     start_doc.update(run_bundle.start_doc)
     start_doc["sample_name"] = Path(paths[0]).resolve().stem
+    start_doc['FileNames'] = [str(p) for p in paths]
     yield 'start', start_doc
 
-    dm_handle = dm.fileDM(path, on_memory=True)
-    num_t = _num_t(dm_handle)
-    num_z = _num_z(dm_handle)
-    first_frame = dm_handle.getSlice(0, 0, sliceZ2=0)['data']  # Most DM files have only 1 dataset
-    shape = first_frame.shape
-    dtype = first_frame.dtype
-
-    delayed_get_slice = dask.delayed(get_slice)
-    if num_z > 1:
-        dask_data = da.stack([[da.from_delayed(delayed_get_slice(dm_handle, t, z), shape=shape, dtype=dtype)
-                               for z in range(num_z)]
-                              for t in range(num_t)])
-    else:
-        dask_data = da.stack([da.from_delayed(delayed_get_slice(dm_handle, t, 0), shape=shape, dtype=dtype)
-                               for t in range(num_t)])
-
-    # Compose descriptor
-    source = 'NCEM'
-    frame_data_keys = {'raw': {'source': source,
-                               'dtype': 'number',
-                               'shape': dask_data.shape}}
-    frame_stream_name = 'primary'
-    frame_stream_bundle = run_bundle.compose_descriptor(data_keys=frame_data_keys,
-                                                        name=frame_stream_name,
-                                                        # configuration=_metadata(path)
-                                                        )
-    yield 'descriptor', frame_stream_bundle.descriptor_doc
-
-    # NOTE: Resource document may be meaningful in the future. For transient access it is not useful
-    # # Compose resource
-    # resource = run_bundle.compose_resource(root=Path(path).root, resource_path=path, spec='NCEM_DM', resource_kwargs={})
-    # yield 'resource', resource.resource_doc
-
-    # Compose datum_page
-    # z_indices, t_indices = zip(*itertools.product(z_indices, t_indices))
-    # datum_page_doc = resource.compose_datum_page(datum_kwargs={'index_z': list(z_indices), 'index_t': list(t_indices)})
-    # datum_ids = datum_page_doc['datum_id']
-    # yield 'datum_page', datum_page_doc
-
-    yield 'event', frame_stream_bundle.compose_event(data={'raw': dask_data},
-                                                     timestamps={'raw': time.time()})
+    sources = multifile.map_headers(functools.partial(_source, on_memory=on_memory), paths)
+    dask_data = multifile.concatenate(sources, paths).to_dask()
+    yield from frames.compose_stream(run_bundle, dask_data, paths, [len(source) for source in sources], 'NCEM_DM',
+                                     external=external, resource_kwargs={'on_memory': on_memory})
 
     yield 'stop', run_bundle.compose_stop()
 
 
+class DMHandler(resources.FrameHandler):
+    """ Serves the frames of a DM3/DM4 file referenced by a NCEM_DM resource"""
+
+    specs = {'NCEM_DM'}
+
+    def _open(self, path, on_memory=False):
+        return _dask_data(path, on_memory=on_memory)
+
+
 if __name__ == "__main__":
     print(list(ingest_NCEM_DM(["/home/rp/data/NCEM/01_TimeSeriesImages_20images(1).dm3"])))
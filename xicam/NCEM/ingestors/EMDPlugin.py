@@ -9,29 +9,30 @@ and then a Velox file.
 The files are parsed using the ncempy.io.fileEMD or the ncempy.io.fileEMDVelox class.
 
 Notes:
-    - Currently only loads the first data set in an EMD file.
+    - Each data set (Berkeley EMD group or Velox detector) is loaded as its own stream.
     - Supports 2D and 3D data sets (3D as C-style ordering) [t,y,x].
-    - 4D datasets are loaded with the first index (C-ordering) set to 0.
+    - 4D datasets are loaded lazily as C-style ordering [scan_y, scan_x, ky, kx].
 
 """
 
 import json
 import functools
 import time
-import dask
-import dask.array as da
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import numpy as np
 from collections.abc import Iterable
 import numbers
 
-import event_model
-from xicam.core import msg
-
 from numpy import where as npwhere
 from numpy import ndarray as ndarray
-from ncempy.io import emd  # EMD Berkeley datasets
-from ncempy.io import emdVelox  # EMD Velox datasets
+
+from . import cache, frames, lazy, metrics, resources
+from .sniffers import emd_sniffer  # noqa: F401 (moved to sniffers with the other formats)
+
+event_model = lazy.LazyModule('event_model')
+emd = lazy.LazyModule('ncempy.io.emd')  # EMD Berkeley datasets
+emdVelox = lazy.LazyModule('ncempy.io.emdVelox')  # EMD Velox datasets
 
 
 def _guess_type(value):
@@ -49,41 +50,43 @@ def _guess_type(value):
         return None
 
 
-def _num_t(emd_obj, dset_num=0):
-    """ The number of slices in the first dimension (C-ordering) for Berkeley data sets
-    OR
-    The number of slices in the last dimension (F-ordering) for Velox data sets
-
-    """
-
-    dataGroup = emd_obj.list_emds[dset_num]
-    dataset0 = dataGroup['data']
-    shape = dataset0.shape
-
-    if len(shape) < 3:
-        out = 1
-    else:
-        # EMD Berkeley
-        out = shape[0]  # Velox files are written incorrectly using Fortran ordering
-
-    return out
-
-
 def _num_datasets(emd_obj):
     return len(emd_obj.list_emds)
 
 
-def _get_slice(emd_obj, t, dset_num=0):
+@metrics.timed('EMD', 'read')
+def _get_slice(emd_obj, t, dset_num=0, z=0):
+    """ Read one frame. For 4D data sets t and z are the scan_y and scan_x positions.
+
+    """
     dataset0 = emd_obj.list_emds[dset_num]['data']  # get the dataset in the first group found
     if dataset0.ndim == 2:
         im1 = dataset0
     elif dataset0.ndim == 3:
         im1 = dataset0[t, :, :]
     elif dataset0.ndim == 4:
-        im1 = dataset0[t, 0, :, :]
+        im1 = dataset0[t, z, :, :]
     return np.asarray(im1)
 
 
+def _dask_data(emd_obj, dset_num=0):
+    """ A lazy dask array for a Berkeley EMD data set.
+
+    The dask chunks are aligned to the HDF5 chunks of the data set (or a multi-frame slab for
+    contiguous data) so that each task reads one or more whole chunks from disk. 4D data sets
+    keep all four dimensions and are chunked in square tiles of scan positions.
+
+    """
+    dataset0 = emd_obj.list_emds[dset_num]['data']
+    # The source holds on to the ncempy file object, which closes its HDF5 file when it is garbage collected
+    source = frames.ArraySource(emd_obj.file_path, dataset0, 'EMD', native_chunks=dataset0.chunks,
+                                frame_axes=(-2, -1), scan=dataset0.ndim == 4, owner=emd_obj)
+    dask_data = source.to_dask()
+    if dataset0.ndim == 2:
+        dask_data = dask_data[None, :, :]
+    return dask_data
+
+
 # Modify types if needed
 def _cleandict(md):
     for k, v in md.items():
@@ -95,14 +98,13 @@ def _cleandict(md):
             md[k] = tuple(v)
 
 
-@functools.lru_cache(maxsize=10, typed=False)
-def _metadata(path):  # parameterized by path rather than emd_obj so that hashing lru hashing resolves easily
+@cache.cached_metadata
+@metrics.timed('EMD', 'metadata')
+def _metadata(path):  # parameterized by path rather than emd_obj so that it is cached by file identity
 
     metaData = {}
     metaData['veloxFlag'] = False
 
-    metaData['FileName'] = path
-
     # EMD Berkeley
     emd_obj = emd.fileEMD(path, readonly=True)
 
@@ -141,13 +143,27 @@ def _metadata(path):  # parameterized by path rather than emd_obj so that hashin
     return metaData
 
 
+def _configuration(path, stream_metadata):
+    """ Descriptor configuration for the scalar values in a stream's metadata"""
+    return {key: {"data": {key: value},
+                  "timestamps": {key: time.time()},
+                  "data_keys": {key: {"source": path,
+                                      "dtype": _guess_type(value),
+                                      "shape": [],
+                                      "units": "",
+                                      #"related_value": 0, ... # i.e. soft limits, precision
+                                      }}}
+            for key, value in stream_metadata.items() if _guess_type(value)}
+
+
 def _dset_names(emd_obj):
     return [emd_obj.list_emds[device_index].name.split('/')[-1] for device_index in range(_num_datasets(emd_obj))]
 
 
 
-@functools.lru_cache(maxsize=10, typed=False)
-def _metadata_from_dset(path, dset_num=0):  # parameterized by path rather than emd_obj so that hashing lru hashing resolves easily
+@cache.cached_metadata
+@metrics.timed('EMD', 'metadata')
+def _metadata_from_dset(path, dset_num=0):  # parameterized by path rather than emd_obj so that it is cached by file identity
 
     metaData = {}
     metaData['veloxFlag'] = False
@@ -175,9 +191,17 @@ def _metadata_from_dset(path, dset_num=0):  # parameterized by path rather than
         dimY = dims[1]  # dataGroup['dim2']
         dimX = dims[2]  # dataGroup['dim3']
     elif dataset0.ndim == 4:
-        dimZ = dims[1]
+        # [scan_y, scan_x, ky, kx]; Y and X describe the diffraction pattern
+        dimZ = None
         dimY = dims[2]  # dataGroup['dim3']
         dimX = dims[3]  # dataGroup['dim4']
+        try:
+            metaData['ScanSizeY'] = dims[0][0][1] - dims[0][0][0]
+            metaData['ScanSizeYUnit'] = dims[0][2].replace('_', '')
+            metaData['ScanSizeX'] = dims[1][0][1] - dims[1][0][0]
+            metaData['ScanSizeXUnit'] = dims[1][2].replace('_', '')
+        except:
+            pass
     else:
         dimZ = None
         dimY = None
@@ -209,7 +233,7 @@ def _metadata_from_dset(path, dset_num=0):  # parameterized by path rather than
     return metaData
 
 
-def ingest_NCEM_EMD(paths):
+def ingest_NCEM_EMD(paths, external=False):
     assert len(paths) == 1
     path = paths[0]
 
@@ -217,66 +241,25 @@ def ingest_NCEM_EMD(paths):
 
     # Compose run start
     run_bundle = event_model.compose_run()  # type: event_model.ComposeRunBundle
-    start_doc = run_bundle.start_doc
+    start_doc = _metadata(path)
+    start_doc['FileName'] = path
+    start_doc.update(run_bundle.start_doc)
     start_doc["sample_name"] = Path(paths[0]).resolve().stem
-    metadata = _metadata(path)
-
-    metadata.update(start_doc)
-    start_doc = metadata
     yield 'start', start_doc
 
     for device_index, device_name in enumerate(_dset_names(emd_handle)):
 
-        num_t = _num_t(emd_handle, dset_num=device_index)
-        first_frame = _get_slice(emd_handle, 0, dset_num=device_index)
-        shape = first_frame.shape
-        dtype = first_frame.dtype
-
-        delayed_get_slice = dask.delayed(_get_slice)
-        dask_data = da.stack([da.from_delayed(delayed_get_slice(emd_handle, t, dset_num=device_index), shape=shape, dtype=dtype)
-                              for t in range(num_t)])
-
-        # Compose descriptor
-        source = 'NCEM'
-        frame_data_keys = {'raw': {'source': source,
-                                   'dtype': 'number',
-                                   'shape': (num_t, *shape)}}
-
-        frame_stream_name = f'primary_{device_name}'
+        dask_data = _dask_data(emd_handle, dset_num=device_index)
         stream_metadata = _metadata_from_dset(path, dset_num=device_index)
-        configuration = {key: {"data": {key: value},
-                               "timestamps": {key: time.time()},
-                               "data_keys": {key: {"source": path,
-                                                   "dtype": _guess_type(value),
-                                                   "shape": [],
-                                                   "units": "",
-                                                   #"related_value": 0, ... # i.e. soft limits, precision
-                                                   }}}
-                         for key, value in stream_metadata.items() if _guess_type(value)}
-
-        frame_stream_bundle = run_bundle.compose_descriptor(data_keys=frame_data_keys,
-                                                            name=frame_stream_name,
-                                                            configuration=configuration
-                                                            )
-        yield 'descriptor', frame_stream_bundle.descriptor_doc
-
-        # NOTE: Resource document may be meaningful in the future. For transient access it is not useful
-        # # Compose resource
-        # resource = run_bundle.compose_resource(root=Path(path).root, resource_path=path, spec='NCEM_DM', resource_kwargs={})
-        # yield 'resource', resource.resource_doc
-
-        # Compose datum_page
-        # z_indices, t_indices = zip(*itertools.product(z_indices, t_indices))
-        # datum_page_doc = resource.compose_datum_page(datum_kwargs={'index_z': list(z_indices), 'index_t': list(t_indices)})
-        # datum_ids = datum_page_doc['datum_id']
-        # yield 'datum_page', datum_page_doc
-
-        yield 'event', frame_stream_bundle.compose_event(data={'raw': dask_data},
-                                                         timestamps={'raw': time.time()})
+        yield from frames.compose_stream(run_bundle, dask_data, [path], [dask_data.shape[0]], 'NCEM_EMD',
+                                         name=f'primary_{device_name}',
+                                         configuration=_configuration(path, stream_metadata),
+                                         external=external, resource_kwargs={'dset_num': device_index})
 
     yield 'stop', run_bundle.compose_stop()
 
 
+@metrics.timed('EMD_VELOX', 'read')
 def _get_slice_velox(emd_obj, t, dset_num=0):
     # Velox EMD
     dataset0 = emd_obj.list_data[dset_num]['Data']
@@ -287,43 +270,186 @@ def _get_slice_velox(emd_obj, t, dset_num=0):
     return im1
 
 
-def _num_t_velox(emd_obj):
-    """ The number of slices in the first dimension (C-ordering) for Berkeley data sets
-    OR
-    The number of slices in the last dimension (F-ordering) for Velox data sets
+class _VeloxFrames(frames.FrameSource):
+    """ C-ordered [t, y, x] frames of a Velox data set stored as [y, x, t].
 
+    Reading a single frame from a [y, x, t] data set is a strided gather across the whole data set.
+    Frames are instead read as slabs [:, :, t0:t1] that follow the HDF5 chunks along t (or the dask
+    blocks for contiguous data) and transposed in memory once per slab.
     """
 
-    dataGroup = emd_obj.list_data[0]
-    dataset0 = dataGroup['Data']
-    shape = dataset0.shape
+    fmt = 'EMD_VELOX'
+
+    def __init__(self, emd_obj, dataset):
+        super(_VeloxFrames, self).__init__(emd_obj.file_path, (dataset.shape[2], dataset.shape[0], dataset.shape[1]),
+                                           dataset.dtype)
+        self.emd_obj = emd_obj  # keep the file open
+        self.dataset = dataset
+        self.part = dataset.name
+        if dataset.chunks is not None:
+            self.native_chunks = dataset.chunks[2], dataset.chunks[0], dataset.chunks[1]
+
+    def _step(self):
+        """ The number of frames in each slab"""
+        return self.native_chunks[0] if self.native_chunks is not None else self.chunks()[0]
+
+    def read_frames(self, indices):
+        unique, inverse = np.unique(np.asarray(indices, dtype=np.intp), return_inverse=True)
+        out = np.empty((len(unique), *self.shape[1:]), dtype=self.dtype)
+        # One slab per chunk (or block) that holds any of the frames
+        slabs = np.flatnonzero(np.diff(unique // self._step(), prepend=-1))
+        for first, last in zip(slabs, [*slabs[1:], len(unique)]):
+            t0 = unique[first]
+            out[first:last] = self[int(t0):int(unique[last - 1]) + 1][unique[first:last] - t0]
+        return out[inverse]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        tt, yy, xx = key + (slice(None),) * (3 - len(key))
+        if isinstance(tt, numbers.Integral):
+            return self[slice(tt, tt + 1), yy, xx][0]
+        if not isinstance(tt, slice) or tt.indices(self.shape[0])[2] != 1:
+            # Index arrays and strides
+            return self.read_frames(frames.frame_indices(tt, self.shape[0]))[:, yy, xx]
+        t0, t1, _ = tt.indices(self.shape[0])
+        step = self._step()
+
+        out = None
+        t = t0
+        while t < t1:
+            t_next = min(t1, (t // step + 1) * step)
+            slab = self.dataset[yy, xx, t:t_next]
+            if out is None:
+                out = np.empty((t1 - t0, *slab.shape[:-1]), dtype=self.dtype)
+            out[t - t0:t_next - t0] = np.moveaxis(slab, -1, 0)
+            t = t_next
+        if out is None:
+            out = np.moveaxis(self.dataset[yy, xx, 0:0], -1, 0)
+        return out
+
+
+def _dask_data_velox(emd_obj, dset_num=0):
+    """ A lazy C-ordered [t, y, x] dask array for a Velox data set stored as [y, x, t].
+
+    Each dask task reads a block of frames aligned to the HDF5 chunks (or a multi-frame slab for
+    contiguous data). See _VeloxFrames.
 
-    if len(shape) < 3:
-        out = 1
-    else:
-        # EMD Velox
-        out = shape[-1]
+    """
+    dataset0 = emd_obj.list_data[dset_num]['Data']
+    if dataset0.ndim == 2:
+        source = frames.ArraySource(emd_obj.file_path, dataset0, 'EMD_VELOX', native_chunks=dataset0.chunks,
+                                    frame_axes=(-2, -1), owner=emd_obj)
+        return source.to_dask()[None, :, :]
+    return _VeloxFrames(emd_obj, dataset0).to_dask()
 
+
+def _num_datasets_velox(emd_obj):
+    return len(emd_obj.list_data)
+
+
+def _decode_velox_metadata(column):
+    """ Convert one column of a Velox Metadata array to a dict"""
+    validMetaDataIndex = npwhere(column > 0)  # find valid metadata
+    mData = column[validMetaDataIndex].tobytes()  # change to string
+    return json.loads(mData.decode('utf-8', 'ignore'))  # load UTF-8 string as JSON and output dict
+
+
+class VeloxFrameMetadata:
+    """ Per-frame metadata of one Velox data set decoded on demand.
+
+    Velox stores one JSON document per frame as a column of the Metadata array. A column is only
+    read and parsed when the metadata for that frame is requested, and recently used frames are
+    cached. Opening a long series therefore only decodes the frames that are looked at.
+
+    Examples
+    --------
+    >> with emdVelox.fileEMDVelox('series.emd') as emd_obj:
+    >>     frame_md = VeloxFrameMetadata(emd_obj, dset_num=0)
+    >>     print(frame_md[10]['Stage'])
+
+    """
+
+    def __init__(self, emd_obj, dset_num=0, maxsize=256):
+        self.emd_obj = emd_obj  # keep the file open
+        self.dataset = emd_obj.list_data[dset_num]['Metadata']
+        self._decode = functools.lru_cache(maxsize=maxsize)(self._decode_frame)
+
+    def __len__(self):
+        return self.dataset.shape[1]
+
+    def __getitem__(self, t):
+        if t < 0:
+            t += len(self)
+        if not 0 <= t < len(self):
+            raise IndexError('Frame {} is out of range for {} frames'.format(t, len(self)))
+        return self._decode(t)
+
+    def _decode_frame(self, t):
+        return _decode_velox_metadata(self.dataset[:, t])
+
+    def cache_info(self):
+        return self._decode.cache_info()
+
+
+# Per-frame values stored in the frame stream of each Velox data set. Each value lists the paths into
+# the frame metadata to try in order. Frames without a value are stored as NaN.
+VELOX_FRAME_FIELDS = {'time': [('Acquisition', 'AcquisitionStartDatetime', 'DateTime')],
+                      'frame_time': [('Scan', 'FrameTime')],
+                      'dose': [('CustomProperties', 'Dose', 'value'), ('Dose',)],
+                      'stage_x': [('Stage', 'Position', 'x')],
+                      'stage_y': [('Stage', 'Position', 'y')],
+                      'stage_z': [('Stage', 'Position', 'z')],
+                      'alpha_tilt': [('Stage', 'AlphaTilt')],
+                      'beta_tilt': [('Stage', 'BetaTilt')]}
+
+
+def _frame_fields_velox(mDataS):
+    out = []
+    for field_paths in VELOX_FRAME_FIELDS.values():
+        value = np.nan
+        for keys in field_paths:
+            try:
+                value = functools.reduce(lambda d, k: d[k], keys, mDataS)
+                value = float(value)
+                break
+            except (KeyError, TypeError, ValueError):
+                value = np.nan
+        out.append(value)
     return out
 
 
-@functools.lru_cache(maxsize=10, typed=False)
-def _metadata_velox(path):  # parameterized by path rather than emd_obj so that hashing lru hashing resolves easily
+def _frame_table_velox(path, emd_obj, dset_num=0, block_size=256, max_workers=4):
+    """ Per-frame values (see VELOX_FRAME_FIELDS) for all frames of a Velox data set as numpy arrays.
 
-    metaData = {}
-    metaData['veloxFlag'] = True
+    The Metadata array is read in blocks of whole frames rather than one strided column at a time,
+    and blocks are read and parsed on a thread pool. The result is cached on disk keyed by the file
+    identity so that reopening a file does not parse the frames again.
 
-    metaData['FileName'] = path
+    """
+    key = cache.cache_key(path, 'velox_frames', dset_num, repr(VELOX_FRAME_FIELDS))
+    table = cache.load_arrays('velox_frames', key)
+    if table is not None:
+        return table
 
-    emd_obj = emdVelox.fileEMDVelox(path)
-    dataGroup = emd_obj.list_data[0]
-    dataset0 = dataGroup['Data']
+    dataset = emd_obj.list_data[dset_num]['Metadata']
+    num_t = dataset.shape[1]
+
+    def decode_block(t0):
+        rows = np.ascontiguousarray(dataset[:, t0:t0 + block_size].T)  # one row per frame
+        return [_frame_fields_velox(_decode_velox_metadata(row)) for row in rows]
 
-    # Convert JSON metadata to dict
-    mData = emd_obj.list_data[0]['Metadata'][:, 0]
-    validMetaDataIndex = npwhere(mData > 0)  # find valid metadata
-    mData = mData[validMetaDataIndex].tostring()  # change to string
-    mDataS = json.loads(mData.decode('utf-8', 'ignore'))  # load UTF-8 string as JSON and output dict
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        values = [v for block in executor.map(decode_block, range(0, num_t, block_size)) for v in block]
+
+    values = np.asarray(values, dtype=np.float64).reshape(num_t, len(VELOX_FRAME_FIELDS))
+    table = {name: values[:, ii] for ii, name in enumerate(VELOX_FRAME_FIELDS)}
+    cache.save_arrays('velox_frames', key, table)
+    return table
+
+
+def _physical_size_velox(mDataS):
+    metaData = {}
     try:
         # Store the X and Y pixel size, offset and unit
         metaData['PhysicalSizeX'] = float(mDataS['BinaryResult']['PixelSize']['width'])
@@ -339,6 +465,23 @@ def _metadata_velox(path):  # parameterized by path rather than emd_obj so that
         metaData['PhysicalSizeY'] = 1
         metaData['PhysicalSizeYOrigin'] = 0
         metaData['PhysicalSizeYUnit'] = ''
+    return metaData
+
+
+@cache.cached_metadata
+@metrics.timed('EMD_VELOX', 'metadata')
+def _metadata_velox(path):  # parameterized by path rather than emd_obj so that it is cached by file identity
+
+    metaData = {}
+    metaData['veloxFlag'] = True
+
+    emd_obj = emdVelox.fileEMDVelox(path)
+    dataGroup = emd_obj.list_data[0]
+    dataset0 = dataGroup['Data']
+
+    # Convert JSON metadata of the first frame to dict
+    mDataS = VeloxFrameMetadata(emd_obj, dset_num=0)[0]
+    metaData.update(_physical_size_velox(mDataS))
 
     metaData.update(mDataS)
 
@@ -347,7 +490,42 @@ def _metadata_velox(path):  # parameterized by path rather than emd_obj so that
     return metaData
 
 
-def ingest_NCEM_EMD_VELOX(paths):
+@cache.cached_metadata
+@metrics.timed('EMD_VELOX', 'metadata')
+def _metadata_velox_from_dset(path, dset_num=0):  # parameterized by path rather than emd_obj so that it is cached by file identity
+
+    metaData = {}
+    metaData['veloxFlag'] = True
+
+    emd_obj = emdVelox.fileEMDVelox(path)
+    dataGroup = emd_obj.list_data[dset_num]
+    dataset0 = dataGroup['Data']
+
+    # Only the first frame is decoded. See VeloxFrameMetadata for the other frames.
+    mDataS = VeloxFrameMetadata(emd_obj, dset_num=dset_num)[0]
+    metaData.update(_physical_size_velox(mDataS))
+    try:
+        metaData['Detector'] = mDataS['BinaryResult']['Detector']
+    except KeyError:
+        metaData['Detector'] = dataGroup.name.split('/')[-1]
+
+    metaData['shape'] = dataset0.shape
+
+    return metaData
+
+
+def _dset_names_velox(path, emd_obj):
+    """ Unique names for each data set using the detector names"""
+    names = []
+    for dset_num in range(_num_datasets_velox(emd_obj)):
+        name = _metadata_velox_from_dset(path, dset_num=dset_num)['Detector']
+        if name in names:
+            name = f'{name}_{dset_num}'
+        names.append(name)
+    return names
+
+
+def ingest_NCEM_EMD_VELOX(paths, external=False):
     assert len(paths) == 1
     path = paths[0]
 
@@ -355,73 +533,54 @@ def ingest_NCEM_EMD_VELOX(paths):
 
     # Compose run start
     run_bundle = event_model.compose_run()  # type: event_model.ComposeRunBundle
-    start_doc = run_bundle.start_doc
+    start_doc = _metadata_velox(path)
+    start_doc['FileName'] = path
+    start_doc.update(run_bundle.start_doc)
     start_doc["sample_name"] = Path(paths[0]).resolve().stem
-    metadata = _metadata_velox(path)
-
-    metadata.update(start_doc)
-    start_doc = metadata
     yield 'start', start_doc
 
-    num_t = _num_t_velox(emd_handle)
-    first_frame = _get_slice_velox(emd_handle, 0)
-    shape = first_frame.shape
-    dtype = first_frame.dtype
-
-    delayed_get_slice = dask.delayed(_get_slice_velox)
-    dask_data = da.stack([da.from_delayed(delayed_get_slice(emd_handle, t), shape=shape, dtype=dtype)
-                          for t in range(num_t)])
-
-    # Compose descriptor
-    source = 'NCEM'
-    frame_data_keys = {'raw': {'source': source,
-                               'dtype': 'number',
-                               'shape': (num_t, *shape)}}
-    frame_stream_name = 'primary'
-    frame_stream_bundle = run_bundle.compose_descriptor(data_keys=frame_data_keys,
-                                                        name=frame_stream_name,
-                                                        # configuration=_metadata(path)
-                                                        )
-    yield 'descriptor', frame_stream_bundle.descriptor_doc
-
-    # NOTE: Resource document may be meaningful in the future. For transient access it is not useful
-    # # Compose resource
-    # resource = run_bundle.compose_resource(root=Path(path).root, resource_path=path, spec='NCEM_DM', resource_kwargs={})
-    # yield 'resource', resource.resource_doc
-
-    # Compose datum_page
-    # z_indices, t_indices = zip(*itertools.product(z_indices, t_indices))
-    # datum_page_doc = resource.compose_datum_page(datum_kwargs={'index_z': list(z_indices), 'index_t': list(t_indices)})
-    # datum_ids = datum_page_doc['datum_id']
-    # yield 'datum_page', datum_page_doc
-
-    yield 'event', frame_stream_bundle.compose_event(data={'raw': dask_data},
-                                                     timestamps={'raw': time.time()})
+    for device_index, device_name in enumerate(_dset_names_velox(path, emd_handle)):
+
+        dask_data = _dask_data_velox(emd_handle, dset_num=device_index)
+        num_t = dask_data.shape[0]
+        stream_metadata = _metadata_velox_from_dset(path, dset_num=device_index)
+        yield from frames.compose_stream(run_bundle, dask_data, [path], [num_t], 'NCEM_EMD_VELOX',
+                                         name=f'primary_{device_name}',
+                                         configuration=_configuration(path, stream_metadata),
+                                         external=external, resource_kwargs={'dset_num': device_index})
+
+        # Per-frame acquisition time, dose and stage position
+        table = _frame_table_velox(path, emd_handle, dset_num=device_index)
+        table_data_keys = {name: {'source': 'NCEM', 'dtype': 'number', 'shape': []} for name in table}
+        table_stream_bundle = run_bundle.compose_descriptor(data_keys=table_data_keys,
+                                                            name=f'frames_{device_name}')
+        yield 'descriptor', table_stream_bundle.descriptor_doc
+
+        now = time.time()
+        times = np.where(np.isfinite(table['time']), table['time'], now)
+        yield 'event_page', table_stream_bundle.compose_event_page(
+            data={name: values.tolist() for name, values in table.items()},
+            timestamps={name: times.tolist() for name in table},
+            seq_num=list(range(1, num_t + 1)),
+            time=times.tolist(),
+            validate=False)
 
     yield 'stop', run_bundle.compose_stop()
 
 
-def emd_sniffer(path, first_bytes):
-    if not Path(path).suffix.lower() == '.emd':
-        return
+class EMDHandler(resources.FrameHandler):
+    """ Serves the frames of one data set of a Berkeley EMD file referenced by a NCEM_EMD resource"""
 
-    test_velox = False
-    try:
-        # Test for Berkeley EMD
-        with emd.fileEMD(path, readonly=True) as emd1:
-            if len(emd1.list_emds) > 0:
-                return 'application/x-EMD'
-            else:
-                test_velox = True
-    except OSError:
-        # Not a HDF5 file
-        return
-
-    if test_velox:
-        # Test for Velox
-        with emdVelox.fileEMDVelox(path) as emd2:
-            ver = emd2._file_hdl['Version'][0].decode('ASCII')
-            if ver.find('Velox') > -1:
-                return 'application/x-EMD-VELOX'
-    else:
-        return
+    specs = {'NCEM_EMD'}
+
+    def _open(self, path, dset_num=0):
+        return _dask_data(emd.fileEMD(path, readonly=True), dset_num=dset_num)
+
+
+class VeloxHandler(resources.FrameHandler):
+    """ Serves the frames of one data set of a Velox EMD file referenced by a NCEM_EMD_VELOX resource"""
+
+    specs = {'NCEM_EMD_VELOX'}
+
+    def _open(self, path, dset_num=0):
+        return _dask_data_velox(emdVelox.fileEMDVelox(path), dset_num=dset_num)
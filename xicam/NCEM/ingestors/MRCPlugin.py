@@ -1,13 +1,12 @@
 import os
-import functools
-import time
-import dask
-import dask.array as da
 from pathlib import Path
 
-import event_model
+import numpy as np
 
-from ncempy.io import mrc
+from . import cache, frames, handles, lazy, metrics, multifile, resources
+
+event_model = lazy.LazyModule('event_model')
+mrc = lazy.LazyModule('ncempy.io.mrc')
 
 
 def _num_t(mrc_obj):
@@ -18,13 +17,78 @@ def _num_t(mrc_obj):
     return int(mrc_obj.dataSize[0])
 
 
+@metrics.timed('MRC', 'read')
 def _get_slice(path, t):
-    with mrc.fileMRC(path) as mrc_obj:
+    with handles.pool.borrow(path, mrc.fileMRC) as mrc_obj:
         return mrc_obj.getSlice(t)
 
 
-@functools.lru_cache(maxsize=10, typed=False)
-def _metadata(path):
+def _memmap(path):
+    """ A read-only memory map of the full MRC volume [t, y, x].
+
+    MRC files are a 1024 byte header, an optional (FEI) extended header and then the raw data.
+    Returns None for data types that cannot be mapped directly (e.g. complex or 4-bit modes)
+    or if the file is shorter than the header says.
+
+    """
+    with mrc.fileMRC(path) as mrc_obj:
+        dtype = mrc_obj.dataType
+        shape = tuple(int(ii) for ii in mrc_obj.dataSize)
+        offset = int(mrc_obj.dataOffset)  # includes the extended header
+    if dtype is None:
+        return None
+    dtype = np.dtype(dtype).newbyteorder('<')
+    if os.path.getsize(path) < offset + dtype.itemsize * int(np.prod(shape, dtype=np.int64)):
+        return None
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+
+class MRCSlices(frames.FrameSource):
+    """ The frames of an MRC file that cannot be memory mapped, read by ncempy.
+
+    All frames of a batch are read through one handle borrowed from the pool.
+
+    """
+
+    fmt = 'MRC'
+
+    def __init__(self, path):
+        with handles.pool.borrow(path, mrc.fileMRC) as mrc_obj:
+            num_t = _num_t(mrc_obj)
+            first_frame = mrc_obj.getSlice(0)
+        super(MRCSlices, self).__init__(path, (num_t, *first_frame.shape), first_frame.dtype)
+
+    def read_frames(self, indices):
+        out = np.empty((len(indices), *self.shape[1:]), dtype=self.dtype)
+        with handles.pool.borrow(self.path, mrc.fileMRC) as mrc_obj:
+            for ii, t in enumerate(indices):
+                out[ii] = mrc_obj.getSlice(int(t))
+        return out
+
+
+def _source(path):
+    """ The frames of an MRC file as [t, y, x].
+
+    The volume is memory mapped so frames are copied straight from the OS page cache. The memory
+    map is borrowed from the handle pool for each read. Files that cannot be memory mapped are read
+    with ncempy (see MRCSlices).
+
+    """
+    with handles.pool.borrow(path, _memmap) as mm:
+        if mm is None:
+            return MRCSlices(path)
+    return frames.PooledSource(path, _memmap, 'MRC')
+
+
+def _dask_data(path):
+    """ A lazy [t, y, x] dask array for an MRC file chunked in blocks of whole frames"""
+    return _source(path).to_dask()
+
+
+@cache.cached_metadata
+@metrics.timed('MRC', 'metadata')
+def _header_metadata(path):
+    """ The metadata in the header of an MRC file"""
     metaData = {}
 
     # Open file and parse the header
@@ -61,12 +125,22 @@ def _metadata(path):
         metaData['PhysicalSizeYOrigin'] = 0
         metaData['PhysicalSizeYUnit'] = ''
 
-    metaData['FileName'] = path
+    return metaData
+
+
+def _sidecar_metadata(path):
+    """ The tilt angles and FEI parameters in the .rawtlt and .txt files next to an MRC file.
+
+    These are small files that can be edited after the MRC file was written, so they are read on
+    every call and not cached with the header.
+
+    """
+    metaData = {}
 
     rawtltName = Path(path).with_suffix('.rawtlt')
     if rawtltName.exists():
         with open(rawtltName, 'r') as f1:
-            tilts = map(float, f1)
+            tilts = list(map(float, f1))
         metaData['tilt angles'] = tilts
 
     FEIparameters = Path(path).with_suffix('.txt')
@@ -85,51 +159,37 @@ def _metadata(path):
     return metaData
 
 
-def ingest_NCEM_MRC(paths):
-    assert len(paths) == 1
+def _metadata(path):
+    metaData = _header_metadata(path)
+    metaData.update(_sidecar_metadata(path))
+    return metaData
+
+
+def ingest_NCEM_MRC(paths, external=False):
+    paths = multifile.natural_sort(paths)
     path = paths[0]
 
     # Compose run start
     run_bundle = event_model.compose_run()  # type: event_model.ComposeRunBundle
     start_doc = _metadata(path)
+    start_doc['FileName'] = path
     start_doc.update(run_bundle.start_doc)
     start_doc["sample_name"] = Path(paths[0]).resolve().stem
+    start_doc['FileNames'] = [str(p) for p in paths]
     yield 'start', start_doc
 
-    mrc_handle = mrc.fileMRC(path)
-    num_t = _num_t(mrc_handle)
-    first_frame = _get_slice(path, 0)
-    shape = first_frame.shape
-    dtype = first_frame.dtype
-
-    delayed_get_slice = dask.delayed(_get_slice)
-    dask_data = da.stack([da.from_delayed(delayed_get_slice(path, t), shape=shape, dtype=dtype)
-                          for t in range(num_t)])
-
-    # Compose descriptor
-    source = 'NCEM'
-    frame_data_keys = {'raw': {'source': source,
-                               'dtype': 'number',
-                               'shape': (num_t, *shape)}}
-    frame_stream_name = 'primary'
-    frame_stream_bundle = run_bundle.compose_descriptor(data_keys=frame_data_keys,
-                                                        name=frame_stream_name,
-                                                        # configuration=_metadata(path)
-                                                        )
-    yield 'descriptor', frame_stream_bundle.descriptor_doc
-
-    # NOTE: Resource document may be meaningful in the future. For transient access it is not useful
-    # # Compose resource
-    # resource = run_bundle.compose_resource(root=Path(path).root, resource_path=path, spec='NCEM_DM', resource_kwargs={})
-    # yield 'resource', resource.resource_doc
-
-    # Compose datum_page
-    # z_indices, t_indices = zip(*itertools.product(z_indices, t_indices))
-    # datum_page_doc = resource.compose_datum_page(datum_kwargs={'index_z': list(z_indices), 'index_t': list(t_indices)})
-    # datum_ids = datum_page_doc['datum_id']
-    # yield 'datum_page', datum_page_doc
-
-    yield 'event', frame_stream_bundle.compose_event(data={'raw': dask_data},
-                                                     timestamps={'raw': time.time()})
+    sources = multifile.map_headers(_source, paths)
+    dask_data = multifile.concatenate(sources, paths).to_dask()
+    yield from frames.compose_stream(run_bundle, dask_data, paths, [len(source) for source in sources], 'NCEM_MRC',
+                                     external=external)
 
     yield 'stop', run_bundle.compose_stop()
+
+
+class MRCHandler(resources.FrameHandler):
+    """ Serves the frames of an MRC file referenced by a NCEM_MRC resource"""
+
+    specs = {'NCEM_MRC'}
+
+    def _open(self, path):
+        return _dask_data(path)
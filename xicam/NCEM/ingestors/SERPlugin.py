@@ -1,41 +1,28 @@
 import os
-import functools
 import time
-import dask
-import dask.array as da
+from contextlib import contextmanager
 from pathlib import Path
 
-import event_model
+import numpy as np
 
-from ncempy.io import ser
+from . import handles
+from . import cache, frames, lazy, metrics, multifile, resources
 
+event_model = lazy.LazyModule('event_model')
+ser = lazy.LazyModule('ncempy.io.ser')
 
-def _num_t(metadata):
-    """ The number of data sets in the ser file. SER files are always laid out as a 'series'
-    of 1D or 2D datasets. Thus, you need to retrieve each data set in the series separately.
+# Layout of the header in front of each data element
+_CALIBRATION = [('CalibrationOffset', '<f8'), ('CalibrationDelta', '<f8'), ('CalibrationElement', '<i4')]
+_ELEMENT_HEADER = {0x4120: np.dtype([('Calibration', _CALIBRATION, (1,)), ('DataType', '<i2'), ('ArrayShape', '<i4', (1,))]),
+                   0x4122: np.dtype([('Calibration', _CALIBRATION, (2,)), ('DataType', '<i2'), ('ArrayShape', '<i4', (2,))])}
 
-    2D data sets:
-    For series of 2D datasets this is a layout of X,Y for each data set
+# Layout of the tags for each data element
+_TAG = {0x4152: np.dtype([('TagTypeID', '<i4'), ('Time', '<i4')]),
+        0x4142: np.dtype([('TagTypeID', '<i4'), ('Time', '<i4'), ('PositionX', '<f8'), ('PositionY', '<f8')])}
 
-    1D data sets (unuspported!)
-    For series of 1D data sets (spectra) this is a layout of 1 spectra at each position
-    in a 1D or 2D raster.
 
-    Note: Each data set can have a different X-Y size. Its rare but possible.
-    """
-    # TODO: Alert Peter Ercius that the type returned by metadata['ValidNumberElements should be `int`
-    # TODO: Not sure why there's a conditional here?
-    if metadata['DataTypeID'] == 16674:
-        # 2D data sets (images)
-        return int(metadata['ValidNumberElements'])
-    elif metadata['DataTypeID'] == 16672:
-        # 1D data sets (currently unsupported)
-        return int(metadata['ValidNumberElements'])
-
-    return None
-
-
-@functools.lru_cache(maxsize=10, typed=False)
+@cache.cached_metadata
+@metrics.timed('SER', 'metadata')
 def _metadata(path):
     with ser.fileSER(path) as ser1:
         data, metaData = ser1.getDataset(0)  # have to get 1 image and its meta data
@@ -67,66 +54,234 @@ def _metadata(path):
         metaData['PhysicalSizeYOrigin'] = 0
         metaData['PhysicalSizeYUnit'] = ''
 
-    metaData['FileName'] = path
-
     return metaData
 
 
+@metrics.timed('SER', 'read')
 def _get_slice(path, t):
-    with ser.fileSER(path) as ser_obj:
+    with handles.pool.borrow(path, ser.fileSER) as ser_obj:
         return ser_obj.getDataset(t)[0]
 
 
-def ingest_NCEM_SER(paths):
-    assert len(paths) == 1
+def _map_file(path):
+    """ A read-only memory map of the bytes of a file"""
+    return np.memmap(path, dtype=np.uint8, mode='r')
+
+
+class SERIndex(frames.FrameSource):
+    """ An index of every data element in a SER file built from the offset and tag tables.
+
+    The offset tables and the small header in front of each data element are read once as numpy
+    arrays. Frames are then read from a memory map of the file without reopening or seeking. The
+    memory map is borrowed from the handle pool for each read, so no file is held open between
+    reads. As a FrameSource, a batch of frames is copied from the memory map into one block, for
+    files whose elements are not evenly spaced (see as_array).
+
+    Attributes
+    ----------
+    data_offsets : ndarray
+        The offset of the raw data of each element.
+    shapes : ndarray
+        The C-ordered shape of each element, [num_t, 2] for images or [num_t, 1] for spectra.
+    data_types : ndarray
+        The SER data type code of each element.
+    times : ndarray
+        The acquisition time tag of each element (0 if the tag is missing).
+    positions : ndarray
+        The [x, y] position tag of each element (NaN if the file has no position tags).
+
+    """
+
+    fmt = 'SER'
+
+    def __init__(self, path):
+        with ser.fileSER(path) as ser_obj:
+            head = ser_obj.head
+
+        self.path = path
+        self.data_type_id = head['DataTypeID']
+
+        element_header = _ELEMENT_HEADER[self.data_type_id]
+        element_offsets = np.asarray(head['DataOffsetArray'], dtype=np.int64)
+        tag_dtype = _TAG[head['TagTypeID']]
+        with self._borrow() as mm:
+            headers, _ = self._gather(mm, element_offsets, element_header)
+            # Tags can point past the end of the file or have the wrong type. Those get the default values.
+            tags, valid = self._gather(mm, np.asarray(head['TagOffsetArray'], dtype=np.int64), tag_dtype)
+        self.data_offsets = element_offsets + element_header.itemsize
+        self.data_types = headers['DataType']
+        self.shapes = headers['ArrayShape'][:, ::-1]  # stored as [x, y]
+
+        valid &= tags['TagTypeID'] == head['TagTypeID']
+        self.times = np.where(valid, tags['Time'], 0)
+        self.positions = np.full((len(tags), 2), np.nan)
+        if 'PositionX' in tag_dtype.names:
+            self.positions[valid, 0] = tags['PositionX'][valid]
+            self.positions[valid, 1] = tags['PositionY'][valid]
+
+    def __len__(self):
+        return len(self.data_offsets)
+
+    @contextmanager
+    def _borrow(self):
+        with handles.pool.borrow(self.path, _map_file) as mm:
+            yield mm
+
+    @staticmethod
+    def _gather(mm, offsets, dtype):
+        """ Read a record of dtype at each offset in one vectorized step"""
+        valid = (offsets >= 0) & (offsets + dtype.itemsize <= mm.size)
+        raw = np.zeros((len(offsets), dtype.itemsize), dtype=np.uint8)
+        raw[valid] = mm[offsets[valid, None] + np.arange(dtype.itemsize)]
+        return raw.view(dtype)[:, 0], valid
+
+    def _dtype(self, t):
+        return np.dtype(ser.fileSER._dictDataType[int(self.data_types[t])].strip())
+
+    def frame(self, t):
+        """ A read-only view of one data element (flipped up-down like ncempy)"""
+        with self._borrow() as mm:
+            return self._frame(mm, t)
+
+    def _frame(self, mm, t):
+        dtype = self._dtype(t)
+        shape = tuple(int(ii) for ii in self.shapes[t])
+        count = int(np.prod(shape))
+        data = np.frombuffer(mm, dtype=dtype, count=count, offset=int(self.data_offsets[t])).reshape(shape)
+        if data.ndim == 2:
+            data = data[::-1]
+        return data
+
+    def uniform(self):
+        """ True if all elements have the same shape and data type"""
+        return len(self) > 0 and (self.shapes == self.shapes[0]).all() and (self.data_types == self.data_types[0]).all()
+
+    def evenly_spaced(self):
+        """ True if all elements have the same shape and data type and are evenly spaced in the file"""
+        if not self.uniform():
+            return False
+        steps = np.diff(self.data_offsets)
+        return not len(steps) or (steps == steps[0]).all()
+
+    def as_array(self):
+        """ All elements as one read-only [t, ...] view into the file.
+
+        Returns None if the elements have different shapes or types or are not evenly spaced in the file.
+
+        """
+        if not self.evenly_spaced():
+            return None
+        with self._borrow() as mm:
+            return self._as_array(mm)
+
+    def _as_array(self, mm):
+        dtype = self._dtype(0)
+        shape = tuple(int(ii) for ii in self.shapes[0])
+        frame_strides = tuple(int(ii) for ii in np.cumprod((1,) + shape[:0:-1])[::-1] * dtype.itemsize)
+        stride = dtype.itemsize * int(np.prod(shape))
+        if len(self) > 1:
+            stride = int(self.data_offsets[1] - self.data_offsets[0])
+        data = np.ndarray((len(self), *shape), dtype=dtype, buffer=mm, offset=int(self.data_offsets[0]),
+                          strides=(stride, *frame_strides))
+        if data.ndim == 3:
+            data = data[:, ::-1]
+        return data
+
+    def read_frames(self, indices):
+        out = np.empty((len(indices), *self.shape[1:]), dtype=self.dtype)
+        with self._borrow() as mm:
+            for ii, t in enumerate(indices):
+                out[ii] = self._frame(mm, int(t))
+        return out
+
+    @property
+    def shape(self):
+        return (len(self), *(int(ii) for ii in self.shapes[0]))
+
+    @property
+    def dtype(self):
+        return self._dtype(0)
+
+
+class _SERArray(frames.PooledSource):
+    """ The evenly spaced elements of a SER file, read through one strided view of the pooled memory map"""
+
+    def __init__(self, index):
+        self.index = index
+        super(_SERArray, self).__init__(index.path, _map_file, 'SER')
+
+    @contextmanager
+    def _borrow(self):
+        with handles.pool.borrow(self.path, self.opener) as mm:
+            yield self.index._as_array(mm)
+
+
+def _source(index):
+    """ The frames of a SER file read from its memory map.
+
+    Evenly spaced elements are sliced as one strided array, so each block is a single copy out of
+    the memory map. Files whose elements are not evenly spaced are read through the SERIndex, which
+    copies the frames of a block one by one.
+
+    """
+    return _SERArray(index) if index.evenly_spaced() else index
+
+
+def _dask_data(path):
+    """ A lazy [t, y, x] dask array of a SER file"""
+    return _source(SERIndex(path)).to_dask()
+
+
+def ingest_NCEM_SER(paths, external=False):
+    paths = multifile.natural_sort(paths)
     path = paths[0]
 
     # Compose run start
     run_bundle = event_model.compose_run()  # type: event_model.ComposeRunBundle
-    start_doc = metadata = _metadata(path)
+    start_doc = _metadata(path)
+    start_doc['FileName'] = path
     start_doc.update(run_bundle.start_doc)
     start_doc["sample_name"] = Path(paths[0]).resolve().stem
+    start_doc['FileNames'] = [str(p) for p in paths]
     yield 'start', start_doc
 
-    #ser_handle = ser.fileSER(path)
-    num_t = _num_t(metadata)
-    first_frame = _get_slice(path, 0)
-    shape = first_frame.shape
-    dtype = first_frame.dtype
-
-    delayed_get_slice = dask.delayed(_get_slice)
-    dask_data = da.stack([da.from_delayed(delayed_get_slice(path, t), shape=shape, dtype=dtype)
-                          for t in range(num_t)])
-
-    # Compose descriptor
-    source = 'NCEM'
-    frame_data_keys = {'raw': {'source': source,
-                               'dtype': 'number',
-                               'shape': (num_t, *shape)}}
-    frame_stream_name = 'primary'
-    frame_stream_bundle = run_bundle.compose_descriptor(data_keys=frame_data_keys,
-                                                        name=frame_stream_name,
-                                                        # configuration=_metadata(path)
-                                                        )
-    yield 'descriptor', frame_stream_bundle.descriptor_doc
-
-    # NOTE: Resource document may be meaningful in the future. For transient access it is not useful
-    # # Compose resource
-    # resource = run_bundle.compose_resource(root=Path(path).root, resource_path=path, spec='NCEM_DM', resource_kwargs={})
-    # yield 'resource', resource.resource_doc
-
-    # Compose datum_page
-    # z_indices, t_indices = zip(*itertools.product(z_indices, t_indices))
-    # datum_page_doc = resource.compose_datum_page(datum_kwargs={'index_z': list(z_indices), 'index_t': list(t_indices)})
-    # datum_ids = datum_page_doc['datum_id']
-    # yield 'datum_page', datum_page_doc
-
-    yield 'event', frame_stream_bundle.compose_event(data={'raw': dask_data},
-                                                     timestamps={'raw': time.time()})
+    indices = multifile.map_headers(SERIndex, paths)
+    sources = [_source(index) for index in indices]
+    dask_data = multifile.concatenate(sources, paths).to_dask()
+    num_t = dask_data.shape[0]
+    yield from frames.compose_stream(run_bundle, dask_data, paths, [len(source) for source in sources], 'NCEM_SER',
+                                     external=external)
+
+    # Per-frame time and position tags
+    positions = np.concatenate([index.positions for index in indices])
+    table = {'time': np.concatenate([index.times for index in indices]),
+             'position_x': positions[:, 0], 'position_y': positions[:, 1]}
+    table_data_keys = {name: {'source': 'NCEM', 'dtype': 'number', 'shape': []} for name in table}
+    table_stream_bundle = run_bundle.compose_descriptor(data_keys=table_data_keys, name='frames')
+    yield 'descriptor', table_stream_bundle.descriptor_doc
+
+    now = time.time()
+    times = np.where(table['time'] > 0, table['time'], now).astype(float)
+    # Validating every row against the schema took most of the ingest time of long series
+    yield 'event_page', table_stream_bundle.compose_event_page(
+        data={name: values.tolist() for name, values in table.items()},
+        timestamps={name: times.tolist() for name in table},
+        seq_num=list(range(1, num_t + 1)),
+        time=times.tolist(),
+        validate=False)
 
     yield 'stop', run_bundle.compose_stop()
 
 
+class SERHandler(resources.FrameHandler):
+    """ Serves the frames of a SER file referenced by a NCEM_SER resource"""
+
+    specs = {'NCEM_SER'}
+
+    def _open(self, path):
+        return _dask_data(path)
+
+
 if __name__ == "__main__":
     output = list(ingest_NCEM_SER([r"C:\Users\linol\Data/10_series_1.ser"]))
     print(output)
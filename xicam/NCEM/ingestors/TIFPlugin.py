@@ -1,42 +1,141 @@
-import time
-import dask
-import dask.array as da
+""" Part of the NCEM plugin for Xicam to read TIF files.
+
+Notes:
+    - The page index (the offsets of every IFD) is built in a single pass the first time a file is
+      opened and reused for all frames through the shared handle pool.
+    - Uncompressed contiguous series are memory mapped.
+    - Compressed series are read through tifffile's zarr store when zarr is installed. Dask blocks
+      follow the tiles of tiled pages (e.g. BigTIFF, OME-TIFF), so a region of a large frame only
+      decodes the tiles it overlaps. Striped pages are blocked in whole strips.
+    - Without zarr (or for series with several leading dimensions), blocks of pages are read with
+      TiffFile.asarray, which decodes compressed pages on a thread pool. Dask blocks contain whole
+      frames.
+    - Neither the TiffFile nor the memory map is held between reads. Both are borrowed from
+      handles.pool, so a series of many files stays within its open file limit.
+    - The frames are the first image series in the file (all pages for plain multi-page files).
+      Extra leading dimensions (e.g. channels in an ImageJ hyperstack) are flattened into the
+      frame axis.
+
+"""
+
+import os
 from pathlib import Path
 
-import event_model
+import numpy as np
 
 import tifffile
 
+from contextlib import contextmanager
 
-def _get_slice(path, t):
-    data = tifffile.imread(path, key=t)
-    return data
+from . import cache, frames, handles, lazy, metrics, multifile, resources
+from .chunking import VIEWER_CHUNK_BYTES, stack_chunks
+
+event_model = lazy.LazyModule('event_model')
+zarr = lazy.LazyModule('zarr')  # optional
+
+# Number of threads used to decode the pages in one block
+MAX_WORKERS = min(4, os.cpu_count() or 1)
+
+
+def _open(path):
+    """ Open a TIF file and index all of its pages in one pass over the IFD chain"""
+    tif = tifffile.TiffFile(path)
+    tif.pages.useframes = True  # TiffFrames only parse the tags needed to read the data
+    len(tif.pages)
+    return tif
+
+
+def _memmap(path):
+    """ A read-only memory map of the uncompressed contiguous first series as [t, y, x]"""
+    with tifffile.TiffFile(path) as tif:
+        frame_shape = tif.series[0].pages[0].shape
+        return tif.asarray(series=0, out='memmap').reshape((-1, *frame_shape))
+
+
+class _TiffPages(frames.FrameSource):
+    """ The pages of the first image series of a TIF file as frames.
+
+    A batch of pages is read with TiffFile.asarray so that compressed pages are decoded on a thread pool.
+
+    """
+
+    fmt = 'TIF'
+
+    def __init__(self, path):
+        with handles.pool.borrow(path, _open) as tif:
+            series = tif.series[0]
+            frame_shape = series.pages[0].shape
+            super(_TiffPages, self).__init__(path, (len(series.pages), *frame_shape), series.dtype)
+        self.frame_axes = tuple(range(-len(frame_shape), 0))
+
+    def read_frames(self, indices):
+        if len(indices) == 0:
+            return np.empty((0, *self.shape[1:]), dtype=self.dtype)
+        with handles.pool.borrow(self.path, _open) as tif:
+            data = tif.asarray(key=[int(t) for t in indices], series=0, maxworkers=MAX_WORKERS)
+        return data.reshape((len(indices), *self.shape[1:]))
+
+
+class _TiffTiles(frames.ArraySource):
+    """ The first image series of a TIF file read through tifffile's zarr store.
 
+    The zarr store has one chunk per tile (or strip) of each page and only decodes the chunks that
+    a read overlaps. The TiffFile is borrowed from the handle pool for each read.
 
-def _num_t(path):
-    """ Number of Tif pages
     """
-    data = tifffile.TiffFile(path)
-    num_t = len(data.pages)
 
-    return num_t
+    def __init__(self, path):
+        self.path = path
+        with self._borrow() as z:
+            frame_ndim = len(z.shape) - 1
+            super(_TiffTiles, self).__init__(path, z, 'TIF', native_chunks=z.chunks,
+                                             frame_axes=tuple(range(-frame_ndim, 0)))
+        self.array = None
 
+    @contextmanager
+    def _borrow(self):
+        with handles.pool.borrow(self.path, _open) as tif:
+            yield zarr.open(tif.aszarr(series=0, level=0, maxworkers=MAX_WORKERS), mode='r')
 
+    def chunks(self):
+        """ Blocks of tiles, or of whole strips up to about VIEWER_CHUNK_BYTES, of one page.
+
+        Pages whose tiles or strips fit into one such block are blocked in whole frames.
+
+        """
+        chunks = list(self.native_chunks)
+        strip_bytes = self.dtype.itemsize * int(np.prod(chunks[1:], dtype=np.int64))
+        if chunks[2:] == list(self.shape[2:]):  # strips span the whole width
+            chunks[1] = min(self.shape[1], chunks[1] * max(1, VIEWER_CHUNK_BYTES // strip_bytes))
+        if chunks[1:] == list(self.shape[1:]):
+            return stack_chunks(self.shape, self.dtype, frame_axes=self.frame_axes)
+        return tuple(chunks)
+
+
+@metrics.timed('TIF', 'read')
+def _get_slice(path, t):
+    with handles.pool.borrow(path, _open) as tif:
+        data = tif.pages[t].asarray()
+    return data
+
+
+@cache.cached_metadata
+@metrics.timed('TIF', 'metadata')
 def _metadata(path):
     metaData = {}
 
-    im = tifffile.TiffFile(path)
-    if im.is_imagej:
-        xres_value = im.pages[0].tags['XResolution'].value
-        yres_value = im.pages[0].tags['YResolution'].value
-        xres = xres_value[1] / xres_value[0]
-        yres = yres_value[1] / yres_value[0]
+    with handles.pool.borrow(path, _open) as im:
+        if im.is_imagej:
+            xres_value = im.pages[0].tags['XResolution'].value
+            yres_value = im.pages[0].tags['YResolution'].value
+            xres = xres_value[1] / xres_value[0]
+            yres = yres_value[1] / yres_value[0]
 
-        units = im.imagej_metadata['unit']
-    else:
-        xres = 1
-        yres = 1
-        units = ''
+            units = im.imagej_metadata['unit']
+        else:
+            xres = 1
+            yres = 1
+            units = ''
 
     # Store the X and Y pixel size, offset and unit
     try:
@@ -57,51 +156,52 @@ def _metadata(path):
     return metaData
 
 
-def ingest_NCEM_TIF(paths):
-    assert len(paths) == 1
+def _source(path):
+    """ The frames of the first image series of a TIF file with any leading dimensions flattened"""
+    with handles.pool.borrow(path, _open) as tif:
+        series = tif.series[0]
+        frame_shape = series.pages[0].shape
+        frame_axes = tuple(range(-len(frame_shape), 0))
+        memmappable = series.dataoffset is not None and series.pages[0].is_memmappable
+
+    if memmappable:
+        # Uncompressed contiguous series (e.g. ImageJ hyperstacks) are mapped directly
+        return frames.PooledSource(path, _memmap, 'TIF', frame_axes=frame_axes)
+    if zarr and len(series.shape) == len(frame_shape) + 1:
+        return _TiffTiles(path)
+    return _TiffPages(path)
+
+
+def _dask_data(path):
+    """ A lazy dask array of the frames in the first image series as [t, y, x]"""
+    return _source(path).to_dask()
+
+
+def ingest_NCEM_TIF(paths, external=False):
+    paths = multifile.natural_sort(paths)
     path = paths[0]
 
     # Compose run start
     run_bundle = event_model.compose_run()  # type: event_model.ComposeRunBundle
-    start_doc = metadata = _metadata(path)
+    start_doc = _metadata(path)
     start_doc.update(run_bundle.start_doc)
     start_doc["sample_name"] = Path(paths[0]).resolve().stem
+    start_doc['FileNames'] = [str(p) for p in paths]
     start_doc['FileName'] = path
     yield 'start', start_doc
 
-    num_t = _num_t(path)
-    first_frame = _get_slice(path, 0)
-    shape = first_frame.shape
-    dtype = first_frame.dtype
-
-    delayed_get_slice = dask.delayed(_get_slice)
-    dask_data = da.stack([da.from_delayed(delayed_get_slice(path, t), shape=shape, dtype=dtype)
-                          for t in range(num_t)])
-
-    # Compose descriptor
-    source = 'NCEM'
-    frame_data_keys = {'raw': {'source': source,
-                               'dtype': 'number',
-                               'shape': (num_t, *shape)}}
-    frame_stream_name = 'primary'
-    frame_stream_bundle = run_bundle.compose_descriptor(data_keys=frame_data_keys,
-                                                        name=frame_stream_name,
-                                                        # configuration=_metadata(path)
-                                                        )
-    yield 'descriptor', frame_stream_bundle.descriptor_doc
-
-    # NOTE: Resource document may be meaningful in the future. For transient access it is not useful
-    # # Compose resource
-    # resource = run_bundle.compose_resource(root=Path(path).root, resource_path=path, spec='NCEM_DM', resource_kwargs={})
-    # yield 'resource', resource.resource_doc
-
-    # Compose datum_page
-    # z_indices, t_indices = zip(*itertools.product(z_indices, t_indices))
-    # datum_page_doc = resource.compose_datum_page(datum_kwargs={'index_z': list(z_indices), 'index_t': list(t_indices)})
-    # datum_ids = datum_page_doc['datum_id']
-    # yield 'datum_page', datum_page_doc
-
-    yield 'event', frame_stream_bundle.compose_event(data={'raw': dask_data},
-                                                     timestamps={'raw': time.time()})
+    sources = multifile.map_headers(_source, paths)
+    dask_data = multifile.concatenate(sources, paths).to_dask()
+    yield from frames.compose_stream(run_bundle, dask_data, paths, [len(source) for source in sources], 'NCEM_TIF',
+                                     external=external)
 
     yield 'stop', run_bundle.compose_stop()
+
+
+class TIFHandler(resources.FrameHandler):
+    """ Serves the frames of a TIFF file referenced by a NCEM_TIF resource"""
+
+    specs = {'NCEM_TIF'}
+
+    def _open(self, path):
+        return _dask_data(path)
@@ -0,0 +1,95 @@
+""" Part of the NCEM plugin for Xicam to read Zarr stores converted from NCEM files.
+
+xicam.NCEM.export writes the runs produced by the other ingestors to a Zarr directory store. The
+store is laid out as:
+
+    run.zarr/
+        .zattrs          {'ncem_zarr': 1, 'metadata': {...}, 'streams': ['primary', ...]}
+        primary/
+            .zattrs      {'configuration': {...}, 'data_keys': {...}}
+            raw          the frames, chunked for the viewer and compressed
+        frames/
+            time         one array per column of a table stream (e.g. SER frame times)
+            ...
+
+Notes:
+    - The metadata is the start document of the original run, so the converted run has the same
+      keys (PhysicalSizeX, FileName, ...).
+    - raw is read lazily with dask. Blocks contain whole chunks of the store.
+
+"""
+
+import time
+from pathlib import Path
+
+import numpy as np
+
+from . import frames, lazy
+
+event_model = lazy.LazyModule('event_model')
+zarr = lazy.LazyModule('zarr')  # optional
+
+# Version of the store layout written by xicam.NCEM.export
+FORMAT_VERSION = 1
+
+
+def _open(path):
+    if not zarr:
+        raise ImportError('Reading converted NCEM files requires zarr')
+    group = zarr.open_group(str(path), mode='r')
+    if group.attrs.get('ncem_zarr') != FORMAT_VERSION:
+        raise ValueError('{} is not a Zarr store written by xicam.NCEM.export'.format(path))
+    return group
+
+
+def _dask_data(path, array):
+    """ A lazy dask array of a Zarr array with blocks of whole store chunks"""
+    source = frames.ArraySource(path, array, 'ZARR', native_chunks=array.chunks, frame_axes=(-2, -1),
+                                scan=array.ndim == 4)
+    return source.to_dask()
+
+
+def ingest_NCEM_ZARR(paths):
+    assert len(paths) == 1
+    path = paths[0]
+
+    group = _open(path)
+
+    # Compose run start
+    run_bundle = event_model.compose_run()  # type: event_model.ComposeRunBundle
+    start_doc = dict(group.attrs['metadata'])
+    start_doc.update(run_bundle.start_doc)
+    start_doc["sample_name"] = start_doc.get('sample_name', Path(path).resolve().stem)
+    start_doc['ConvertedFrom'] = start_doc.get('FileName')
+    start_doc['FileName'] = str(path)
+    yield 'start', start_doc
+
+    for stream_name in group.attrs['streams']:
+        stream = group[stream_name]
+        configuration = stream.attrs.get('configuration', {})
+
+        if 'raw' in stream:
+            dask_data = _dask_data(path, stream['raw'])
+            yield from frames.compose_stream(run_bundle, dask_data, [path], [dask_data.shape[0]], None,
+                                             name=stream_name, configuration=configuration)
+            continue
+
+        # A table stream with one array per column
+        table = {name: stream[name][:] for name in stream.attrs['data_keys']}
+        table_stream_bundle = run_bundle.compose_descriptor(data_keys=stream.attrs['data_keys'],
+                                                            name=stream_name,
+                                                            configuration=configuration)
+        yield 'descriptor', table_stream_bundle.descriptor_doc
+
+        num_rows = len(next(iter(table.values()))) if table else 0
+        now = time.time()
+        times = table['time'] if 'time' in table else np.full(num_rows, now)
+        times = np.where(np.isfinite(times), times, now)
+        yield 'event_page', table_stream_bundle.compose_event_page(
+            data={name: values.tolist() for name, values in table.items()},
+            timestamps={name: times.tolist() for name in table},
+            seq_num=list(range(1, num_rows + 1)),
+            time=times.tolist(),
+            validate=False)
+
+    yield 'stop', run_bundle.compose_stop()
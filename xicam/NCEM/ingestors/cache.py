@@ -0,0 +1,216 @@
+""" Part of the NCEM plugin for Xicam to cache values derived from data files on disk.
+
+Values are keyed by the identity of the file they came from (resolved path, size, modification
+time and inode). A file that is rewritten gets a new identity, so stale entries are never used.
+
+Arrays are stored as .npz files. Metadata (the return values of the ingestors' _metadata functions)
+is stored in a SQLite data base that is shared between sessions and processes:
+
+    @cache.cached_metadata
+    def _metadata(path):
+        ...
+
+Each call returns a new copy of the cached value, so callers may modify it freely. The least
+recently used entries are evicted when the data base grows beyond metadata_cache.max_bytes.
+Values that can not be pickled are returned as computed and not cached. Cached values must not
+depend on the path used to reach the file (e.g. a relative path), since any path to the same
+file returns the same entry.
+
+The cache is stored in the Xi-cam user cache directory. Set the XICAM_NCEM_CACHE_DIR environment
+variable to use a different location.
+
+"""
+
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from appdirs import user_cache_dir
+
+# The NCEM directory in xicam.core.paths.user_cache_dir. xicam.core is not imported because it
+# imports the Xi-cam plugin system.
+CACHE_DIR = Path(os.environ.get('XICAM_NCEM_CACHE_DIR',
+                                Path(user_cache_dir(appname='xicam', appauthor='CAMERA')) / 'NCEM'))
+
+
+def file_identity(path):
+    """ The identity of a file as (resolved path, size, mtime_ns, inode)"""
+    path = Path(path).resolve()
+    st = path.stat()
+    return str(path), st.st_size, st.st_mtime_ns, st.st_ino
+
+
+def cache_key(path, *args):
+    """ A key for a value derived from the file at path. Extra args distinguish values from the same file."""
+    token = repr((file_identity(path),) + args)
+    return hashlib.sha1(token.encode('utf-8')).hexdigest()
+
+
+def thumbnail_path(path):
+    """ The location of the cached thumbnail image of the file at path"""
+    return CACHE_DIR / 'thumbnails' / f'{cache_key(path)}.png'
+
+
+def load_arrays(name, key):
+    """ Load a dict of arrays saved with save_arrays or return None if it is not cached"""
+    cache_path = CACHE_DIR / name / f'{key}.npz'
+    try:
+        with np.load(cache_path, allow_pickle=False) as npz:
+            return {k: npz[k] for k in npz.files}
+    except (OSError, ValueError):
+        return None
+
+
+def save_arrays(name, key, arrays):
+    """ Save a dict of arrays. The file is written to a temporary name first so readers never see a partial file."""
+    cache_path = CACHE_DIR / name / f'{key}.npz'
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_name(f'{key}.{os.getpid()}.tmp.npz')
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass  # the cache is an optimization; a read-only cache directory is not an error
+
+
+class MetadataCache:
+    """ A persistent, size-bounded cache of picklable values backed by SQLite.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path or None
+        The data base file. None uses metadata.sqlite in CACHE_DIR.
+    max_bytes : int
+        The least recently used entries are evicted when the stored values exceed this size.
+
+    """
+
+    def __init__(self, path=None, max_bytes=64 * 1024 ** 2):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def db_path(self):
+        return Path(self.path) if self.path is not None else CACHE_DIR / 'metadata.sqlite'
+
+    def get(self, key, default=None):
+        """ A new copy of the value stored for key or default if it is not cached"""
+        try:
+            with self._connect() as conn:
+                row = conn.execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    conn.execute('UPDATE entries SET accessed = ? WHERE key = ?', (time.time(), key))
+        except (OSError, sqlite3.Error):
+            row = None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+        return pickle.loads(row[0])
+
+    def put(self, key, value):
+        """ Store value for key and evict the least recently used entries if the cache is too large.
+
+        Returns False if value could not be stored (e.g. it can not be pickled).
+        """
+        try:
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return False
+        try:
+            with self._connect() as conn:
+                conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                             (key, blob, len(blob), time.time()))
+                self._evict(conn)
+        except (OSError, sqlite3.Error):
+            return False  # the cache is an optimization; a read-only cache directory is not an error
+        return True
+
+    def stats(self):
+        """ Hit and miss counts, the hit rate and the number and size of the cached entries"""
+        try:
+            with self._connect() as conn:
+                entries, nbytes = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        except (OSError, sqlite3.Error):
+            entries, nbytes = 0, 0
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0,
+                    'entries': entries, 'bytes': nbytes}
+
+    def clear(self):
+        """ Remove all entries and reset the counters"""
+        try:
+            with self._connect() as conn:
+                conn.execute('DELETE FROM entries')
+        except (OSError, sqlite3.Error):
+            pass
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def _evict(self, conn):
+        total, = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return
+        evict = []
+        for key, size in conn.execute('SELECT key, size FROM entries ORDER BY accessed'):
+            evict.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany('DELETE FROM entries WHERE key = ?', evict)
+
+    def _connect(self):
+        # SQLite connections can not be shared between threads
+        db_path = self.db_path
+        connections = self._local.__dict__.setdefault('connections', {})
+        conn = connections.get(db_path)
+        if conn is None:
+            db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(db_path), timeout=10)
+            conn.execute('CREATE TABLE IF NOT EXISTS entries '
+                         '(key TEXT PRIMARY KEY, value BLOB, size INTEGER, accessed REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+            connections[db_path] = conn
+        return conn
+
+
+# The metadata cache shared by all of the ingestors
+metadata_cache = MetadataCache()
+
+_MISSING = object()
+
+
+def cached_metadata(func):
+    """ Cache the return value of func(path, *args) in metadata_cache keyed by the identity of the file at path"""
+    name = '{}.{}'.format(func.__module__, func.__qualname__)
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(path, *args, **kwargs):
+        bound = signature.bind(path, *args, **kwargs)
+        bound.apply_defaults()
+        key = cache_key(path, name, *list(bound.arguments.values())[1:])
+        value = metadata_cache.get(key, _MISSING)
+        if value is _MISSING:
+            value = func(*bound.args, **bound.kwargs)
+            if metadata_cache.put(key, value):
+                # Return a copy so the caller can not modify what the next caller receives
+                value = pickle.loads(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        return value
+
+    return wrapper
@@ -0,0 +1,146 @@
+""" Part of the NCEM plugin for Xicam to choose dask chunk shapes for image stacks.
+
+The ingestors expose each data set as a lazy dask array. Reading one frame per dask task ignores
+the on-disk layout of the file and creates very large task graphs for long series. The functions
+here choose chunks that contain one or more whole native (HDF5) chunks or, for contiguous data,
+a slab of several whole frames.
+
+Notes:
+    - Frame axes (by default the last two axes in C-ordering) are never split unless the file is
+      natively chunked along them.
+    - The remaining (series) axes are blocked so that one dask chunk is close to TARGET_BLOCK_BYTES.
+
+"""
+
+import numpy as np
+
+# Aim for dask blocks of about this many bytes
+TARGET_BLOCK_BYTES = 32 * 1024 ** 2
+
+# Chunks of converted files are kept small enough to decompress for a single view
+VIEWER_CHUNK_BYTES = 4 * 1024 ** 2
+
+
+def stack_chunks(shape, dtype, native_chunks=None, frame_axes=(-2, -1), target_bytes=TARGET_BLOCK_BYTES):
+    """ Choose dask chunks for a stack of frames.
+
+    Parameters
+    ----------
+    shape : tuple
+        The shape of the data set.
+    dtype : numpy.dtype
+        The data type of the data set.
+    native_chunks : tuple or None
+        The chunk shape used in the file (h5py.Dataset.chunks). None for contiguous data.
+    frame_axes : tuple
+        The axes that make up a single frame. These are kept whole.
+    target_bytes : int
+        The approximate number of bytes in each dask chunk.
+
+    Returns
+    -------
+    : tuple
+        A chunk shape with one entry per axis that can be passed to dask.array.from_array.
+
+    """
+    ndim = len(shape)
+    frame_axes = sorted(ax % ndim for ax in frame_axes) if ndim > 0 else []
+    if native_chunks is None:
+        native_chunks = (1,) * ndim
+
+    chunks = [1] * ndim
+    for ax in frame_axes:
+        chunks[ax] = shape[ax]
+
+    # Series axes are filled from the innermost outward to follow C-ordering on disk
+    block_bytes = np.dtype(dtype).itemsize * int(np.prod([shape[ax] for ax in frame_axes], dtype=np.int64))
+    series_axes = [ax for ax in range(ndim) if ax not in frame_axes]
+    for ax in reversed(series_axes):
+        native = max(1, min(int(native_chunks[ax]), shape[ax]))
+        block_bytes *= native
+        count = max(1, target_bytes // max(1, block_bytes))
+        chunks[ax] = min(shape[ax], native * count)
+        block_bytes = block_bytes // native * chunks[ax]
+        if chunks[ax] < shape[ax]:
+            # Outer axes stay at their native chunk size once the budget is used up
+            for outer in series_axes[:series_axes.index(ax)]:
+                chunks[outer] = max(1, min(int(native_chunks[outer]), shape[outer]))
+            break
+
+    return tuple(max(1, int(c)) for c in chunks)
+
+
+def scan_chunks(shape, dtype, native_chunks=None, target_bytes=TARGET_BLOCK_BYTES):
+    """ Choose dask chunks for a 4D-STEM data set ordered as [scan_y, scan_x, ky, kx].
+
+    The scan axes are blocked into square tiles so that a region of the real-space image and a
+    single diffraction pattern both touch only a few chunks. Diffraction patterns are kept whole
+    unless the file is natively chunked along ky and kx, in which case the native chunks are used
+    so that virtual detectors only read the parts of the pattern they need.
+
+    Parameters
+    ----------
+    shape : tuple
+        The 4D shape of the data set.
+    dtype : numpy.dtype
+        The data type of the data set.
+    native_chunks : tuple or None
+        The chunk shape used in the file (h5py.Dataset.chunks). None for contiguous data.
+    target_bytes : int
+        The approximate number of bytes in each dask chunk.
+
+    Returns
+    -------
+    : tuple
+        A chunk shape with one entry per axis.
+
+    """
+    if native_chunks is None:
+        native_chunks = (1, 1, shape[2], shape[3])
+    native = [max(1, min(int(c), s)) for c, s in zip(native_chunks, shape)]
+
+    pattern_bytes = np.dtype(dtype).itemsize * native[2] * native[3]
+    num_patterns = max(1, target_bytes // max(1, pattern_bytes))
+    tile = max(1, int(np.sqrt(num_patterns)))
+
+    chunks = []
+    for ax in (0, 1):
+        # Round the tile to a whole number of native chunks along each scan axis
+        count = max(1, tile // native[ax])
+        chunks.append(min(shape[ax], native[ax] * count))
+    chunks.extend(native[2:])
+
+    return tuple(chunks)
+
+
+def viewer_chunks(shape, dtype, target_bytes=VIEWER_CHUNK_BYTES):
+    """ Choose the on-disk chunks of a converted file for the way the viewer reads it.
+
+    Stacks are stored one frame per chunk so that showing a frame decompresses nothing else. Frames
+    larger than target_bytes are split into tiles by halving the longer frame axis. 4D-STEM data
+    sets use square tiles of scan positions with whole diffraction patterns (see scan_chunks).
+
+    Parameters
+    ----------
+    shape : tuple
+        The shape of the data set.
+    dtype : numpy.dtype
+        The data type of the data set.
+    target_bytes : int
+        The approximate maximum number of bytes in each chunk.
+
+    Returns
+    -------
+    : tuple
+        A chunk shape with one entry per axis.
+
+    """
+    if len(shape) == 4:
+        return scan_chunks(shape, dtype, target_bytes=target_bytes)
+
+    itemsize = np.dtype(dtype).itemsize
+    frame = [max(1, int(s)) for s in shape[-2:]]
+    while itemsize * int(np.prod(frame)) > target_bytes and max(frame) > 256:
+        ax = int(np.argmax(frame))
+        frame[ax] = (frame[ax] + 1) // 2
+    return (1,) * (len(shape) - len(frame)) + tuple(frame)
@@ -0,0 +1,316 @@
+""" Part of the NCEM plugin for Xicam to read the frames of every file format the same way.
+
+Each ingestor describes a data set as a FrameSource: its shape, data type and native chunking, and
+read_frames(indices), which reads any set of frames along the first axis in as few requests as the
+format allows (a fancy index into a memory map, one slab of an HDF5 data set per chunk, a batch of
+TIFF pages decoded on a thread pool). Chunking, instrumentation and the documents of the frame
+stream are implemented here once:
+
+    source = ArraySource(path, np.memmap(path, ...), 'MRC')
+    dask_data = source.to_dask()
+    ...
+    yield from compose_stream(run_bundle, dask_data, paths, lengths, 'NCEM_MRC', external=external)
+
+Notes:
+    - Dask reads a source through __getitem__. The default implementation reads whole frames with
+      read_frames and then crops them. Sources that can read part of a frame (memory maps, HDF5)
+      index the file directly, so a tile of a large frame only reads that tile.
+
+"""
+
+import numbers
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from . import cache, handles, lazy, metrics, resources
+from .chunking import stack_chunks, scan_chunks
+
+da = lazy.LazyModule('dask.array')
+
+
+def frame_indices(key, length):
+    """ The frame indices selected by an integer, slice or sequence key along an axis of length"""
+    if isinstance(key, slice):
+        return np.arange(*key.indices(length), dtype=np.intp)
+    indices = np.asarray(key, dtype=np.intp).reshape(-1)
+    return np.where(indices < 0, indices + length, indices)
+
+
+class FrameSource:
+    """ The frames of one data set in a file, indexed along the first axis.
+
+    Subclasses set shape and dtype and implement read_frames.
+
+    Attributes
+    ----------
+    path : str
+        The file the frames are read from (used for the metrics and the dask name).
+    fmt : str
+        The format label of the metrics, e.g. 'MRC'.
+    shape : tuple
+        The shape of the data set with the frames along the first axis.
+    dtype : numpy.dtype
+        The data type of the frames.
+    native_chunks : tuple or None
+        The chunk shape used in the file. None for contiguous data.
+    frame_axes : tuple or None
+        The axes that are never split into dask blocks. None for all axes after the first.
+    scan : bool
+        True for 4D-STEM data sets [scan_y, scan_x, ky, kx] that are blocked in tiles of scan
+        positions (see chunking.scan_chunks).
+    part : str or None
+        Identifies the data set in a file with several (e.g. the HDF5 path).
+
+    """
+
+    fmt = ''
+    native_chunks = None
+    frame_axes = None
+    scan = False
+    part = None
+
+    def __init__(self, path, shape, dtype):
+        self.path = path
+        self.shape = tuple(int(ii) for ii in shape)
+        self.dtype = np.dtype(dtype)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def read_frames(self, indices):
+        """ The frames at indices (in that order, repeats allowed) as one [len(indices), ...] array"""
+        raise NotImplementedError
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        tt, rest = key[0], key[1:]
+        if isinstance(tt, numbers.Integral):
+            return self.read_frames(frame_indices(tt, len(self)))[0][rest]
+        return self.read_frames(frame_indices(tt, len(self)))[(slice(None),) + rest]
+
+    def chunks(self):
+        """ The dask chunks (see chunking.stack_chunks and chunking.scan_chunks)"""
+        if self.scan and self.ndim == 4:
+            return scan_chunks(self.shape, self.dtype, native_chunks=self.native_chunks)
+        frame_axes = self.frame_axes if self.frame_axes is not None else range(1, self.ndim)
+        return stack_chunks(self.shape, self.dtype, native_chunks=self.native_chunks, frame_axes=frame_axes)
+
+    def name(self):
+        """ A dask name that is the same for every source of the same file contents"""
+        return '{}-{}'.format(self.fmt.lower(), cache.cache_key(self.path, type(self).__name__, self.part,
+                                                                   self.chunks()))
+
+    def to_dask(self, name=None):
+        """ A lazy dask array of all frames, instrumented with metrics. The name defaults to self.name()."""
+        return da.from_array(metrics.instrument(self, self.fmt, self.path), chunks=self.chunks(),
+                             name=self.name() if name is None else name)
+
+
+class ArraySource(FrameSource):
+    """ The frames of an array-like with numpy indexing: a memory map, an HDF5 data set or a Zarr array.
+
+    Parameters
+    ----------
+    path : str
+        The file the array is read from.
+    array : array-like
+        The data set with the frames along the first axis.
+    fmt : str
+        The format label of the metrics.
+    native_chunks : tuple or None
+        The chunk shape of the array in the file.
+    frame_axes : tuple or None
+        See FrameSource.
+    scan : bool
+        See FrameSource.
+    owner : object
+        An object to keep alive as long as the array is used, e.g. the ncempy file object whose
+        HDF5 file is closed when it is garbage collected.
+
+    """
+
+    def __init__(self, path, array, fmt, native_chunks=None, frame_axes=None, scan=False, owner=None):
+        super(ArraySource, self).__init__(path, array.shape, array.dtype)
+        self.array = array
+        self.fmt = fmt
+        self.native_chunks = native_chunks
+        self.frame_axes = frame_axes
+        self.scan = scan
+        self.part = getattr(array, 'name', None)  # HDF5 and Zarr paths
+        self.owner = owner
+
+    def read_frames(self, indices):
+        indices = np.asarray(indices, dtype=np.intp)
+        if len(indices) == 0:
+            return np.empty((0, *self.shape[1:]), dtype=self.dtype)
+        steps = np.diff(indices)
+        if len(indices) == 1 or (steps[0] > 0 and (steps == steps[0]).all()):
+            step = int(steps[0]) if len(steps) else 1
+            return np.asarray(self[int(indices[0]):int(indices[-1]) + 1:step])
+
+        # HDF5 needs increasing indices and Zarr needs orthogonal indexing for index arrays
+        unique, inverse = np.unique(indices, return_inverse=True)
+        with self._borrow() as array:
+            return np.asarray(getattr(array, 'oindex', array)[unique])[inverse]
+
+    def __getitem__(self, key):
+        """ Index the array directly so that part of a frame only reads that part"""
+        with self._borrow() as array:
+            data = array[key]
+        return data if isinstance(data, np.ndarray) else np.asarray(data)  # keeps np.memmap for metrics
+
+    @contextmanager
+    def _borrow(self):
+        yield self.array
+
+
+class PooledSource(ArraySource):
+    """ The frames of the array returned by opener(path), borrowed from handles.pool for each read.
+
+    No file is held open between reads. A series of thousands of files therefore stays within the
+    open file limit of the pool (and of the process). opener is typically a function that returns a
+    read-only memory map of the file. Reads are copied out of the memory map, since a view would
+    keep the file open after the map is returned to the pool.
+
+    """
+
+    def __init__(self, path, opener, fmt, **kwargs):
+        self.path = path
+        self.opener = opener
+        with self._borrow() as array:
+            super(PooledSource, self).__init__(path, array, fmt, **kwargs)
+        self.array = None
+
+    def __getitem__(self, key):
+        return np.array(super(PooledSource, self).__getitem__(key))
+
+    @contextmanager
+    def _borrow(self):
+        with handles.pool.borrow(self.path, self.opener) as array:
+            yield array
+
+
+class ConcatenatedSource(FrameSource):
+    """ The frames of several sources one after the other, e.g. a series written as numbered files.
+
+    The dask array is a single layer however many files there are. Its blocks never cross a file
+    boundary, so each task reads from one source and the reads are recorded per file.
+
+    """
+
+    def __init__(self, sources):
+        first = sources[0]
+        self.sources = list(sources)
+        self.offsets = np.cumsum([0] + [len(source) for source in self.sources])
+        super(ConcatenatedSource, self).__init__(first.path, (int(self.offsets[-1]), *first.shape[1:]), first.dtype)
+        self.fmt = first.fmt
+        self.native_chunks = first.native_chunks
+        self.frame_axes = first.frame_axes
+        self.scan = first.scan
+        # Instrumented when made, like FrameSource.to_dask
+        self._readers = [metrics.instrument(source, source.fmt, source.path) for source in self.sources]
+
+    def _locate(self, start, stop):
+        """ (source number, local start, local stop) of each file with frames in [start, stop)"""
+        first = int(np.searchsorted(self.offsets, start, side='right')) - 1
+        for ii in range(max(first, 0), len(self.sources)):
+            offset = int(self.offsets[ii])
+            if offset >= stop:
+                break
+            yield ii, max(start - offset, 0), min(stop, int(self.offsets[ii + 1])) - offset
+
+    def read_frames(self, indices):
+        indices = np.asarray(indices, dtype=np.intp)
+        out = np.empty((len(indices), *self.shape[1:]), dtype=self.dtype)
+        files = np.searchsorted(self.offsets, indices, side='right') - 1
+        for ii in np.unique(files):
+            selected = files == ii
+            out[selected] = self.sources[ii].read_frames(indices[selected] - self.offsets[ii])
+        return out
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        tt, rest = key[0], key[1:]
+        if isinstance(tt, numbers.Integral):
+            tt = tt + len(self) if tt < 0 else tt
+            ((ii, t0, _),) = self._locate(tt, tt + 1)
+            return self._readers[ii][(t0,) + rest]
+        if not isinstance(tt, slice) or tt.indices(len(self))[2] != 1:
+            return super(ConcatenatedSource, self).__getitem__(key)
+        start, stop, _ = tt.indices(len(self))
+        pieces = [self._readers[ii][(slice(t0, t1),) + rest] for ii, t0, t1 in self._locate(start, stop)]
+        if len(pieces) == 1:
+            return pieces[0]  # a dask block
+        if not pieces:
+            return self.read_frames([])[(slice(None),) + rest]
+        return np.concatenate(pieces)
+
+    def chunks(self):
+        blocks = []
+        for source in self.sources:
+            step = source.chunks()[0]
+            blocks.extend([step] * (len(source) // step))
+            if len(source) % step:
+                blocks.append(len(source) % step)
+        return (tuple(blocks), *self.sources[0].chunks()[1:])
+
+    def name(self):
+        return '{}-{}'.format(self.fmt.lower(), cache.cache_key(self.path, [source.name() for source in self.sources]))
+
+    def to_dask(self, name=None):
+        return da.from_array(self, chunks=self.chunks(), name=self.name() if name is None else name)
+
+
+def compose_stream(run_bundle, dask_data, paths, lengths, spec, name='primary', configuration=None,
+                   external=False, resource_kwargs=None):
+    """ Yield the descriptor and event documents of a stream with the frames in dask_data as 'raw'.
+
+    Parameters
+    ----------
+    run_bundle : event_model.ComposeRunBundle
+        The run the stream belongs to.
+    dask_data : dask.array.Array
+        The frames of all files along the first axis.
+    paths : list
+        The files in the order their frames appear in dask_data.
+    lengths : list of int
+        The number of frames in each file.
+    spec : str
+        The handler spec used with external=True, e.g. 'NCEM_MRC'.
+    name : str
+        The stream name.
+    configuration : dict
+        The descriptor configuration.
+    external : bool
+        Emit resource and datum documents and one event per frame instead of one event with dask_data
+        (see resources).
+    resource_kwargs : dict
+        Extra arguments for the handler.
+
+    """
+    source = 'NCEM'
+    if external:
+        frame_data_keys = {'raw': resources.frame_data_key(source, dask_data.shape, dask_data.dtype)}
+    else:
+        frame_data_keys = {'raw': {'source': source,
+                                   'dtype': 'number',
+                                   'shape': dask_data.shape}}
+    frame_stream_bundle = run_bundle.compose_descriptor(data_keys=frame_data_keys,
+                                                        name=name,
+                                                        configuration=configuration)
+    yield 'descriptor', frame_stream_bundle.descriptor_doc
+
+    if external:
+        yield from resources.compose_external(run_bundle, frame_stream_bundle, paths, lengths, spec,
+                                              resource_kwargs)
+    else:
+        yield 'event', frame_stream_bundle.compose_event(data={'raw': dask_data},
+                                                         timestamps={'raw': time.time()})
@@ -0,0 +1,135 @@
+""" Part of the NCEM plugin for Xicam to share open file handles between frame reads.
+
+Opening a SER, MRC or TIF file parses its header. Doing that for every frame dominates the time
+to play back a long series. The frame readers instead borrow an open reader object from a pool:
+
+    with handles.pool.borrow(path, ser.fileSER) as ser_obj:
+        data = ser_obj.getDataset(t)[0]
+
+Handles are keyed by the opener and the file identity (path, size, mtime and inode), so a file that
+is rewritten is opened again. A borrowed handle is used by one thread at a time. Idle handles
+are kept for the most recently used files up to max_files and the total number of open handles
+never exceeds max_open.
+
+"""
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from . import metrics
+from .cache import file_identity
+
+
+def _format_of(opener):
+    # e.g. 'MRC' for ncempy.io.mrc.fileMRC and 'TIF' for TIFPlugin._open
+    return opener.__module__.rsplit('.', 1)[-1].replace('Plugin', '').upper()
+
+
+def _close(handle):
+    if hasattr(handle, 'close'):
+        handle.close()
+    elif hasattr(handle, '__exit__'):
+        handle.__exit__(None, None, None)
+
+
+class HandlePool:
+    """ A thread-safe pool of open file reader objects.
+
+    Parameters
+    ----------
+    max_files : int
+        The number of files whose idle handles are kept open (least recently used files are closed first).
+    max_open : int
+        The maximum number of open handles including borrowed ones. Borrowing waits when the limit is reached.
+
+    """
+
+    def __init__(self, max_files=16, max_open=64):
+        self.max_files = max_files
+        self.max_open = max_open
+        self.hits = 0
+        self.misses = 0
+        self._idle = OrderedDict()  # key -> list of idle handles, least recently used first
+        self._num_open = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def borrow(self, path, opener):
+        """ Borrow an open handle for path, opening it with opener(path) if no idle handle exists."""
+        key = (opener, *file_identity(path))
+        handle = self._acquire(key, path, opener)
+        try:
+            yield handle
+        finally:
+            self._release(key, handle)
+
+    def stats(self):
+        """ Hit and miss counts and the number of open handles"""
+        with self._condition:
+            return {'hits': self.hits, 'misses': self.misses, 'open': self._num_open,
+                    'files': len(self._idle)}
+
+    def clear(self):
+        """ Close all idle handles and reset the counters"""
+        with self._condition:
+            for key in list(self._idle):
+                self._close_key(key)
+            self.hits = 0
+            self.misses = 0
+
+    def _acquire(self, key, path, opener):
+        with self._condition:
+            while True:
+                idle = self._idle.get(key)
+                if idle:
+                    self.hits += 1
+                    handle = idle.pop()
+                    if not idle:
+                        del self._idle[key]
+                    return handle
+                self._drop_stale(key)
+                if self._num_open < self.max_open:
+                    self.misses += 1
+                    self._num_open += 1
+                    break
+                if not self._close_lru():
+                    self._condition.wait()
+
+        try:
+            with metrics.measure(_format_of(opener), 'open', path):
+                return opener(path)
+        except:
+            with self._condition:
+                self._num_open -= 1
+                self._condition.notify()
+            raise
+
+    def _release(self, key, handle):
+        with self._condition:
+            self._idle.setdefault(key, []).append(handle)
+            self._idle.move_to_end(key)
+            while len(self._idle) > self.max_files:
+                self._close_lru()
+            self._condition.notify()
+
+    def _drop_stale(self, key):
+        # Close idle handles to an older version of the same file
+        for other in list(self._idle):
+            if other[:2] == key[:2] and other != key:
+                self._close_key(other)
+
+    def _close_lru(self):
+        for key in self._idle:
+            self._close_key(key)
+            return True
+        return False
+
+    def _close_key(self, key):
+        for handle in self._idle.pop(key):
+            _close(handle)
+            self._num_open -= 1
+
+
+# The pool shared by all of the ingestors
+pool = HandlePool()
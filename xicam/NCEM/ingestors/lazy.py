@@ -0,0 +1,51 @@
+""" Part of the NCEM plugin for Xicam to import heavy dependencies on first use.
+
+Databroker imports the ingestors through entry points, often in batch workers that never read a
+frame of some formats. Importing dask.array, ncempy (which imports matplotlib) and event_model up
+front costs more than a second, so the ingestors bind them to proxies instead:
+
+    da = lazy.LazyModule('dask.array')
+    mrc = lazy.LazyModule('ncempy.io.mrc')
+
+The module is imported the first time an attribute of the proxy is used. An optional dependency is
+falsy when it is not installed, which is checked without importing it:
+
+    zarr = lazy.LazyModule('zarr')
+    if zarr:
+        ...
+
+"""
+
+import importlib
+import importlib.util
+
+
+class LazyModule:
+    """ A stand in for the module name that imports it on first attribute access"""
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            module = self.__dict__['_module'] = importlib.import_module(self._name)
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __bool__(self):
+        if self.__dict__['_module'] is not None:
+            return True
+        try:
+            return importlib.util.find_spec(self._name) is not None
+        except (ImportError, ValueError):  # e.g. the parent package is missing
+            return False
+
+    def __repr__(self):
+        return '<lazy module {!r}>'.format(self._name)
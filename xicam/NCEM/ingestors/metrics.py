@@ -0,0 +1,243 @@
+""" Part of the NCEM plugin for Xicam to measure where the time of reading data goes.
+
+When enabled, the ingestors record the number of calls, the bytes returned and a latency histogram
+of every file open, metadata parse and frame read, per format and per file. The viewer records
+the time to show each frame, so the difference to the frame reads is the dask scheduling overhead:
+
+    from xicam.NCEM.ingestors import metrics
+    metrics.enable()  # before the files are ingested
+    ...
+    metrics.snapshot()  # {format: {operation: {'count', 'bytes', 'seconds', ..., 'files': {...}}}}
+
+The operations are 'open' (a new handle in handles.pool), 'metadata' (parsing the header of a file
+that is not in the metadata cache), 'read' (a block of frames read by a dask task or _get_slice)
+and 'frame' (format 'viewer'). HDF5 decompression is part of the EMD reads.
+
+Set the XICAM_NCEM_METRICS environment variable to 1 to enable the metrics at start up. While
+enabled, a summary is logged (logging, INFO) every LOG_INTERVAL seconds.
+
+Notes:
+    - When disabled the frame readers are not wrapped at all (see instrument) and the decorated
+      functions only check a flag. Arrays made while the metrics were disabled stay unmeasured.
+    - Reads of memory mapped frames are copied when measured so that the time includes the read
+      from disk.
+
+"""
+
+import bisect
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram bins in seconds. The last bin counts everything slower.
+BUCKETS = (1e-4, 3e-4, 1e-3, 3e-3, 1e-2, 3e-2, 0.1, 0.3, 1., 3.)
+
+# Seconds between summaries in the log while enabled
+LOG_INTERVAL = 60.
+
+_enabled = False
+_stats = {}  # (format, operation, path) -> Stat
+_lock = threading.Lock()
+_reporter = None
+
+
+class Stat:
+    """ Counts, bytes and a latency histogram of one operation"""
+
+    __slots__ = ('count', 'bytes', 'seconds', 'max', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.seconds = 0.
+        self.max = 0.
+        self.histogram = [0] * (len(BUCKETS) + 1)
+
+    def add(self, nbytes, seconds):
+        self.count += 1
+        self.bytes += nbytes
+        self.seconds += seconds
+        self.max = max(self.max, seconds)
+        self.histogram[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.bytes += other.bytes
+        self.seconds += other.seconds
+        self.max = max(self.max, other.max)
+        self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+
+    def as_dict(self):
+        labels = [str(b) for b in BUCKETS] + ['inf']
+        return {'count': self.count,
+                'bytes': self.bytes,
+                'seconds': self.seconds,
+                'mean': self.seconds / self.count if self.count else 0.,
+                'max': self.max,
+                'histogram': dict(zip(labels, self.histogram))}
+
+
+def is_enabled():
+    return _enabled
+
+
+def enable(log_interval=LOG_INTERVAL):
+    """ Start recording. A summary is logged every log_interval seconds (never if None)."""
+    global _enabled, _reporter
+    _enabled = True
+    if log_interval and _reporter is None:
+        _reporter = _Reporter(log_interval)
+        _reporter.start()
+
+
+def disable():
+    """ Stop recording. The recorded values are kept until reset."""
+    global _enabled, _reporter
+    _enabled = False
+    if _reporter is not None:
+        _reporter.stop()
+        _reporter = None
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def record(fmt, operation, path, nbytes, seconds):
+    """ Add one measurement of operation on the file at path"""
+    key = (fmt, operation, str(path) if path is not None else '')
+    with _lock:
+        stat = _stats.get(key)
+        if stat is None:
+            stat = _stats[key] = Stat()
+        stat.add(nbytes, seconds)
+
+
+@contextmanager
+def measure(fmt, operation, path=None, nbytes=0):
+    """ Record the time spent in the with block"""
+    if not _enabled:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(fmt, operation, path, nbytes, time.perf_counter() - t0)
+
+
+def _path_of(args):
+    if not args:
+        return None
+    if isinstance(args[0], (str, os.PathLike)):
+        return args[0]
+    # ncempy file objects
+    return getattr(args[0], 'file_path', None) or getattr(args[0], 'file_name', None)
+
+
+def timed(fmt, operation):
+    """ Decorate a function of a file path (or ncempy file object) to record its calls"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            t0 = time.perf_counter()
+            result = func(*args, **kwargs)
+            record(fmt, operation, _path_of(args), getattr(result, 'nbytes', 0), time.perf_counter() - t0)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+class InstrumentedArray:
+    """ An array-like that records every read of the array-like it wraps"""
+
+    def __init__(self, array, fmt, path):
+        self.array = array
+        self.fmt = fmt
+        self.path = path
+        self.shape = array.shape
+        self.dtype = array.dtype
+        self.ndim = len(array.shape)
+
+    def __getitem__(self, key):
+        t0 = time.perf_counter()
+        data = self.array[key]
+        data = np.array(data) if isinstance(data, np.memmap) else np.asarray(data)
+        if data.size:  # not the empty slices dask takes to learn the array type
+            record(self.fmt, 'read', self.path, data.nbytes, time.perf_counter() - t0)
+        return data
+
+
+def instrument(array, fmt, path):
+    """ array wrapped to record its reads if the metrics are enabled, otherwise array itself"""
+    if not _enabled:
+        return array
+    return InstrumentedArray(array, fmt, path)
+
+
+def snapshot(per_file=True):
+    """ The recorded values as {format: {operation: {..., 'files': {path: {...}}}}}"""
+    with _lock:
+        items = [(key, stat.as_dict()) for key, stat in _stats.items()]
+        totals = {}
+        for (fmt, operation, path), stat in _stats.items():
+            total = totals.get((fmt, operation))
+            if total is None:
+                total = totals[(fmt, operation)] = Stat()
+            total.merge(stat)
+
+    out = {}
+    for (fmt, operation), total in totals.items():
+        out.setdefault(fmt, {})[operation] = total.as_dict()
+    if per_file:
+        for (fmt, operation, path), stat in items:
+            out[fmt][operation].setdefault('files', {})[path] = stat
+    return out
+
+
+def report():
+    """ A one line summary of each format and operation"""
+    lines = []
+    for fmt, operations in sorted(snapshot(per_file=False).items()):
+        for operation, stat in sorted(operations.items()):
+            lines.append('{} {}: {} calls, {:.1f} MB, mean {:.2f} ms, max {:.2f} ms'.format(
+                fmt, operation, stat['count'], stat['bytes'] / 1e6, stat['mean'] * 1e3, stat['max'] * 1e3))
+    return '\n'.join(lines)
+
+
+class _Reporter(threading.Thread):
+    """ Logs the summary periodically when something new was recorded"""
+
+    def __init__(self, interval):
+        super(_Reporter, self).__init__(name='NCEM metrics', daemon=True)
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        last_count = 0
+        while not self._stopped.wait(self.interval):
+            with _lock:
+                count = sum(stat.count for stat in _stats.values())
+            if count != last_count:
+                last_count = count
+                logger.info('I/O metrics\n%s', report())
+
+    def stop(self):
+        self._stopped.set()
+
+
+if os.environ.get('XICAM_NCEM_METRICS', '') not in ('', '0'):
+    enable()
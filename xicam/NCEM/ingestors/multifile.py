@@ -0,0 +1,66 @@
+""" Part of the NCEM plugin for Xicam to ingest a series written as many numbered files.
+
+In-situ experiments often write one file per frame or per block of frames (series_1.ser,
+series_2.ser, ..., series_10.ser). The ingestors accept all of the paths and return a single run
+whose raw data is one lazy dask array with the files concatenated along the first axis:
+
+    paths = multifile.natural_sort(paths)
+    sources = multifile.map_headers(_source, paths)
+    dask_data = multifile.concatenate(sources, paths).to_dask()
+
+Only the headers are read to build the array, on a thread pool. The frames of every file must have
+the same shape and data type. The dask graph is a single layer however many files there are (see
+frames.ConcatenatedSource).
+
+"""
+
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .frames import ConcatenatedSource
+
+# Number of files whose headers are parsed at the same time
+MAX_WORKERS = min(8, (os.cpu_count() or 1) + 4)
+
+_DIGITS = re.compile(r'(\d+)')
+
+
+def natural_key(path):
+    """ A sort key that orders the numbers in a file name by value (series_2 before series_10)"""
+    parts = _DIGITS.split(str(path))
+    return [int(part) if part.isdigit() else part.lower() for part in parts]
+
+
+def natural_sort(paths):
+    """ The paths sorted in natural order"""
+    return sorted(paths, key=natural_key)
+
+
+def map_headers(func, paths, max_workers=MAX_WORKERS):
+    """ Call func(path) for each path on a thread pool and return the results in the order of paths"""
+    if len(paths) == 1:
+        return [func(paths[0])]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(paths))) as executor:
+        return list(executor.map(func, paths))
+
+
+def concatenate(sources, paths):
+    """ The frame sources of each file (see frames.FrameSource) as one source, concatenated along the
+    first (time) axis.
+
+    Raises
+    ------
+    ValueError
+        If the frames of a file differ in shape or data type from the first file.
+
+    """
+    first = sources[0]
+    for source, path in zip(sources[1:], paths[1:]):
+        if source.shape[1:] != first.shape[1:] or source.dtype != first.dtype:
+            raise ValueError('{} has frames of shape {} and type {} but {} has shape {} and type {}'.format(
+                Path(path).name, source.shape[1:], source.dtype, Path(paths[0]).name, first.shape[1:], first.dtype))
+    if len(sources) == 1:
+        return first
+    return ConcatenatedSource(sources)
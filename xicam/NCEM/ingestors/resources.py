@@ -0,0 +1,99 @@
+""" Part of the NCEM plugin for Xicam to refer to data by the files it is stored in.
+
+By default the ingestors put the whole data set in one event as a lazy dask array. That run can not
+be saved to a document store. With external=True the ingestors instead emit a resource document for
+each file and a datum for each frame (each index along the first axis). The primary stream then has
+one event per frame that holds the datum id:
+
+    docs = list(ingest_NCEM_MRC([path], external=True))
+
+The handlers registered as databroker.handlers in setup.py reopen a file the first time one of its
+frames is requested and serve frames from the same lazy array the ingestor uses. A stored run can
+then be opened from its documents alone and frames are only read when they are accessed.
+
+"""
+
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+def frame_data_key(source, shape, dtype):
+    """ The data key of a frame in a file referenced by a datum"""
+    return {'source': source,
+            'dtype': 'array',
+            'dtype_str': np.dtype(dtype).str,
+            'shape': list(shape[1:]),
+            'external': 'FILESTORE:'}
+
+
+def compose_external(run_bundle, stream_bundle, paths, lengths, spec, resource_kwargs=None):
+    """ Yield the resource, datum_page and event_page documents for the frames in paths.
+
+    Parameters
+    ----------
+    run_bundle : event_model.ComposeRunBundle
+        The run the documents belong to.
+    stream_bundle : event_model.ComposeDescriptorBundle
+        The stream that gets one event per frame.
+    paths : list
+        The files in the order their frames appear in the stream.
+    lengths : list of int
+        The number of frames in each file.
+    spec : str
+        The handler spec, e.g. 'NCEM_MRC'.
+    resource_kwargs : dict
+        Extra arguments for the handler (e.g. the data set number). frame_per_point is always 1 so
+        that databroker knows the shape of each datum without reading it.
+
+    """
+    seq_num = 1
+    for path, length in zip(paths, lengths):
+        path = Path(path).resolve()
+        resource_bundle = run_bundle.compose_resource(spec=spec, root=path.anchor,
+                                                      resource_path=str(path.relative_to(path.anchor)),
+                                                      resource_kwargs={'frame_per_point': 1, **(resource_kwargs or {})})
+        yield 'resource', resource_bundle.resource_doc
+
+        # The pages are not validated. That takes seconds per 100k frames.
+        datum_page = resource_bundle.compose_datum_page(datum_kwargs={'index': list(range(length))}, validate=False)
+        yield 'datum_page', datum_page
+
+        timestamps = [time.time()] * length
+        yield 'event_page', stream_bundle.compose_event_page(data={'raw': list(datum_page['datum_id'])},
+                                                             timestamps={'raw': timestamps},
+                                                             seq_num=list(range(seq_num, seq_num + length)),
+                                                             time=timestamps,
+                                                             filled={'raw': [False] * length},
+                                                             validate=False)
+        seq_num += length
+
+
+class FrameHandler:
+    """ A databroker handler that serves frames of a file by their index along the first axis.
+
+    Subclasses implement _open(path, **resource_kwargs) to return a lazy array of the file.
+
+    """
+
+    specs = set()
+
+    def __init__(self, resource_path, frame_per_point=1, **resource_kwargs):
+        self._path = resource_path
+        self._resource_kwargs = resource_kwargs
+        self._data = None
+        self._lock = threading.Lock()
+
+    def __call__(self, index):
+        with self._lock:
+            if self._data is None:
+                self._data = self._open(self._path, **self._resource_kwargs)
+        return np.asarray(self._data[index])
+
+    def get_file_list(self, datum_kwargs_gen):
+        return [self._path]
+
+    def _open(self, path, **resource_kwargs):
+        raise NotImplementedError
@@ -0,0 +1,117 @@
+""" Part of the NCEM plugin for Xicam to identify NCEM file formats from their first bytes.
+
+Xi-cam passes each sniffer the path and the first bytes of a file (usually 64) and uses the returned
+MIME type to choose an ingestor. The sniffers here classify files from those bytes:
+
+    - DM3/DM4: big-endian version 3 or 4 followed by the little-endian byte order flag
+    - SER: little-endian byte order 0x4949 and series ID 0x0197
+    - TIFF and BigTIFF: II*, MM*, II+ or MM+
+    - MRC: a plausible header (sizes and mode) and the MAP string at byte 208 or an MRC extension
+    - Berkeley and Velox EMD: the HDF5 signature plus one probe of the root group for the
+      version_major attribute (Berkeley) or the Version data set (Velox)
+
+Only the MRC and HDF5 checks read from the file. Their results are cached by file identity, and
+the HDF5 probe is kept in the on-disk metadata cache so that a directory is only probed once.
+
+"""
+
+import functools
+import struct
+from pathlib import Path
+
+import numpy as np
+
+from . import cache
+
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+TIFF_SIGNATURES = (b'II*\x00', b'MM\x00*', b'II+\x00', b'MM\x00+')
+MRC_EXTENSIONS = ('.mrc', '.rec', '.ali', '.st')
+MRC_MODES = (0, 1, 2, 3, 4, 6, 12, 16, 101)
+
+
+def _by_identity(func):
+    """ Cache func(path) in memory by the identity of the file at path"""
+
+    @functools.lru_cache(maxsize=16384)
+    def cached(identity):
+        return func(identity[0])
+
+    @functools.wraps(func)
+    def wrapper(path):
+        try:
+            identity = cache.file_identity(path)
+        except OSError:
+            return None
+        return cached(identity)
+
+    wrapper.cache_info = cached.cache_info
+    wrapper.cache_clear = cached.cache_clear
+    return wrapper
+
+
+def dm_sniffer(path, first_bytes):
+    if len(first_bytes) < 16:
+        return
+    version, = struct.unpack('>I', first_bytes[:4])
+    if version == 3:
+        byte_order, = struct.unpack('>I', first_bytes[8:12])
+    elif version == 4:
+        byte_order, = struct.unpack('>I', first_bytes[12:16])
+    else:
+        return
+    if byte_order == 1:
+        return 'application/x-DM'
+
+
+def ser_sniffer(path, first_bytes):
+    if len(first_bytes) >= 6 and first_bytes[:4] == b'II\x97\x01':
+        version, = struct.unpack('<H', first_bytes[4:6])
+        if version in (0x0210, 0x0220):
+            return 'application/x-SER'
+
+
+def tif_sniffer(path, first_bytes):
+    if first_bytes[:4] in TIFF_SIGNATURES:
+        return 'image/tiff'
+
+
+@_by_identity
+def _has_map_string(path):
+    with open(path, 'rb') as f:
+        f.seek(208)
+        return f.read(4) == b'MAP '
+
+
+def mrc_sniffer(path, first_bytes):
+    if len(first_bytes) < 40:
+        return
+    nx, ny, nz, mode, _, _, _, mx, my, mz = np.frombuffer(first_bytes[:40], dtype='<i4')
+    if not (0 < nx <= 2 ** 20 and 0 < ny <= 2 ** 20 and nz > 0 and mode in MRC_MODES):
+        return
+    if mx < 0 or my < 0 or mz < 0:
+        return
+    if Path(path).suffix.lower() in MRC_EXTENSIONS or _has_map_string(path):
+        return 'application/x-MRC'
+
+
+@cache.cached_metadata
+def _hdf5_mimetype(path):
+    import h5py
+
+    try:
+        with h5py.File(path, 'r') as f0:
+            if 'version_major' in f0.attrs:
+                return 'application/x-EMD'
+            elif 'Version' in f0:
+                return 'application/x-EMD-VELOX'
+    except OSError:
+        pass
+
+
+def emd_sniffer(path, first_bytes):
+    if first_bytes[:8] != HDF5_SIGNATURE:
+        return
+    try:
+        return _hdf5_mimetype(path)
+    except OSError:
+        return
@@ -0,0 +1,157 @@
+import numpy as np
+from qtpy.QtCore import *
+from qtpy.QtGui import *
+from qtpy.QtWidgets import QFileDialog, QToolBar
+
+from databroker.core import BlueskyRun
+
+#from xicam.core.data import NonDBHeader
+
+from xicam.plugins import GUIPlugin, GUILayout
+from . import widgets
+
+from xicam.gui.widgets.tabview import TabView
+from xicam.gui.widgets.metadataview import MetadataView
+
+from . import ingestors  # necessary unused import; registers mimetypes
+
+
+class NCEMPlugin(GUIPlugin):
+    name = 'NCEM'
+    sigLog = Signal(int, str, str, np.ndarray)
+
+    def __init__(self):
+        # Data model
+        self.catalogModel = QStandardItemModel()
+
+        # Selection model
+        self.selectionmodel = QItemSelectionModel(self.catalogModel)
+
+        # Setup TabViews
+        self.rawview = TabView(self.catalogModel, self.selectionmodel, widgets.NCEMViewerPlugin, 'primary', field='raw')
+
+        self.fftview = TabView(self.catalogModel, self.selectionmodel, widgets.FFTViewerPlugin, 'primary', field='raw')
+
+        #self.fourDview = TabView(self.headermodel, self.selectionmodel, widgets.FourDImageView, 'primary')
+
+        self.metadataview = MetadataView(self.catalogModel, self.selectionmodel, excludedkeys=('uid','descriptor','data'))
+
+        # self.toolbar = widgets.NCEMToolbar(self.catalogModel, self.selectionmodel)
+
+        # Thumbnails of the runs are made in the background and shown as item and tab icons
+        self.thumbnailLoader = widgets.ThumbnailLoader()
+        self.thumbnailLoader.sigIconChanged.connect(self._setTabIcons)
+
+        # Files followed during live acquisition (see followFile)
+        self._followers = []
+        self.followToolbar = QToolBar()
+        self.followAction = self.followToolbar.addAction('Follow File...', self._chooseFollowFile)
+        self.followAction.setToolTip('Show a file that is still being written and add its frames as they appear')
+        self.stopFollowingAction = self.followToolbar.addAction('Stop Following', self.stopFollowing)
+        self.stopFollowingAction.setEnabled(False)
+
+        self.stages = {
+            'View': GUILayout(self.rawview, right=self.metadataview, top=self.followToolbar),
+            # 'View': GUILayout(self.rawview, top=self.toolbar),
+            # '4D STEM': GUILayout(self.fourDview, ),
+            'FFT View': GUILayout(self.fftview, )
+        }
+        super(NCEMPlugin, self).__init__()
+
+    def appendCatalog(self, catalog: BlueskyRun, *args, **kwargs):
+
+        displayName = ""
+        if 'sample_name' in catalog.metadata['start']:
+            displayName = catalog.metadata['start']['sample_name']
+        elif 'scan_id' in catalog.metadata['start']:
+            displayName = f"Scan: {catalog.metadata['start']['scan_id']}"
+        else:
+            displayName = f"UID: {catalog.metadata['start']['uid']}"
+
+        item = QStandardItem()
+        item.setData(displayName, Qt.DisplayRole)
+        item.setData(catalog, Qt.UserRole)
+        self.catalogModel.appendRow(item)
+        self.catalogModel.dataChanged.emit(item.index(), item.index())
+        self.thumbnailLoader.request(item, catalog)
+
+    def _setTabIcons(self, row, icon):
+        for tabview in (self.rawview, self.fftview):
+            if row < tabview.count():
+                tabview.setTabIcon(row, icon)
+
+    def followFile(self, path, **kwargs):
+        """ Show a file that is still being written and add its frames as they appear.
+
+        The file is polled on a background thread (see xicam.NCEM.follow for the formats and the
+        keyword arguments). The run is shown once it has its first frames and the viewers are
+        extended with each later batch of frames. Returns the thread; cancel it to stop following.
+
+        """
+        from xicam.core.threads import QThreadFutureIterator
+        from .follow import follow
+
+        documents = []
+        item = []
+
+        def should_stop():
+            return thread.cancelled
+
+        def on_document(name, doc):
+            if item:
+                if name == 'event_page':
+                    self._appendFrames(item[0], doc['data']['raw'])
+                return
+            documents.append((name, doc))
+            if name == 'event_page':
+                item.append(self._appendLiveRun(documents))
+
+        def on_finished():
+            if thread in self._followers:
+                self._followers.remove(thread)
+            self.stopFollowingAction.setEnabled(bool(self._followers))
+
+        thread = QThreadFutureIterator(follow, path, should_stop=should_stop, callback_slot=on_document,
+                                       finished_slot=on_finished, showBusy=False, **kwargs)
+        self._followers.append(thread)
+        self.stopFollowingAction.setEnabled(True)
+        thread.start()
+        return thread
+
+    def stopFollowing(self):
+        """ Stop following all files. The runs stay open with the frames read so far."""
+        for thread in self._followers:
+            thread.cancel()
+        self._followers.clear()
+        self.stopFollowingAction.setEnabled(False)
+
+    def _chooseFollowFile(self):
+        path, _ = QFileDialog.getOpenFileName(None, 'Follow File', '',
+                                              'Live acquisition files (*.mrc *.tif *.tiff *.emd);;All files (*)')
+        if path:
+            self.followFile(path)
+
+    def _appendLiveRun(self, documents):
+        from databroker.in_memory import BlueskyInMemoryCatalog
+
+        start_doc = documents[0][1]
+        catalog = BlueskyInMemoryCatalog()
+        catalog.upsert(start_doc, None, lambda: iter(list(documents)), [], {})
+        self.appendCatalog(catalog[start_doc['uid']])
+        return QPersistentModelIndex(self.catalogModel.index(self.catalogModel.rowCount() - 1, 0))
+
+    def _appendFrames(self, index, frames):
+        if not index.isValid():  # the run was closed
+            return
+        for tabview in (self.rawview, self.fftview):
+            if index.row() < tabview.count():
+                widget = tabview.widget(index.row())
+                widget = getattr(widget, 'Rimageview', widget)
+                if hasattr(widget, 'appendFrames'):
+                    widget.appendFrames(frames)
+
+    def searchIndex(self, db_path=None, **filters):
+        """ Search the file index built by xicam.NCEM.indexer. See Index.search for the filters."""
+        from .indexer import Index
+        with Index(db_path) as index:
+            return index.search(**filters)
@@ -0,0 +1,161 @@
+""" Part of the NCEM plugin for Xicam to show very large frames at the resolution of the screen.
+
+Montages and 16k x 16k camera frames are far larger than the viewer widget. A FramePyramid holds
+power-of-two downsampled levels of the frames of a stack and reads only what is needed to draw
+the current view:
+
+    pyramid = FramePyramid(dask_data)
+    level = pyramid.level_for(data_pixels_per_screen_pixel)
+    if level == 0:
+        image, (y0, x0) = pyramid.region(t, y0, y1, x0, x1)  # visible full resolution tiles
+    else:
+        image = pyramid.frame(t, level)  # whole frame binned by 2 ** level
+
+Notes:
+    - Levels are block means over 2 ** level pixels on a side. They are built lazily the first
+      time they are shown, from the nearest finer level that is already cached or by streaming the
+      full resolution frame through dask.
+    - Full resolution data is only read for the visible region, rounded out to whole tiles.
+    - Levels and tiles of all frames share one least recently used cache of max_bytes.
+
+"""
+
+import math
+import threading
+from collections import OrderedDict
+
+import dask.array as da
+import numpy as np
+
+# Frames with more pixels than this are shown through a pyramid
+MIN_PIXELS = 2048 * 2048
+
+# The coarsest level has no side longer than this
+TOP_SIZE = 512
+
+# Full resolution regions are read in square tiles of this many pixels
+TILE_SIZE = 512
+
+# Approximate size of the dask blocks used to bin a full resolution frame
+BLOCK_BYTES = 32 * 1024 ** 2
+
+
+def _bin(frame, factor):
+    """ Block mean of a 2D numpy array over factor x factor pixels. Edge pixels that do not fill a
+    block are dropped."""
+    fy, fx = (min(factor, s) for s in frame.shape)
+    ny, nx = frame.shape[0] // fy * fy, frame.shape[1] // fx * fx
+    return frame[:ny, :nx].reshape(ny // fy, fy, nx // fx, fx).mean(axis=(1, 3), dtype=np.float32)
+
+
+def _bin_lazy(frame, factor):
+    """ Block mean of a (possibly lazy) 2D frame computed in blocks of whole rows"""
+    frame = da.asarray(frame)
+    fy, fx = (min(factor, s) for s in frame.shape)
+    ny, nx = frame.shape[0] // fy * fy, frame.shape[1] // fx * fx
+    rows = max(fy, BLOCK_BYTES // max(1, nx * frame.dtype.itemsize) // fy * fy)
+    frame = frame[:ny, :nx].rechunk((rows, nx))
+    return da.coarsen(np.mean, frame, {0: fy, 1: fx}).astype(np.float32).compute()
+
+
+class FramePyramid:
+    """ Lazily built power-of-two levels of the frames in a stack.
+
+    Parameters
+    ----------
+    data : dask.array.Array or numpy.ndarray
+        The frames as [t, y, x] or a single [y, x] frame.
+    max_bytes : int
+        The size of the cache of levels and tiles shared by all frames.
+
+    """
+
+    def __init__(self, data, max_bytes=256 * 1024 ** 2):
+        if data.ndim == 2:
+            data = data[None]
+        self.data = data
+        self.shape = tuple(int(s) for s in data.shape[-2:])
+        self.num_levels = 1 + max(0, math.ceil(math.log2(max(self.shape) / TOP_SIZE)))
+        self.max_bytes = max_bytes
+        self._cache = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def wanted(shape):
+        """ Whether frames of shape are large enough to be shown through a pyramid"""
+        return len(shape) >= 2 and shape[-2] * shape[-1] > MIN_PIXELS
+
+    def level_for(self, ratio):
+        """ The coarsest level that still has at least one pixel per screen pixel.
+
+        ratio is the number of full resolution pixels per screen pixel.
+
+        """
+        if not ratio > 1:
+            return 0
+        return min(self.num_levels - 1, int(math.floor(math.log2(ratio))))
+
+    def frame(self, t, level):
+        """ The whole frame t binned by 2 ** level as a numpy array"""
+        if level == 0:
+            return np.asarray(self.data[t])
+        key = (t, level)
+        cached = self._get(key)
+        if cached is not None:
+            return cached
+
+        # Start from the nearest finer level that is cached
+        for finer in range(level - 1, 0, -1):
+            source = self._get((t, finer))
+            if source is not None:
+                binned = _bin(source, 2 ** (level - finer))
+                break
+        else:
+            binned = _bin_lazy(self.data[t], 2 ** level)
+        self._put(key, binned)
+        return binned
+
+    def region(self, t, y0, y1, x0, x1):
+        """ The full resolution pixels of frame t that cover [y0:y1, x0:x1].
+
+        The region is rounded out to whole tiles and clipped to the frame.
+
+        Returns
+        -------
+        : tuple
+            (image, (y, x)) where y and x are the position of image in the frame.
+
+        """
+        ny, nx = self.shape
+        ty0, tx0 = (int(max(0, min(v, s - 1)) // TILE_SIZE * TILE_SIZE) for v, s in ((y0, ny), (x0, nx)))
+        ty1, tx1 = (int(min(s, max(v0 + 1, math.ceil(v / TILE_SIZE) * TILE_SIZE)))
+                    for v, v0, s in ((y1, ty0, ny), (x1, tx0, nx)))
+        key = (t, 0, ty0, ty1, tx0, tx1)
+        image = self._get(key)
+        if image is None:
+            image = np.asarray(self.data[t, ty0:ty1, tx0:tx1])
+            self._put(key, image)
+        return image, (ty0, tx0)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._nbytes = 0
+
+    def _get(self, key):
+        with self._lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self._cache.move_to_end(key)
+            return value
+
+    def _put(self, key, value):
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = value
+            self._nbytes += value.nbytes
+            while self._nbytes > self.max_bytes and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self._nbytes -= evicted.nbytes
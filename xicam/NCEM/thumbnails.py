@@ -0,0 +1,112 @@
+""" Part of the NCEM plugin for Xicam to make small preview images of runs.
+
+A thumbnail is a strided subsample of the first frame of a run scaled to 8 bits and saved as a
+grayscale PNG in the NCEM cache directory (see cache.thumbnail_path). Thumbnails are keyed by the
+identity of the file the run was read from, so they are made once per file:
+
+    path = thumbnails.thumbnail_for_run(run)
+
+Notes:
+    - Only every stride-th row and column of the first frame is read. The stride is chosen so
+      that the rows touched add up to at most MAX_READ_BYTES (4 MB by default) for memory mapped
+      formats. Compressed frames (e.g. TIFF pages) are decoded whole.
+    - Frames with more than two dimensions (4D-STEM data) use their first 2D pattern.
+    - The PNG is written without extra dependencies so the indexer can make thumbnails in its
+      worker processes.
+
+"""
+
+import math
+import os
+import struct
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from .ingestors import cache
+
+# Longest side of a thumbnail in pixels
+THUMBNAIL_SIZE = 128
+
+# Upper bound of the bytes read from a frame to make its thumbnail
+MAX_READ_BYTES = 4 * 1024 ** 2
+
+
+def _stride(shape, itemsize, size=THUMBNAIL_SIZE, max_bytes=MAX_READ_BYTES):
+    """ The subsampling step along both axes of a [y, x] frame"""
+    ny, nx = shape
+    stride = max(1, math.ceil(max(ny, nx) / size))
+    while math.ceil(ny / stride) * nx * itemsize > max_bytes and stride < ny:
+        stride *= 2
+    return stride
+
+
+def thumbnail_array(frame, size=THUMBNAIL_SIZE, max_bytes=MAX_READ_BYTES):
+    """ A uint8 subsample of a (possibly lazy) frame with no side longer than size"""
+    while frame.ndim > 2:
+        frame = frame[0]
+    stride = _stride(frame.shape, np.dtype(frame.dtype).itemsize, size, max_bytes)
+    image = np.asarray(frame[::stride, ::stride], dtype=np.float32)
+
+    # Clip the brightest and darkest 0.5% as for TEM data in the viewer
+    finite = image[np.isfinite(image)]
+    if finite.size == 0:
+        return np.zeros(image.shape, dtype=np.uint8)
+    low, high = np.percentile(finite, (0.5, 99.5))
+    if high <= low:
+        high = low + 1
+    image = np.nan_to_num((image - low) / (high - low), nan=0.0)
+    return (np.clip(image, 0, 1) * 255).astype(np.uint8)
+
+
+def write_png(path, image):
+    """ Write a 2D uint8 array as a grayscale PNG. The file is replaced atomically."""
+    height, width = image.shape
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    # Each row starts with filter type 0 (none)
+    rows = np.hstack([np.zeros((height, 1), dtype=np.uint8), np.ascontiguousarray(image, dtype=np.uint8)])
+    png = b'\x89PNG\r\n\x1a\n' + \
+        chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)) + \
+        chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)) + \
+        chunk(b'IEND', b'')
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name('{}.{}.tmp'.format(path.name, os.getpid()))
+    temp_path.write_bytes(png)
+    os.replace(str(temp_path), str(path))
+    return path
+
+
+def make_thumbnail(path, frame, size=THUMBNAIL_SIZE):
+    """ The cached thumbnail of the file at path, made from frame if it is not cached yet"""
+    thumbnail_path = cache.thumbnail_path(path)
+    if not thumbnail_path.exists():
+        write_png(thumbnail_path, thumbnail_array(frame, size))
+    return thumbnail_path
+
+
+def run_path(run):
+    """ The first file a run was read from or None"""
+    start_doc = run.metadata['start']
+    file_names = start_doc.get('FileNames') or [start_doc.get('FileName')]
+    if file_names[0] and Path(file_names[0]).exists():
+        return file_names[0]
+
+
+def thumbnail_for_run(run, size=THUMBNAIL_SIZE):
+    """ The cached thumbnail of the first frame stream of a BlueskyRun, or None if it has no file"""
+    path = run_path(run)
+    if path is None:
+        return None
+    thumbnail_path = cache.thumbnail_path(path)
+    if thumbnail_path.exists():
+        return thumbnail_path
+
+    stream_name = next(name for name in run if name.startswith('primary'))
+    frame = getattr(run, stream_name).to_dask()['raw'].data
+    return make_thumbnail(path, frame, size)
@@ -69,7 +69,7 @@ class FFTViewerPlugin(QWidgetPlugin):
         """
         # Get the frame data back from Rimageview (applies timeline slicing)
         try:
-            data = self.Rimageview.imageItem.image[::-1, :]
+            data = self.Rimageview.currentFrame()[::-1, :]
 
             scale0, units0 = self.Rimageview._get_physical_size()
 
@@ -83,7 +83,7 @@ class FFTViewerPlugin(QWidgetPlugin):
 
             # Unsure of the scale0 order with respect to x,y and w,h
             dataSlice = data[int(y / scale0[1]):int((y + h) / scale0[1]), int(x / scale0[0]):int((x + w) / scale0[0])]
-            fft = np.fft.fft2(dataSlice)
+            fft = np.fft.fft2(np.asarray(dataSlice))
             self.Fimageview.setImage(np.log(np.abs(np.fft.fftshift(fft)) + .001))
 
             self.Rroi.setPen(pg.mkPen('w'))
@@ -1,12 +1,19 @@
 from pathlib import Path
+import dask.array as da
 import numpy as np
+import xarray as xr
 
 from pyqtgraph import InfLineLabel
+from qtpy.QtCore import QTimer
+from qtpy.QtGui import QTransform
 from qtpy.QtWidgets import *
 
 from xicam.core import msg
 from xicam.gui.widgets.imageviewmixins import CatalogView, FieldSelector, StreamSelector, ExportButton, BetterButtons
 from .ncemimageview import NCEMCatalogView
+from ..ingestors import metrics
+from ..ingestors.chunking import stack_chunks
+from ..pyramid import FramePyramid
 
 
 class NCEMViewerPlugin(StreamSelector, FieldSelector, ExportButton, BetterButtons,
@@ -18,6 +25,15 @@ class NCEMViewerPlugin(StreamSelector, FieldSelector, ExportButton, BetterButton
         self.header = None
         self.field = None
 
+        # Very large frames are drawn from a pyramid at the resolution of the screen (see setImage)
+        self.pyramid = None
+        self._baseTransform = QTransform()
+
+        # Frames added by appendFrames and the lazy frames they follow
+        self._liveBase = None
+        self._liveBuffer = None
+        self._liveLength = 0
+
         # Add axes
         #self.axesItem = PlotItem()
         #self.axesItem.axes['left']['item'].setZValue(10)
@@ -27,6 +43,14 @@ class NCEMViewerPlugin(StreamSelector, FieldSelector, ExportButton, BetterButton
 
         super(NCEMViewerPlugin, self).__init__(**kwargs)
 
+        # Choose the pyramid level once panning and zooming pauses
+        self._levelTimer = QTimer(self)
+        self._levelTimer.setSingleShot(True)
+        self._levelTimer.setInterval(50)
+        self._levelTimer.timeout.connect(self._showPyramidLevel)
+        self.view.getViewBox().sigRangeChanged.connect(lambda *args: self._levelTimer.start())
+        self.view.getViewBox().sigResized.connect(lambda *args: self._levelTimer.start())
+
         if catalog:
             self.setCatalog(catalog, stream=stream, field=field)
 
@@ -37,6 +61,14 @@ class NCEMViewerPlugin(StreamSelector, FieldSelector, ExportButton, BetterButton
 
         self.imageItem.setOpts(axisOrder="row-major")
 
+        # Show 4D data sets [scan_y, scan_x, ky, kx] as a series of diffraction patterns
+        if self.xarray.ndim == 4:
+            data = self.xarray.data
+            self.xarray = xr.DataArray(data.reshape((-1, *data.shape[-2:])), dims=('dim_0', 'dim_1', 'dim_2'))
+        # Streams with one event per frame (e.g. followed files) are [time, y, x]
+        elif self.xarray.ndim == 3 and self.xarray.dims[0] == 'time':
+            self.xarray = xr.DataArray(self.xarray.data, dims=('dim_0', 'dim_1', 'dim_2'))
+
         # Set the physical scale on the xarray
         scale0, units0 = self._get_physical_size()
 
@@ -57,6 +89,133 @@ class NCEMViewerPlugin(StreamSelector, FieldSelector, ExportButton, BetterButton
         #self.axesItem.setLabel('bottom', text='X', units=units0[0])
         #self.axesItem.setLabel('left', text='Y', units=units0[1])
 
+    def setImage(self, img, autoRange=True, **kwargs):
+        """ Set the image and build a pyramid if its frames are too large to draw at full resolution"""
+        data = getattr(img, 'data', img)
+        self.pyramid = FramePyramid(data) if FramePyramid.wanted(img.shape) else None
+        self._baseTransform = None
+
+        super(NCEMViewerPlugin, self).setImage(img, autoRange=False, **kwargs)
+
+        # The transform from frame pixels to the view set by XArrayView
+        self._baseTransform = self.imageItem.transform()
+        if self.pyramid is not None:
+            # Start from the whole frame at the coarsest level so that auto range sees its full extent
+            self._showPyramidLevel(self.pyramid.num_levels - 1)
+        if autoRange:
+            self.view.getViewBox().autoRange()
+
+    def updateImage(self, autoHistogramRange=True):
+        # The time to show a frame includes reading it and scheduling the dask tasks (see metrics)
+        with metrics.measure('viewer', 'frame'):
+            self._updateImage(autoHistogramRange)
+
+    def _updateImage(self, autoHistogramRange):
+        if self.pyramid is None or self.image is None:
+            return super(NCEMViewerPlugin, self).updateImage(autoHistogramRange)
+
+        self.getProcessedImage()
+        if autoHistogramRange:
+            self.ui.histogram.setHistogramRange(self.levelMin, self.levelMax)
+        if self.axes['t'] is not None:
+            self.ui.roiPlot.show()
+        self._showPyramidLevel()
+
+    def quickMinMax(self, data):
+        if self.pyramid is not None:
+            # Estimate the levels from the coarsest level of the current frame
+            data = self.pyramid.frame(self._frameIndex(), self.pyramid.num_levels - 1)
+        return super(NCEMViewerPlugin, self).quickMinMax(data)
+
+    def appendFrames(self, frames):
+        """ Add frames [n, y, x] to the end of the series without resetting the view or the levels.
+
+        Used to show a file that is still being written (see xicam.NCEM.follow). If the last frame
+        was shown, the newest frame is shown instead. New frames are copied into a buffer that
+        doubles in size when it is full so each call costs time proportional to the new frames.
+
+        """
+        frames = np.asarray(frames)
+        if frames.ndim == 2:
+            frames = frames[None]
+        if len(frames) == 0 or self.xarray is None:
+            return
+
+        if self._liveBase is None:
+            self._liveBase = da.asarray(self.xarray.data)
+        length = self._liveLength + len(frames)
+        if self._liveBuffer is None or length > len(self._liveBuffer):
+            buffer = np.empty((max(16, 2 * length), *self._liveBase.shape[1:]), dtype=self._liveBase.dtype)
+            if self._liveBuffer is not None:
+                buffer[:self._liveLength] = self._liveBuffer[:self._liveLength]
+            self._liveBuffer = buffer
+        self._liveBuffer[self._liveLength:length] = frames
+        self._liveLength = length
+
+        live = self._liveBuffer[:length]
+        data = da.concatenate([self._liveBase,
+                               da.from_array(live, chunks=stack_chunks(live.shape, live.dtype), name=False)])
+        dims = self.xarray.dims
+        coords = {dim: self.xarray.coords[dim] for dim in dims[1:] if dim in self.xarray.coords}
+        self.xarray = xr.DataArray(data, dims=dims, coords=coords, attrs=self.xarray.attrs)
+        if self.pyramid is not None:
+            self.pyramid.data = data
+
+        if self.axes.get('t') is None:
+            # A single frame becomes a series
+            self.setImage(self.xarray, autoRange=False, autoLevels=False)
+            return
+
+        following = self.currentIndex == len(self.tVals) - 1
+        self.image = self.xarray
+        # Without normalization the displayed image is the image itself and the levels are kept
+        self.imageDisp = self.image if self.ui.normOffRadio.isChecked() else None
+
+        # Extend the timeline as ImageView.setImage does
+        self.tVals = np.arange(self.image.shape[0])
+        self.ui.roiPlot.setXRange(self.tVals.min(), self.tVals.max())
+        self.frameTicks.setXVals(self.tVals)
+        stop = self.tVals.max() + abs(self.tVals[-1] - self.tVals[0]) * 0.02
+        for s in [self.timeLine, self.normRgn]:
+            s.setBounds([self.tVals.min(), stop])
+
+        if following:
+            self.setCurrentIndex(len(self.tVals) - 1)
+
+    def currentFrame(self):
+        """ The current frame at full resolution. It is lazy when the frames are shown through a pyramid."""
+        if self.pyramid is not None:
+            return self.pyramid.data[self._frameIndex()]
+        return self.imageItem.image
+
+    def _frameIndex(self):
+        if self.axes.get('t') is None:
+            return 0
+        return getattr(self, 'currentIndex', 0)
+
+    def _showPyramidLevel(self, level=None):
+        """ Draw the pyramid level that matches the zoom. Zoomed in, only the visible tiles are read."""
+        if self.pyramid is None or self.image is None or self._baseTransform is None:
+            return
+        view_box = self.view.getViewBox()
+        inverse, invertible = self._baseTransform.inverted()
+        if not invertible:
+            return
+        visible = inverse.mapRect(view_box.viewRect())  # in frame pixels
+        if level is None:
+            level = self.pyramid.level_for(visible.width() / max(1., view_box.width()))
+
+        t = self._frameIndex()
+        if level == 0:
+            image, (y0, x0) = self.pyramid.region(t, visible.top(), visible.bottom(), visible.left(), visible.right())
+        else:
+            image, (y0, x0) = self.pyramid.frame(t, level), (0, 0)
+        scale = 2 ** level
+
+        self.imageItem.updateImage(image)
+        self.imageItem.setTransform(QTransform.fromScale(scale, scale) * QTransform.fromTranslate(x0, y0) *
+                                    self._baseTransform)
+
     def _get_physical_size(self):
         start_doc = getattr(self.catalog, self.stream).metadata['start']
         config = getattr(self.catalog, self.stream).metadata['descriptors'][0]['configuration']
@@ -2,5 +2,6 @@ from .FFTViewerPlugin import FFTViewerPlugin
 from .fourdimageview import FourDImageView
 from .NCEMToolbar import NCEMToolbar
 from .NCEMViewerPlugin import NCEMViewerPlugin
+from .thumbnailloader import ThumbnailLoader
 
-__all__ = ['FFTViewerPlugin', 'NCEMToolbar', 'NCEMViewerPlugin']
+__all__ = ['FFTViewerPlugin', 'NCEMToolbar', 'NCEMViewerPlugin', 'ThumbnailLoader']
@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from qtpy.QtCore import QObject, QModelIndex, QPersistentModelIndex, Qt, Signal
+from qtpy.QtGui import QIcon
+
+from xicam.core import msg
+from .. import thumbnails
+
+
+class ThumbnailLoader(QObject):
+    """ Makes the thumbnails of catalog items on a thread pool and sets them as the item icons.
+
+    Thumbnails are read from the on-disk cache or made from a subsample of the first frame (see
+    xicam.NCEM.thumbnails). Nothing is read on the GUI thread except the small PNG.
+
+    """
+
+    sigIconChanged = Signal(int, QIcon)  # row, icon
+    _sigThumbnail = Signal(object, str)  # QPersistentModelIndex, thumbnail path
+
+    def __init__(self, max_workers=2, parent=None):
+        super(ThumbnailLoader, self).__init__(parent)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        # Emitted from the worker threads and delivered on the GUI thread
+        self._sigThumbnail.connect(self._setIcon)
+
+    def request(self, item, catalog):
+        """ Make the thumbnail of catalog in the background and show it as the icon of item"""
+        self._executor.submit(self._load, QPersistentModelIndex(item.index()), catalog)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def _load(self, index, catalog):
+        try:
+            path = thumbnails.thumbnail_for_run(catalog)
+        except Exception as ex:
+            msg.logMessage('NCEM: No thumbnail for {}: {}'.format(catalog.metadata['start'].get('sample_name'), ex),
+                           level=msg.DEBUG)
+            return
+        if path is not None:
+            self._sigThumbnail.emit(index, str(path))
+
+    def _setIcon(self, index, path):
+        if not index.isValid():  # the item was removed
+            return
+        icon = QIcon(path)
+        index.model().setData(QModelIndex(index), icon, Qt.DecorationRole)
+        self.sigIconChanged.emit(index.row(), icon)